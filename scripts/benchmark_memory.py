@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import pandas as pd
+import pytz
+
+from turbot import COLLECTABLE_CATALOGS, COLLECTABLE_STORES, PRICES_COLS, open_storage
+
+
+def synthetic_guild(members, weeks, seed):
+    """Generates a reproducible guild's worth of prices and museum collections."""
+    rng = random.Random(seed)
+    start = datetime(2020, 4, 5, 9, tzinfo=pytz.utc)  # a sunday morning
+    rows = []
+    for week in range(weeks):
+        sunday = start + timedelta(weeks=week)
+        for author in range(1, members + 1):
+            rows.append([author, "buy", rng.randint(90, 110), sunday])
+            for half_day in range(12):  # a sell price every morning and afternoon
+                at = sunday + timedelta(days=1 + half_day // 2, hours=5 * (half_day % 2))
+                rows.append([author, "sell", rng.randint(20, 600), at])
+    prices = pd.DataFrame(columns=PRICES_COLS, data=rows)
+
+    collections = {}
+    for kind in COLLECTABLE_STORES:
+        catalog = sorted(COLLECTABLE_CATALOGS[kind])
+        collections[kind] = pd.DataFrame(
+            columns=["author", "name"],
+            data=[
+                [author, name]
+                for author in range(1, members + 1)
+                for name in rng.sample(catalog, rng.randint(0, len(catalog)))
+            ],
+        )
+    return prices, collections
+
+
+def mebibytes(data):
+    return data.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def timed(f):
+    start = perf_counter()
+    f()
+    return 1000 * (perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measures the memory used by the stores for a large synthetic guild."
+    )
+    parser.add_argument("-m", "--members", type=int, default=500)
+    parser.add_argument("-w", "--weeks", type=int, default=26)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    prices, collections = synthetic_guild(args.members, args.weeks, args.seed)
+    store = open_storage("memory")
+    store.prices.replace_prices(prices)
+    for kind, data in collections.items():
+        store.collection(kind).replace_collected(data)
+
+    # compare the stores to the same data kept with one python string per row
+    print(f"{'store':<8} {'rows':>9} {'strings MiB':>12} {'stored MiB':>11}")
+    loaded = {"prices": store.prices.load()}
+    loaded.update({kind: store.collection(kind).load() for kind in COLLECTABLE_STORES})
+    for name, data in loaded.items():
+        strings = data.astype({"kind" if name == "prices" else "name": object})
+        print(
+            f"{name:<8} {len(data):>9} {mebibytes(strings):>12.2f} "
+            f"{mebibytes(data):>11.2f}"
+        )
+
+    prices = loaded["prices"]
+    strings = prices.astype({"kind": object})
+    print(f"\n{'filter':<24} {'strings ms':>11} {'stored ms':>10}")
+    print(
+        f"{'kind == sell':<24} {timed(lambda: strings.kind == 'sell'):>11.2f} "
+        f"{timed(lambda: prices.kind == 'sell'):>10.2f}"
+    )
+    fossils = loaded["fossils"]
+    strings = fossils.astype({"name": object})
+    wanted = sorted(COLLECTABLE_CATALOGS["fossils"])[:10]
+    print(
+        f"{'fossil name isin':<24} {timed(lambda: strings.name.isin(wanted)):>11.2f} "
+        f"{timed(lambda: fossils.name.isin(wanted)):>10.2f}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from types import SimpleNamespace
+
+from turbot import FOSSILS_SET, Turbot, open_storage
+
+ENGINES = ["memory", "csv", "npz", "sqlite"]
+FOSSILS = sorted(FOSSILS_SET)
+
+
+class Member(SimpleNamespace):
+    def __str__(self):
+        return self.name
+
+
+def workload(members, count, seed):
+    """Generates a reproducible list of (command, author, params) to run."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        author = rng.choice(members)
+        roll = rng.random()
+        if roll < 0.40:
+            yield "sell", author, [str(rng.randint(20, 600))]
+        elif roll < 0.50:
+            yield "buy", author, [str(rng.randint(90, 110))]
+        elif roll < 0.60:
+            yield "collect", author, [", ".join(rng.sample(FOSSILS, 3))]
+        elif roll < 0.65:
+            yield "uncollect", author, [rng.choice(FOSSILS)]
+        elif roll < 0.75:
+            yield "history", author, []
+        elif roll < 0.85:
+            yield "bestsell", author, []
+        elif roll < 0.95:
+            yield "uncollected", author, []
+        else:
+            yield "oops", author, []
+
+
+def benchmark(engine, members, commands):
+    with TemporaryDirectory() as tmp:
+        bot = Turbot(
+            prices_file=f"{tmp}/prices.csv",
+            art_file=f"{tmp}/art.csv",
+            fish_file=f"{tmp}/fish.csv",
+            fossils_file=f"{tmp}/fossils.csv",
+            users_file=f"{tmp}/users.csv",
+            db_file=f"{tmp}/turbot.db",
+            storage=engine,
+        )
+        channel = SimpleNamespace(members=members)
+        timings = {}
+        for command, author, params in commands:
+            start = perf_counter()
+            getattr(bot, command)(channel, author, params)
+            timings.setdefault(command, []).append(perf_counter() - start)
+        bot.store.flush()
+
+        # then time a cold start loading all of that data back
+        if engine != "memory":
+            start = perf_counter()
+            store = open_storage(
+                engine,
+                prices_file=bot.prices_file,
+                art_file=bot.art_file,
+                fish_file=bot.fish_file,
+                fossils_file=bot.fossils_file,
+                users_file=bot.users_file,
+                db_file=bot.db_file,
+            )
+            store.prices.load()
+            store.users.load()
+            timings["(load)"] = [perf_counter() - start]
+        return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs the same command workload against each storage engine."
+    )
+    parser.add_argument("-m", "--members", type=int, default=200)
+    parser.add_argument("-n", "--commands", type=int, default=2000)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument(
+        "-e",
+        "--engine",
+        action="append",
+        choices=ENGINES,
+        help="benchmark this engine; use this multiple times to benchmark several",
+    )
+    args = parser.parse_args()
+
+    members = [Member(id=n + 1, name=f"user{n}", roles=[]) for n in range(args.members)]
+    commands = list(workload(members, args.commands, args.seed))
+
+    print(f"{'engine':<8} {'command':<12} {'calls':>6} {'mean ms':>9} {'max ms':>9}")
+    for engine in args.engine or ENGINES:
+        timings = benchmark(engine, members, commands)
+        for command, samples in sorted(timings.items()):
+            mean = 1000 * sum(samples) / len(samples)
+            worst = 1000 * max(samples)
+            print(
+                f"{engine:<8} {command:<12} {len(samples):>6} {mean:>9.3f} {worst:>9.3f}"
+            )
+        total = 1000 * sum(sum(samples) for samples in timings.values())
+        print(f"{engine:<8} {'TOTAL':<12} {len(commands):>6} {total:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,28 @@
+import asyncio
+import gzip
+import hashlib
 import inspect
 import json
 import logging
+import math
+import multiprocessing
+import os
 import random
 import re
+import sqlite3
 import sys
-from collections import defaultdict
+import threading
+import zipfile
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from contextlib import redirect_stdout
 from datetime import datetime, timedelta
-from io import StringIO
-from itertools import product
+from decimal import ROUND_DOWN, ROUND_UP, Decimal
+from functools import partial, wraps
+from io import BytesIO, StringIO
+from itertools import groupby, product
 from os import getenv
 from os.path import dirname, realpath
 from pathlib import Path
@@ -20,14 +34,12 @@ import dunamai as _dunamai
 import hupper
 import matplotlib
 import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import pytz
 from dateutil.relativedelta import relativedelta
 from humanize import naturaltime
-from turnips.archipelago import Archipelago
-from turnips.plots import plot_models_range
+from matplotlib.figure import Figure
 from yaml import load
 
 try:
@@ -63,10 +75,10 @@ DEFAULT_DB_PRICES = DB_DIR / "prices.csv"
 DEFAULT_DB_ART = DB_DIR / "art.csv"
 DEFAULT_DB_USERS = DB_DIR / "users.csv"
 DEFAULT_DB_FISH = DB_DIR / "fish.csv"
+DEFAULT_DB_SQLITE = DB_DIR / "turbot.db"
 
 # temporary application files
 TMP_DIR = RUNTIME_ROOT / "tmp"
-GRAPHCMD_FILE = TMP_DIR / "graphcmd.png"
 LASTWEEKCMD_FILE = TMP_DIR / "lastweek.png"
 
 with open(STRINGS_DATA_FILE) as f:
@@ -83,6 +95,32 @@ BUGS_SET = frozenset(BUGS.drop_duplicates(subset="name").name.tolist())
 ART_SET = frozenset(ART.drop_duplicates(subset="name").name.tolist())
 COLLECTABLE_SET = FOSSILS_SET | FISH_SET | BUGS_SET | ART_SET
 
+PRICES_COLS = ["author", "kind", "price", "timestamp"]
+PRICES_DTYPES = dict(
+    zip(
+        PRICES_COLS,
+        ["int64", pd.CategoricalDtype(["buy", "sell"]), "int64", "datetime64[ns, UTC]"],
+    )
+)
+
+# the periods of a week's timeline of turnip prices, starting with Sunday's buy price
+TIMELINE_PERIODS = [
+    "Sunday_AM",
+    "Monday_AM",
+    "Monday_PM",
+    "Tuesday_AM",
+    "Tuesday_PM",
+    "Wednesday_AM",
+    "Wednesday_PM",
+    "Thursday_AM",
+    "Thursday_PM",
+    "Friday_AM",
+    "Friday_PM",
+    "Saturday_AM",
+    "Saturday_PM",
+]
+SELLING_PERIODS = TIMELINE_PERIODS[1:]
+
 EMBED_LIMIT = 5  # more embeds in a row than this causes issues
 
 USER_PREFRENCES = [
@@ -95,6 +133,84 @@ USER_PREFRENCES = [
     "creator",
 ]
 
+USERS_COLS = ["author", *USER_PREFRENCES]
+USERS_DTYPES = dict(zip(USERS_COLS, ["int64", *["str"] * len(USER_PREFRENCES)]))
+
+# user collections of museum collectables, each stored as rows of author and name
+COLLECTABLE_STORES = ["art", "fish", "fossils"]
+COLLECTABLE_CATALOGS = {"art": ART_SET, "fish": FISH_SET, "fossils": FOSSILS_SET}
+COLLECTION_DTYPES = {
+    kind: {"author": "int64", "name": pd.CategoricalDtype(sorted(catalog))}
+    for kind, catalog in COLLECTABLE_CATALOGS.items()
+}
+
+STORAGE_BACKENDS = ["csv", "npz", "sqlite"]
+
+# the npz storage engine takes a new snapshot once its journal has this many prices
+DEFAULT_NPZ_JOURNAL_LIMIT = 1000
+
+# when buffering writes, flush them once this many changes are pending
+DEFAULT_FLUSH_THRESHOLD = 100
+
+# how many of the most recent price backups to keep
+DEFAULT_BACKUP_RETENTION = 12
+
+# how many commands can run at the same time
+DEFAULT_WORKERS = 4
+
+# how many graphs can be rendered at the same time
+DEFAULT_RENDER_WORKERS = 2
+
+# modes for !graph on busy servers and their default number of users or points
+GRAPH_MODES = {"top": 10, "sample": 100}
+
+# how many bytes of rendered graphs to keep cached
+DEFAULT_GRAPH_CACHE_SIZE = 32 * 1024 * 1024
+
+# how many turnip price predictions to keep cached
+DEFAULT_PREDICTION_CACHE_SIZE = 1024
+HISTORY_WEEKS = 4  # how many of the most recent closed weeks !history shows
+RENDER_WORKERS_START_TIMEOUT = 60  # seconds to wait for the render workers to start
+PREDICTION_CACHE_FORMAT = 2  # bump whenever the fields of a Prediction change
+
+# how often in seconds to archive prices older than the retention period, if one is set
+DEFAULT_RETENTION_INTERVAL = 24 * 60 * 60
+
+SQLITE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS prices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    author INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS prices_author ON prices (author);
+CREATE INDEX IF NOT EXISTS prices_author_kind_timestamp
+    ON prices (author, kind, timestamp);
+CREATE TABLE IF NOT EXISTS closed_prices (
+    week INTEGER NOT NULL,
+    author INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS closed_prices_week ON closed_prices (week);
+CREATE TABLE IF NOT EXISTS users (
+    author INTEGER PRIMARY KEY,
+    {", ".join(f"{pref} TEXT NOT NULL DEFAULT ''" for pref in USER_PREFRENCES)}
+);
+""" + "".join(
+    f"""
+CREATE TABLE IF NOT EXISTS {kind} (
+    author INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (author, name)
+);
+CREATE INDEX IF NOT EXISTS {kind}_author ON {kind} (author);
+"""
+    for kind in COLLECTABLE_STORES
+)
+
 # Based on values from datetime.isoweekday()
 DAYS = {
     "monday": 1,
@@ -167,6 +283,11 @@ def day_and_time(dt):
     return f"{day.title()} {am_pm}"
 
 
+def summary_price(price, missing="?"):
+    """Formats a price from a weekly summary, where it's missing if it wasn't logged."""
+    return missing if pd.isna(price) else str(int(price))
+
+
 def humanize_months(row):
     """Generator that humanizes months from row data where each month is a column."""
     ABBR = {
@@ -271,6 +392,2666 @@ def is_turbot_admin(channel, user_or_member):
     return any(role.name == "Turbot Admin" for role in member.roles) if member else False
 
 
+##############################
+# Storage Engines
+##############################
+
+# Turbot never touches its persisted data directly. Instead it goes through a store for
+# each kind of data that it keeps: prices, user preferences, and the art, fish and
+# fossil collections. The base store classes hold their data in memory and together
+# make up the in-memory storage engine. Other engines subclass them and override the
+# _read() hook to load their data and the _on_*() hooks to record each change.
+#
+# Recorded changes are persisted by _flush(). Normally that happens right away, but in
+# write-behind mode changes are buffered in memory until flush() is called. That lets
+# a burst of changes to any number of stores be written out to disk all at once.
+#
+# Commands run on a pool of worker threads, so each store has a lock that every public
+# method holds while it runs. Changes to a store are serialized but commands that use
+# different stores, or that spend their time outside of the stores, run concurrently.
+
+
+def synchronized(method):
+    """Decorates a store method to hold the store's lock while it runs."""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class Store:
+    """The base class for all stores."""
+
+    def __init__(self):
+        self._data = None  # do not use directly, load it from load()
+        self.pending = 0  # number of changes not yet persisted
+        self.write_behind = False  # when set, buffer changes until flush() is called
+        self.lock = threading.RLock()  # held by public methods, see synchronized()
+
+    def _changed(self):
+        """Records that there's a change to persist; persists it unless write-behind."""
+        self.pending += 1
+        if not self.write_behind:
+            self.flush()
+
+    def _flush(self):
+        """Persists all of the changes recorded since the last flush."""
+
+    @synchronized
+    def flush(self):
+        """Persists any buffered changes."""
+        if self.pending:
+            self._flush()
+            self.pending = 0
+
+
+class PriceStore(Store):
+    """Turnip prices logged by users.
+
+    Besides all of the prices, the store keeps an index of each author to a frame of just
+    their prices. It's updated as prices are appended and removed so that looking up one
+    user's prices never has to scan the prices of every other user.
+
+    Prices are partitioned by week. Only the open week is ever loaded; closing it with
+    close_week() sets it aside as it is, so older weeks never slow down the open one.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._journal = []  # labels and rows of prices appended since _data was built
+        self._by_author = None  # do not use directly, get it from _author_index()
+        self._next_label = 0  # index label of the next price to be appended
+        self._closed = {}  # prices of each closed week by week number
+        self._closed_index = {}  # closed week number to each author's prices in it
+        self._weeks_version = 0  # incremented whenever a week is closed or dropped
+        self.version = 0  # incremented on every change to the open week of prices
+
+    def _read(self):
+        """Reads all of the stored prices into a new DataFrame."""
+        return pd.read_csv(StringIO(""), names=PRICES_COLS, dtype=PRICES_DTYPES)
+
+    def _on_append(self, row):
+        """Records a newly appended row of price data."""
+
+    def _on_drop_last(self, author):
+        """Records the removal of the last price logged by the given author."""
+
+    def _on_clear(self, author):
+        """Records the removal of all prices logged by the given author."""
+
+    def _on_replace(self, data):
+        """Records the replacement of all stored prices with the given data."""
+
+    def _on_close_week(self, closed, carried):
+        """Records closing the week of prices closed with carried as the new week."""
+        self._closed[next_week(self.weeks())] = closed
+
+    @synchronized
+    def weeks(self):
+        """Returns the numbers of the closed weeks of prices, oldest first."""
+        return sorted(self._closed)
+
+    def _read_week(self, week):
+        """Reads the prices of the given closed week into a DataFrame.
+
+        Closed weeks never change, so this is called without holding the store's lock.
+        """
+        return self._closed[week]
+
+    @synchronized
+    def load_week(self, week):
+        """Returns the prices of the given closed week as a DataFrame."""
+        return self._read_week(week)
+
+    def closed_prices_for(self, author, weeks=None):
+        """Returns the given author's prices in each closed week, oldest first.
+
+        With weeks, only that many of the most recent closed weeks are included. Each
+        week's prices are indexed by author once they've been read. Weeks that haven't
+        been are read without holding the store's lock, so the open week isn't held up.
+        """
+        with self.lock:
+            closed = self.weeks()[-weeks:] if weeks else self.weeks()
+            self._closed_index = {
+                week: index
+                for week, index in self._closed_index.items()
+                if week in closed
+            }
+            indexed = dict(self._closed_index)
+            version = self._weeks_version
+        for week in closed:
+            if week not in indexed:
+                try:
+                    prices = self._read_week(week)
+                except (FileNotFoundError, KeyError):  # dropped by retention meanwhile
+                    continue
+                indexed[week] = dict(iter(prices.groupby(by="author", sort=False)))
+        with self.lock:
+            if version == self._weeks_version:  # no week has been closed or dropped
+                self._closed_index.update(indexed)
+        none = self._frame([], [])
+        return [indexed[week].get(author, none) for week in closed if week in indexed]
+
+    @synchronized
+    def drop_week(self, week):
+        """Removes the given closed week of prices."""
+        del self._closed[week]
+
+    @synchronized
+    def replace_weeks(self, weeks):
+        """Replaces every week of stored prices with the given weeks, oldest first.
+
+        Every week but the last one is closed and the last one is the open week.
+        """
+        *closed, last = weeks
+        for week in self.weeks():
+            self.drop_week(week)
+        self._closed_index.clear()
+        self._weeks_version += 1
+        for prices in closed:
+            self.replace_prices(prices)
+            self.close_week()
+        self.replace_prices(last)
+
+    def _frame(self, rows, labels):
+        return pd.DataFrame(columns=PRICES_COLS, data=rows, index=labels).astype(
+            PRICES_DTYPES
+        )
+
+    def _author_index(self):
+        """Returns a dict of each author to a DataFrame of the prices they've logged."""
+        if self._data is None or self._by_author is None:
+            prices = self.load()
+            self._by_author = dict(iter(prices.groupby(by="author", sort=False)))
+        return self._by_author
+
+    @synchronized
+    def load(self):
+        """Returns all of the stored prices as a DataFrame."""
+        if self._data is None:
+            self._data = self._read().astype(PRICES_DTYPES).reset_index(drop=True)
+            self._journal = []
+            self._by_author = None
+            self._next_label = len(self._data)
+        elif self._journal:  # fold in rows appended since the last load
+            labels, rows = zip(*self._journal)
+            journal = self._frame(list(rows), list(labels))
+            self._data = pd.concat([self._data, journal])
+            self._journal = []
+        return self._data
+
+    @synchronized
+    def prices_for(self, author, since=None):
+        """Returns the prices logged by the given author, optionally only after since."""
+        prices = self._author_index().get(author)
+        if prices is None:
+            return self._frame([], [])
+        if since is not None:
+            return prices[prices.timestamp > since]
+        return prices.copy()
+
+    @synchronized
+    def append_price(self, author, kind, price, at):
+        """Logs a price of the given kind for the given author at the given UTC time."""
+        self.load()  # stored prices must be read before any more are appended
+        row = [author, kind, price, pd.Timestamp(at)]
+        self.version += 1
+        label = self._next_label
+        self._next_label += 1
+        self._journal.append((label, row))
+        if self._by_author is not None:
+            prices = self._frame([row], [label])
+            if author in self._by_author:
+                prices = pd.concat([self._by_author[author], prices])
+            self._by_author[author] = prices
+        self._on_append(row)
+
+    @synchronized
+    def drop_last_price(self, author):
+        """Removes the last price logged by the given author."""
+        yours = self._author_index().get(author)
+        if yours is None:
+            return
+        self._data = self.load().drop(yours.index[-1:])
+        self.version += 1
+        if len(yours) > 1:
+            self._by_author[author] = yours.iloc[:-1]
+        else:
+            del self._by_author[author]
+        self._on_drop_last(author)
+
+    @synchronized
+    def clear_prices(self, author):
+        """Removes all of the prices logged by the given author."""
+        yours = self._author_index().pop(author, None)
+        if yours is not None:
+            self._data = self.load().drop(yours.index)
+            self.version += 1
+        self._on_clear(author)
+
+    def _reset(self, data):
+        self._data = data.astype(PRICES_DTYPES).reset_index(drop=True)
+        self.version += 1
+        self._journal = []
+        self._by_author = None
+        self._next_label = len(self._data)
+
+    @synchronized
+    def replace_prices(self, data):
+        """Replaces all of the stored prices with the given data."""
+        self._reset(data)
+        self._on_replace(self._data)
+
+    @synchronized
+    def close_week(self):
+        """Closes the open week of prices and returns the prices it had.
+
+        A new week is opened with the most recent buy price of each author carried
+        forward into it. The closed week can still be loaded with load_week().
+        """
+        self.flush()  # the closed week must include any buffered prices
+        closed = self.load()
+        buys = closed[closed.kind == "buy"].sort_values(by="timestamp")
+        self._reset(buys.loc[buys.groupby(by="author")["timestamp"].idxmax()])
+        self._on_close_week(closed, self._data)
+        week = self.weeks()[-1]
+        self._closed_index[week] = dict(iter(closed.groupby(by="author", sort=False)))
+        self._weeks_version += 1
+        return closed
+
+    @synchronized
+    def expire(self, before, archive):
+        """Removes prices logged before the given time, first passing them to archive.
+
+        Closed weeks are removed once all of their prices are before that time. Old
+        prices in the open week are removed too, except for the most recent buy price of
+        each author which is always kept, as close_week() does.
+        """
+        self.flush()  # the archive must include any buffered prices
+        weeks = []
+        expired = []
+        for week in self.weeks():
+            prices = self.load_week(week)
+            if prices.empty or prices.timestamp.max() < before:
+                weeks.append(week)
+                expired.append(prices)
+        prices = self.load()
+        buys = prices[prices.kind == "buy"].sort_values(by="timestamp")
+        latest = buys.groupby(by="author")["timestamp"].idxmax()
+        stale = prices[(prices.timestamp < before) & ~prices.index.isin(latest)]
+        expired.append(stale)
+        archive(pd.concat(expired, ignore_index=True).astype(PRICES_DTYPES))
+        for week in weeks:
+            self.drop_week(week)
+            self._closed_index.pop(week, None)
+        self._weeks_version += 1
+        if not stale.empty:
+            self.replace_prices(prices.drop(stale.index))
+        return weeks
+
+
+class UserPrefs:
+    """One user's preferences, keeping their timezone once it's been resolved."""
+
+    __slots__ = ["author", *USER_PREFRENCES, "_tz"]
+
+    def __init__(self, author, **prefs):
+        self.author = author
+        for pref in USER_PREFRENCES:
+            setattr(self, pref, prefs.get(pref, ""))
+        self._tz = None
+
+    def set(self, pref, value):
+        """Sets the given preference to the given value."""
+        setattr(self, pref, value)
+        if pref == "timezone":
+            self._tz = None
+
+    @property
+    def tz(self):
+        """The user's timezone as a tzinfo, or UTC if they haven't set one."""
+        if self._tz is None:
+            self._tz = pytz.timezone(self.timezone) if self.timezone else pytz.UTC
+        return self._tz
+
+    def as_dict(self):
+        """Returns a dict of just the preferences that have been set."""
+        prefs = {}
+        for pref in USER_PREFRENCES:
+            value = getattr(self, pref)
+            if value:
+                prefs[pref] = self.tz if pref == "timezone" else value
+        return prefs
+
+
+class UserStore(Store):
+    """User preferences, keyed by author."""
+
+    def _read(self):
+        """Reads all of the stored user preferences into a new DataFrame."""
+        return pd.read_csv(StringIO(""), names=USERS_COLS, dtype=USERS_DTYPES)
+
+    def _on_set_pref(self, author, pref, value):
+        """Records a change to one of the given author's preferences."""
+
+    def _on_replace(self, data):
+        """Records the replacement of all stored user preferences with the given data."""
+
+    def _records(self, data=None):
+        if data is not None or self._data is None:
+            users = (self._read() if data is None else data).fillna("")
+            self._data = {
+                int(row["author"]): UserPrefs(**row)
+                for row in users.astype(USERS_DTYPES).to_dict(orient="records")
+            }
+        return self._data
+
+    @synchronized
+    def load(self):
+        """Returns all of the stored user preferences as a DataFrame."""
+        rows = [
+            [prefs.author, *(getattr(prefs, pref) for pref in USER_PREFRENCES)]
+            for prefs in self._records().values()
+        ]
+        return pd.DataFrame(columns=USERS_COLS, data=rows).astype(USERS_DTYPES)
+
+    @synchronized
+    def authors(self):
+        """Returns a list of every author that has set any preferences."""
+        return list(self._records())
+
+    @synchronized
+    def prefs_for(self, author):
+        """Returns the given author's UserPrefs, or None if they've never set any."""
+        return self._records().get(author)
+
+    @synchronized
+    def set_pref(self, author, pref, value):
+        """Sets one of the given author's preferences to the given value."""
+        records = self._records()
+        if author not in records:
+            records[author] = UserPrefs(author)
+        records[author].set(pref, value)
+        self._on_set_pref(author, pref, value)
+
+    @synchronized
+    def replace_users(self, data):
+        """Replaces all of the stored user preferences with the given data."""
+        self._records(data)
+        self._on_replace(self.load())
+
+
+class CollectionStore(Store):
+    """Collectables that users have donated to their museum, by name."""
+
+    def __init__(self, kind):
+        super().__init__()
+        self.kind = kind
+        self.catalog = COLLECTABLE_CATALOGS[kind]  # every name that can be collected
+        self.dtypes = COLLECTION_DTYPES[kind]
+
+    def _read(self):
+        """Reads all of the stored collection data into a new DataFrame."""
+        return pd.DataFrame(columns=["author", "name"])
+
+    def _on_add(self, author, names):
+        """Records the addition of the given names to the author's collection."""
+
+    def _on_remove(self, author, names):
+        """Records the removal of the given names from the author's collection."""
+
+    def _on_replace(self, data):
+        """Records the replacement of all stored collection data with the given data."""
+
+    def _typed(self, data):
+        """Returns the given data with names as categories of the catalog."""
+        data = data.astype(self.dtypes)
+        unknown = data.name.isnull()
+        if unknown.any():
+            logging.warning("dropping %s unknown %s", unknown.sum(), self.kind)
+            data = data[~unknown]
+        return data
+
+    @synchronized
+    def load(self):
+        """Returns the collections of all users as a DataFrame of author and name."""
+        if self._data is None:
+            self._data = self._typed(self._read())
+        return self._data
+
+    @synchronized
+    def collected(self, author):
+        """Returns the set of names in the given author's collection."""
+        data = self.load()
+        return set(data[data.author == author].name.unique())
+
+    @synchronized
+    def count(self, author):
+        """Returns the number of names in the given author's collection."""
+        return len(self.collected(author))
+
+    @synchronized
+    def uncollected(self, author):
+        """Returns the set of names in the catalog that the author has not collected."""
+        return self.catalog - self.collected(author)
+
+    @synchronized
+    def add_collected(self, author, names):
+        """Adds the given names to the author's collection; returns the new names."""
+        added = set(names) - self.collected(author)
+        if added:
+            rows = pd.DataFrame(
+                columns=["author", "name"], data=[[author, name] for name in added]
+            )
+            self._data = self.load().append(self._typed(rows), ignore_index=True)
+            self._on_add(author, added)
+        return added
+
+    @synchronized
+    def remove_collected(self, author, names):
+        """Removes the given names from the author's collection; returns those removed."""
+        data = self.load()
+        removing = data[(data.author == author) & data.name.isin(names)]
+        removed = set(removing.name.unique())
+        if removed:
+            self._data = data.drop(removing.index)
+            self._on_remove(author, removed)
+        return removed
+
+    @synchronized
+    def replace_collected(self, data):
+        """Replaces all of the stored collection data with the given data."""
+        self._data = self._typed(data)
+        self._on_replace(self._data)
+
+
+class CorruptSnapshotError(Exception):
+    """Raised when a stored csv file does not match the checksum in its manifest."""
+
+
+# The csv stores never rewrite a file in place. Instead each snapshot is written to a
+# temporary file that is synced to disk and then renamed over the original, so that a
+# crash mid-write leaves either the old or the new file but never a truncated one. Next
+# to each file is a manifest with the size and checksum of its last snapshot, which is
+# verified when the file is loaded. The prices file may have rows appended after its
+# snapshot, so only the snapshot at the start of the file is covered by the checksum.
+
+
+def manifest_path(path):
+    """Returns the path of the manifest for the csv file at the given path."""
+    path = Path(path)
+    return path.with_name(f"{path.name}.manifest")
+
+
+def _sync_dir(path):
+    """Flushes a rename within the given directory to disk, where that's supported."""
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _atomic_write(path, content):
+    """Replaces the file at the given path with the given bytes all at once."""
+    path = Path(path)
+    temp = path.with_name(f".{path.name}.tmp")
+    with open(temp, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+    _sync_dir(path.parent)
+
+
+def _checksum(content):
+    return {"size": len(content), "sha256": hashlib.sha256(content).hexdigest()}
+
+
+def write_snapshot(path, data):
+    """Atomically replaces the csv file at the given path with the given data."""
+    _write_verified(path, data.to_csv(index=False).encode())
+
+
+def write_npz_snapshot(path, data, dtypes, **extra):
+    """Atomically replaces the npz file at the given path with the given data.
+
+    Each column is saved as its own typed array: strings as fixed width unicode,
+    categoricals as their integer codes and categories, and timestamps as nanoseconds
+    since the epoch, so that loading them needs no parsing. Any extra keyword arguments
+    are saved alongside the columns as arrays.
+    """
+    columns = {}
+    for col, dtype in dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            values = data[col].astype(dtype).cat
+            columns[col] = values.codes.to_numpy()
+            columns[f"{col}.categories"] = values.categories.to_numpy(dtype=str)
+        elif dtype.startswith("datetime64"):
+            columns[col] = data[col].values.astype("int64")
+        elif dtype in ("object", "str"):
+            columns[col] = data[col].to_numpy(dtype=str)
+        else:
+            columns[col] = data[col].to_numpy(dtype=dtype)
+    buffer = BytesIO()
+    np.savez(buffer, **columns, **extra)
+    _write_verified(path, buffer.getvalue())
+
+
+def read_npz_snapshot(path, dtypes):
+    """Returns the data in the npz file at the given path and a dict of its extras."""
+    verify_snapshot(path)
+    with np.load(path, allow_pickle=False) as npz:
+        arrays = {key: npz[key] for key in npz.files}
+    data = pd.DataFrame(index=pd.RangeIndex(len(arrays[next(iter(dtypes))])))
+    for col, dtype in dtypes.items():
+        values = arrays.pop(col)
+        if isinstance(dtype, pd.CategoricalDtype):
+            categories = arrays.pop(f"{col}.categories")
+            data[col] = pd.Categorical.from_codes(values, categories).astype(dtype)
+        elif dtype.startswith("datetime64"):
+            data[col] = pd.to_datetime(values, utc=True)
+        elif dtype in ("object", "str"):
+            data[col] = values.astype(object)
+        else:
+            data[col] = values
+    return data, arrays
+
+
+def _write_verified(path, content):
+    path = Path(path)
+
+    # The manifest is written first and lists the checksum of the previous snapshot as
+    # well, so a crash between the two renames still leaves a file that verifies.
+    checksums = [_checksum(content)]
+    if path.exists():
+        with open(path, "rb") as f:
+            checksums.append(_checksum(f.read()))
+    _atomic_write(manifest_path(path), json.dumps(checksums).encode())
+    _atomic_write(path, content)
+
+
+def verify_snapshot(path):
+    """Raises CorruptSnapshotError if the file at path doesn't match its manifest."""
+    manifest = manifest_path(path)
+    if not manifest.exists():  # files from before manifests existed are trusted as is
+        return
+    with open(path, "rb") as f:
+        content = f.read()
+    for checksum in json.loads(manifest.read_text()):
+        if _checksum(content[: checksum["size"]]) == checksum:
+            return
+    raise CorruptSnapshotError(
+        f"{path} does not match the checksum in {manifest}; restore it from a backup "
+        "or remove the manifest to load it anyway"
+    )
+
+
+def ends_with_newline(path):
+    """Returns True if the file at path is empty or its last line is complete."""
+    with open(path, "rb") as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def remove_snapshot(path):
+    """Removes the snapshot at the given path along with its manifest."""
+    for stale in [Path(path), manifest_path(path)]:
+        if stale.exists():
+            stale.unlink()
+
+
+def closed_weeks_dir(path):
+    """Returns the directory for closed weeks of the prices stored at the given path."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}-weeks")
+
+
+def next_week(weeks):
+    """Returns the number for the next week to be closed after the given weeks."""
+    return max(weeks, default=-1) + 1
+
+
+# Every timestamp that the price journal is written with, to the second and in UTC.
+COMPLETE_TIMESTAMP = re.compile(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(\.\d+)?\+00:00")
+
+
+class CsvPriceStore(PriceStore):
+    """Prices in a csv file that's used as an append-only journal of new prices."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.weeks_dir = closed_weeks_dir(path)
+        self._unwritten = []  # appended rows not yet written to the journal
+        self._rewrite = False  # rows were removed so the whole file must be rewritten
+
+    def _read(self):
+        if not Path(self.path).exists():
+            return super()._read()
+        verify_snapshot(self.path)
+        raw = pd.read_csv(self.path, names=PRICES_COLS, dtype=str, skiprows=1)
+        timestamps = pd.to_datetime(raw.timestamp, errors="coerce", utc=True)
+        valid = (
+            raw.author.str.fullmatch(r"\d+", na=False)
+            & raw.kind.isin(PRICES_DTYPES["kind"].categories)
+            & raw.price.str.fullmatch(r"\d+", na=False)
+            & timestamps.notnull()
+        )
+
+        # A crash while appending leaves a partially written row at the end of the file,
+        # without a newline. Its timestamp may still parse, like 10:0 for 10:00, so it's
+        # only kept if it's as complete as the timestamps the journal is written with.
+        finished = ends_with_newline(self.path)
+        if not finished and len(raw):
+            last = str(raw.timestamp.iloc[-1])
+            valid.iloc[-1] &= COMPLETE_TIMESTAMP.fullmatch(last) is not None
+
+        data = raw[valid].astype({"author": "int64", "price": "int64"})
+        data["timestamp"] = timestamps[valid]
+        data = data.reset_index(drop=True)
+        torn = (~valid).sum()
+        if torn:
+            logging.warning("dropping %s torn rows from the price log", torn)
+        elif not finished:
+            logging.debug("restoring the newline at the end of the price log")
+        if torn or not finished:  # appending needs the file to end with a newline
+            write_snapshot(self.path, data.astype(PRICES_DTYPES))
+        return data
+
+    def _on_append(self, row):
+        self._unwritten.append(row)
+        self._changed()
+
+    def _on_drop_last(self, author):
+        self._rewrite = True
+        self._changed()
+
+    def _on_clear(self, author):
+        self._rewrite = True
+        self._changed()
+
+    def _on_replace(self, data):
+        self._rewrite = True
+        self._changed()
+
+    def _on_close_week(self, closed, carried):
+        # The closed week is written before the new week replaces it, even when writes
+        # are buffered. A crash in between leaves the week both closed and open, which
+        # loses nothing, where moving the file would lose the carried buys.
+        path = self.weeks_dir / f"{next_week(self.weeks()):04d}.csv"
+        self.weeks_dir.mkdir(parents=True, exist_ok=True)
+        write_snapshot(path, closed)
+        write_snapshot(self.path, carried)
+        self._unwritten = []
+        self._rewrite = False
+
+    @synchronized
+    def weeks(self):
+        return sorted(int(path.stem) for path in self.weeks_dir.glob("*.csv"))
+
+    def _read_week(self, week):
+        path = self.weeks_dir / f"{week:04d}.csv"
+        if not path.exists():
+            raise FileNotFoundError(path)
+        return CsvPriceStore(path).load()
+
+    @synchronized
+    def drop_week(self, week):
+        remove_snapshot(self.weeks_dir / f"{week:04d}.csv")
+
+    def _flush(self):
+        if self._rewrite:
+            write_snapshot(self.path, self.load())
+        else:
+            # New prices are written to the end of the csv file in a single write rather
+            # than rewriting the whole file. Removing any prices does rewrite it however.
+            path = Path(self.path)
+            needs_header = not path.exists() or path.stat().st_size == 0
+            lines = [f"{','.join(PRICES_COLS)}\n"] if needs_header else []
+            for row in self._unwritten:
+                lines.append(f"{','.join(str(value) for value in row)}\n")
+            with open(path, "a") as f:
+                f.write("".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+        self._unwritten = []
+        self._rewrite = False
+
+
+class CsvUserStore(UserStore):
+    """User preferences in a csv file that's rewritten on every flush."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def _read(self):
+        if not Path(self.path).exists():
+            return super()._read()
+        verify_snapshot(self.path)
+        return pd.read_csv(self.path, names=USERS_COLS, skiprows=1)
+
+    def _on_set_pref(self, author, pref, value):
+        self._changed()
+
+    def _on_replace(self, data):
+        self._changed()
+
+    def _flush(self):
+        write_snapshot(self.path, self.load())
+
+
+class CsvCollectionStore(CollectionStore):
+    """Collection data in a csv file that's rewritten on every flush."""
+
+    def __init__(self, kind, path):
+        super().__init__(kind)
+        self.path = path
+
+    def _read(self):
+        if not Path(self.path).exists():
+            return super()._read()
+        verify_snapshot(self.path)
+        return pd.read_csv(self.path)
+
+    def _on_add(self, author, names):
+        self._changed()
+
+    def _on_remove(self, author, names):
+        self._changed()
+
+    def _on_replace(self, data):
+        self._changed()
+
+    def _flush(self):
+        write_snapshot(self.path, self._data)
+
+
+# The npz storage engine keeps binary snapshots that load with next to no parsing, which
+# matters for cold starts with a long price history. New prices are still appended to a
+# small csv journal between snapshots. Each snapshot records the generation of its
+# journal, so a journal left over from before a crash is never replayed twice.
+
+
+class NpzPriceStore(PriceStore):
+    """Prices in an npz snapshot plus a csv journal of prices appended since."""
+
+    def __init__(self, path, seed=None, journal_limit=DEFAULT_NPZ_JOURNAL_LIMIT):
+        super().__init__()
+        self.path = Path(path)
+        self.seed = seed  # store to import prices from when there's no snapshot yet
+        self.journal_limit = journal_limit  # take a new snapshot past this many rows
+        self.weeks_dir = closed_weeks_dir(path)
+        self._log = None  # csv store for the journal of the current generation
+        self._generation = 0
+        self._rewrite = False
+
+    def _log_path(self, generation):
+        return self.path.with_name(f"{self.path.stem}.journal-{generation}.csv")
+
+    def _open_log(self, generation):
+        self._log = CsvPriceStore(self._log_path(generation))
+        self._log.write_behind = True  # the journal is flushed by this store
+        self._generation = generation
+
+    def _read(self):
+        if self.path.exists():
+            data, extra = read_npz_snapshot(self.path, PRICES_DTYPES)
+            self._open_log(int(extra["generation"]))
+            return pd.concat([data, self._log.load()], ignore_index=True)
+        self._open_log(0)
+        if self.seed is not None:
+            data = self.seed.load()
+            write_npz_snapshot(self.path, data, PRICES_DTYPES, generation=0)
+            return data
+        return super()._read()
+
+    def _on_append(self, row):
+        self._log.append_price(*row)
+        self._changed()
+
+    def _on_drop_last(self, author):
+        self._rewrite = True
+        self._changed()
+
+    def _on_clear(self, author):
+        self._rewrite = True
+        self._changed()
+
+    def _on_replace(self, data):
+        if self._log is None:  # make sure the current generation is known
+            self._read()
+        self._rewrite = True
+        self._changed()
+
+    def _on_close_week(self, closed, carried):
+        path = self.weeks_dir / f"{next_week(self.weeks()):04d}.npz"
+        self.weeks_dir.mkdir(parents=True, exist_ok=True)
+        write_npz_snapshot(path, closed, PRICES_DTYPES)
+        self._rewrite = True
+        self._changed()
+
+    @synchronized
+    def weeks(self):
+        return sorted(int(path.stem) for path in self.weeks_dir.glob("*.npz"))
+
+    def _read_week(self, week):
+        path = self.weeks_dir / f"{week:04d}.npz"
+        return read_npz_snapshot(path, PRICES_DTYPES)[0]
+
+    @synchronized
+    def drop_week(self, week):
+        remove_snapshot(self.weeks_dir / f"{week:04d}.npz")
+
+    def _flush(self):
+        self._log.flush()
+        if self._rewrite or len(self._log.load()) >= self.journal_limit:
+            stale = self._log.path
+            generation = self._generation + 1
+            write_npz_snapshot(
+                self.path, self.load(), PRICES_DTYPES, generation=generation
+            )
+            self._open_log(generation)
+            if stale.exists():
+                stale.unlink()
+        self._rewrite = False
+
+
+class NpzUserStore(UserStore):
+    """User preferences in an npz snapshot that's rewritten on every flush."""
+
+    def __init__(self, path, seed=None):
+        super().__init__()
+        self.path = Path(path)
+        self.seed = seed  # store to import preferences from when there's no snapshot
+
+    def _read(self):
+        if self.path.exists():
+            return read_npz_snapshot(self.path, USERS_DTYPES)[0]
+        if self.seed is not None:
+            return self.seed.load()
+        return super()._read()
+
+    def _on_set_pref(self, author, pref, value):
+        self._changed()
+
+    def _on_replace(self, data):
+        self._changed()
+
+    def _flush(self):
+        write_npz_snapshot(self.path, self.load(), USERS_DTYPES)
+
+
+class BitsetCollectionStore(CollectionStore):
+    """Collection data as a bitmask per user, saved to an npz snapshot on every flush.
+
+    Every item in the catalog for the kind of collectables gets a bit, so membership,
+    counts and differences are all bitwise operations on a user's mask. Snapshots save
+    the masks as arrays of 64 bit words along with the catalog they were built from, so
+    they still load correctly after items are added to or removed from the catalog.
+    """
+
+    def __init__(self, kind, path, seed=None):
+        super().__init__(kind)
+        self.path = Path(path)
+        self.seed = seed  # store to import collections from when there's no snapshot
+        self.names = sorted(self.catalog)  # the item for each bit of a mask
+        self.bits = {name: 1 << ordinal for ordinal, name in enumerate(self.names)}
+        self.complete = (1 << len(self.names)) - 1  # the mask of a complete collection
+
+    def _mask(self, names):
+        mask = 0
+        for name in names:
+            mask |= self.bits[name]
+        return mask
+
+    def _names(self, mask):
+        return {name for name, bit in self.bits.items() if mask & bit}
+
+    def _masks_from(self, data):
+        masks = {}
+        unknown = data[~data.name.isin(self.catalog)]
+        if not unknown.empty:
+            logging.warning("dropping %s unknown %s", len(unknown), self.kind)
+        for author, names in data.drop(unknown.index).groupby(by="author").name:
+            masks[int(author)] = self._mask(names)
+        return masks
+
+    def _read_masks(self):
+        if not self.path.exists():
+            return self._masks_from(self.seed.load() if self.seed else super()._read())
+
+        verify_snapshot(self.path)
+        with np.load(self.path, allow_pickle=False) as npz:
+            authors, words, names = npz["authors"], npz["words"], npz["names"]
+        masks = {}
+        for author, row in zip(authors.tolist(), words.tolist()):
+            mask = 0
+            for n, word in enumerate(row):
+                mask |= word << (64 * n)
+            masks[author] = mask
+        if names.tolist() != self.names:  # the catalog changed so renumber the bits
+            saved = dict(enumerate(names.tolist()))
+            for author, mask in masks.items():
+                items = [saved[i] for i in range(len(saved)) if mask >> i & 1]
+                masks[author] = self._mask(name for name in items if name in self.bits)
+        return masks
+
+    def _masks(self):
+        if self._data is None:
+            self._data = self._read_masks()
+        return self._data
+
+    @synchronized
+    def load(self):
+        rows = []
+        for author, mask in self._masks().items():
+            rows.extend([author, name] for name in sorted(self._names(mask)))
+        return pd.DataFrame(columns=["author", "name"], data=rows).astype(self.dtypes)
+
+    @synchronized
+    def collected(self, author):
+        return self._names(self._masks().get(author, 0))
+
+    @synchronized
+    def count(self, author):
+        return bin(self._masks().get(author, 0)).count("1")
+
+    @synchronized
+    def uncollected(self, author):
+        return self._names(self.complete & ~self._masks().get(author, 0))
+
+    @synchronized
+    def add_collected(self, author, names):
+        masks = self._masks()
+        mask = masks.get(author, 0)
+        added = self._mask(names) & ~mask
+        if added:
+            masks[author] = mask | added
+            self._on_add(author, self._names(added))
+        return self._names(added)
+
+    @synchronized
+    def remove_collected(self, author, names):
+        masks = self._masks()
+        mask = masks.get(author, 0)
+        removed = self._mask(names) & mask
+        if removed:
+            masks[author] = mask & ~removed
+            self._on_remove(author, self._names(removed))
+        return self._names(removed)
+
+    @synchronized
+    def replace_collected(self, data):
+        self._data = self._masks_from(data)
+        self._on_replace(data)
+
+    def _on_add(self, author, names):
+        self._changed()
+
+    def _on_remove(self, author, names):
+        self._changed()
+
+    def _on_replace(self, data):
+        self._changed()
+
+    def _flush(self):
+        masks = self._masks()
+        width = max(1, -(-len(self.names) // 64))  # words needed for the whole catalog
+        words = np.array(
+            [
+                [mask >> (64 * n) & 0xFFFFFFFFFFFFFFFF for n in range(width)]
+                for mask in masks.values()
+            ],
+            dtype="uint64",
+        ).reshape(len(masks), width)
+        buffer = BytesIO()
+        np.savez(
+            buffer,
+            authors=np.array(list(masks), dtype="int64"),
+            words=words,
+            names=np.array(self.names, dtype=str),
+        )
+        _write_verified(self.path, buffer.getvalue())
+
+
+class SqliteDatabase:
+    """A lazily opened connection to the sqlite database shared by the sqlite stores.
+
+    Statements run by execute() and replace() are left in an open transaction until
+    commit(), so all of the changes made by all of the stores are committed together.
+    Queries use the same connection so they always see uncommitted changes.
+    """
+
+    def __init__(self, path, seed=None):
+        self.path = path
+        self.seed = seed  # storage to import data from when the database is created
+        self._connection = None  # do not use directly, get it from connect()
+        self.lock = threading.RLock()  # the connection is shared by every sqlite store
+
+    @synchronized
+    def connect(self):
+        """Returns the database connection, creating the database if needed."""
+        if self._connection is None:
+            fresh = not Path(self.path).exists()
+            self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._connection.executescript(SQLITE_SCHEMA)
+            if fresh and self.seed:
+                self._import(self.seed)
+        return self._connection
+
+    def _import(self, storage):
+        self.replace("prices", storage.prices.load())
+        self.replace("users", storage.users.load())
+        for kind in COLLECTABLE_STORES:
+            self.replace(kind, storage.collection(kind).load())
+        self.commit()
+
+    @synchronized
+    def execute(self, statement, rows):
+        """Runs the given statement once for each of the given rows without committing."""
+        self.connect().executemany(statement, rows)
+
+    @synchronized
+    def replace(self, table, data):
+        """Replaces all of the rows in the table with the data without committing."""
+        if table == "prices":  # timestamps are stored as nanoseconds since the epoch
+            data = data.assign(timestamp=data.timestamp.values.astype("int64"))
+        cols = ", ".join(data.columns)
+        marks = ", ".join("?" * len(data.columns))
+        self.execute(f"DELETE FROM {table}", [()])
+        self.execute(
+            f"INSERT INTO {table} ({cols}) VALUES ({marks})", data.values.tolist()
+        )
+
+    @synchronized
+    def commit(self):
+        """Commits all of the changes made since the last commit in one transaction."""
+        self.connect().commit()
+
+    @synchronized
+    def query(self, statement, params=()):
+        """Returns the results of the given query as a DataFrame."""
+        return pd.read_sql_query(statement, self.connect(), params=params)
+
+
+class SqlitePriceStore(PriceStore):
+    """Prices in a sqlite table indexed by author, kind and timestamp."""
+
+    SELECT = "SELECT author, kind, price, timestamp FROM prices"
+
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+
+    def _query(self, statement, params=()):
+        data = self.db.query(statement, params)
+        data["timestamp"] = pd.to_datetime(data.timestamp, utc=True)
+        return data.astype(PRICES_DTYPES)
+
+    def _read(self):
+        return self._query(f"{self.SELECT} ORDER BY id")
+
+    def _on_append(self, row):
+        author, kind, price, at = row
+        self.db.execute(
+            "INSERT INTO prices (author, kind, price, timestamp) VALUES (?, ?, ?, ?)",
+            [(author, kind, price, at.value)],
+        )
+        self._changed()
+
+    def _on_drop_last(self, author):
+        self.db.execute(
+            "DELETE FROM prices WHERE id = (SELECT MAX(id) FROM prices WHERE author = ?)",
+            [(author,)],
+        )
+        self._changed()
+
+    def _on_clear(self, author):
+        self.db.execute("DELETE FROM prices WHERE author = ?", [(author,)])
+        self._changed()
+
+    def _on_replace(self, data):
+        self.db.replace("prices", data)
+        self._changed()
+
+    def _on_close_week(self, closed, carried):
+        self.db.execute(
+            "INSERT INTO closed_prices (week, author, kind, price, timestamp) "
+            "SELECT ?, author, kind, price, timestamp FROM prices ORDER BY id",
+            [(next_week(self.weeks()),)],
+        )
+        self.db.replace("prices", carried)
+        self._changed()
+
+    @synchronized
+    def weeks(self):
+        weeks = self.db.query("SELECT DISTINCT week FROM closed_prices ORDER BY week")
+        return weeks.week.tolist()
+
+    def _read_week(self, week):
+        return self._query(
+            "SELECT author, kind, price, timestamp FROM closed_prices "
+            "WHERE week = ? ORDER BY rowid",
+            (week,),
+        )
+
+    @synchronized
+    def drop_week(self, week):
+        self.db.execute("DELETE FROM closed_prices WHERE week = ?", [(week,)])
+        self._changed()
+
+    def _flush(self):
+        self.db.commit()
+
+
+class SqliteUserStore(UserStore):
+    """User preferences in a sqlite table keyed by author."""
+
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+
+    def _read(self):
+        return self.db.query(f"SELECT {', '.join(USERS_COLS)} FROM users ORDER BY rowid")
+
+    def _on_set_pref(self, author, pref, value):
+        self.db.execute(
+            f"INSERT INTO users (author, {pref}) VALUES (?, ?) "
+            f"ON CONFLICT (author) DO UPDATE SET {pref} = excluded.{pref}",
+            [(author, value)],
+        )
+        self._changed()
+
+    def _on_replace(self, data):
+        self.db.replace("users", data)
+        self._changed()
+
+    def _flush(self):
+        self.db.commit()
+
+
+class SqliteCollectionStore(CollectionStore):
+    """Collection data in a sqlite table keyed by author and name."""
+
+    def __init__(self, kind, db):
+        super().__init__(kind)
+        self.db = db
+
+    def _read(self):
+        return self.db.query(f"SELECT author, name FROM {self.kind} ORDER BY rowid")
+
+    def _on_add(self, author, names):
+        self.db.execute(
+            f"INSERT OR IGNORE INTO {self.kind} (author, name) VALUES (?, ?)",
+            [(author, name) for name in names],
+        )
+        self._changed()
+
+    def _on_remove(self, author, names):
+        self.db.execute(
+            f"DELETE FROM {self.kind} WHERE author = ? AND name = ?",
+            [(author, name) for name in names],
+        )
+        self._changed()
+
+    def _on_replace(self, data):
+        self.db.replace(self.kind, data)
+        self._changed()
+
+    def _flush(self):
+        self.db.commit()
+
+
+class Storage:
+    """The stores that make up one storage engine for all of turbot's data."""
+
+    def __init__(self, prices, users, art, fish, fossils):
+        self.prices = prices
+        self.users = users
+        self.art = art
+        self.fish = fish
+        self.fossils = fossils
+
+    @property
+    def stores(self):
+        return [self.prices, self.users, self.art, self.fish, self.fossils]
+
+    @property
+    def pending(self):
+        """The number of changes across all stores that have not been persisted yet."""
+        return sum(store.pending for store in self.stores)
+
+    def collection(self, kind):
+        """Returns the collection store for the given kind of collectables."""
+        return getattr(self, kind)
+
+    def set_write_behind(self, enabled):
+        """Enables or disables buffering of changes until the next flush()."""
+        for store in self.stores:
+            store.write_behind = enabled
+        if not enabled:
+            self.flush()
+
+    def flush(self):
+        """Persists the buffered changes of every store together."""
+        for store in self.stores:
+            store.flush()
+
+    def copy_to(self, other):
+        """Replaces all of the data in the other storage with the data in this one."""
+        other.prices.replace_prices(self.prices.load())
+        other.users.replace_users(self.users.load())
+        for kind in COLLECTABLE_STORES:
+            other.collection(kind).replace_collected(self.collection(kind).load())
+        other.flush()
+
+
+def open_storage(
+    engine,
+    prices_file=DEFAULT_DB_PRICES,
+    art_file=DEFAULT_DB_ART,
+    fish_file=DEFAULT_DB_FISH,
+    fossils_file=DEFAULT_DB_FOSSILS,
+    users_file=DEFAULT_DB_USERS,
+    db_file=DEFAULT_DB_SQLITE,
+):
+    """Returns a Storage using the given engine: "csv", "npz", "sqlite" or "memory".
+
+    The npz and sqlite engines import any existing csv files when they're first used.
+    """
+    if engine == "memory":
+        return Storage(
+            prices=PriceStore(),
+            users=UserStore(),
+            art=CollectionStore("art"),
+            fish=CollectionStore("fish"),
+            fossils=CollectionStore("fossils"),
+        )
+
+    csv = Storage(
+        prices=CsvPriceStore(prices_file),
+        users=CsvUserStore(users_file),
+        art=CsvCollectionStore("art", art_file),
+        fish=CsvCollectionStore("fish", fish_file),
+        fossils=CsvCollectionStore("fossils", fossils_file),
+    )
+    if engine == "csv":
+        return csv
+
+    if engine == "npz":
+        return Storage(
+            prices=NpzPriceStore(Path(prices_file).with_suffix(".npz"), seed=csv.prices),
+            users=NpzUserStore(Path(users_file).with_suffix(".npz"), seed=csv.users),
+            art=BitsetCollectionStore(
+                "art", Path(art_file).with_suffix(".npz"), seed=csv.art
+            ),
+            fish=BitsetCollectionStore(
+                "fish", Path(fish_file).with_suffix(".npz"), seed=csv.fish
+            ),
+            fossils=BitsetCollectionStore(
+                "fossils", Path(fossils_file).with_suffix(".npz"), seed=csv.fossils
+            ),
+        )
+
+    if engine == "sqlite":
+        db = SqliteDatabase(db_file, seed=csv)
+        return Storage(
+            prices=SqlitePriceStore(db),
+            users=SqliteUserStore(db),
+            art=SqliteCollectionStore("art", db),
+            fish=SqliteCollectionStore("fish", db),
+            fossils=SqliteCollectionStore("fossils", db),
+        )
+
+    raise ValueError(f"unknown storage engine: {engine}")
+
+
+##############################
+# Price Retention
+##############################
+
+# Raw prices older than the retention period are moved out of the price store into
+# compressed files in the archive, one per week. For each week the archive also keeps a
+# summary per user of their buy price, their best sell price and their timeline of
+# sell prices, which is all that !history shows for weeks that have been archived.
+
+TIMELINE_SLOTS = [
+    f"{day}_{half}"
+    for day in ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday"]
+    for half in ["am", "pm"]
+]
+SUMMARY_COLS = ["author", "week", "buy", "best", *TIMELINE_SLOTS]
+
+
+def week_of(timestamps):
+    """Returns the date of the sunday that starts the week of each given timestamp."""
+    dates = timestamps.dt.tz_convert(pytz.utc).dt.normalize()
+    return (dates - pd.to_timedelta((dates.dt.weekday + 1) % 7, unit="D")).dt.date
+
+
+class PriceArchive:
+    """Compressed weekly files of expired prices, with weekly summaries for each user."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._summaries = None  # do not use directly, get them from summaries()
+
+    @property
+    def summaries_file(self):
+        return self.path / "summaries.csv"
+
+    def _week_file(self, week):
+        return self.path / f"prices-{week:%Y-%m-%d}.csv.gz"
+
+    def load_week(self, week):
+        """Returns the archived prices for the week starting on the given sunday."""
+        with gzip.open(self._week_file(week), "rt") as f:
+            data = pd.read_csv(f)
+        data["timestamp"] = pd.to_datetime(data.timestamp, utc=True)
+        return data.astype(PRICES_DTYPES)
+
+    def summaries(self):
+        """Returns the weekly summaries of every user as a DataFrame."""
+        if self._summaries is None:
+            if self.summaries_file.exists():
+                verify_snapshot(self.summaries_file)
+                self._summaries = pd.read_csv(self.summaries_file, parse_dates=["week"])
+                self._summaries["week"] = self._summaries.week.dt.date
+            else:
+                self._summaries = pd.DataFrame(columns=SUMMARY_COLS)
+        return self._summaries
+
+    def summaries_for(self, author):
+        """Returns the weekly summaries for the given author, oldest week first."""
+        summaries = self.summaries()
+        return summaries[summaries.author == author].sort_values(by="week")
+
+    def summarize(self, week, prices, timezone_for):
+        """Returns a summary of each user's prices in the given week."""
+        rows = []
+        for author, yours in prices.groupby(by="author"):
+            buys = yours[yours.kind == "buy"].sort_values(by="timestamp")
+            sells = yours[yours.kind == "sell"].sort_values(by="timestamp")
+            timeline = [None] * len(TIMELINE_SLOTS)
+            local = sells.timestamp.dt.tz_convert(timezone_for(author))
+            for at, price in zip(local, sells.price):
+                if at.isoweekday() != DAYS["sunday"]:
+                    timeline[(at.isoweekday() - 1) * 2 + (at.hour >= 12)] = price
+            rows.append(
+                [
+                    author,
+                    week,
+                    buys.price.iloc[-1] if not buys.empty else None,
+                    sells.price.max() if not sells.empty else None,
+                    *timeline,
+                ]
+            )
+        return pd.DataFrame(columns=SUMMARY_COLS, data=rows)
+
+    def save(self, prices, timezone_for=lambda author: pytz.utc):
+        """Archives the given prices into their weeks and updates those week's summaries.
+
+        Archiving the same prices again is harmless, so that prices which were archived
+        just before a crash, but not yet removed from the price store, aren't doubled.
+        """
+        if prices.empty:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        summaries = self.summaries()
+        for week, rows in prices.groupby(week_of(prices.timestamp)):
+            if self._week_file(week).exists():
+                rows = pd.concat([self.load_week(week), rows], ignore_index=True)
+                rows = rows.drop_duplicates().sort_values(by="timestamp", kind="stable")
+            content = rows.to_csv(index=False).encode()
+            _atomic_write(self._week_file(week), gzip.compress(content, mtime=0))
+            summaries = pd.concat(
+                [
+                    summaries[summaries.week != week],
+                    self.summarize(week, rows, timezone_for),
+                ],
+                ignore_index=True,
+            )
+        self._summaries = summaries.sort_values(by=["week", "author"], kind="stable")
+        write_snapshot(self.summaries_file, self._summaries)
+
+
+##############################
+# Price Backups
+##############################
+
+# Each backup of the prices has every closed week of prices in the store, as one run of
+# rows per week. Runs are stored compressed under the hash of their contents, so a week
+# that's in more than one backup is only ever stored once. A backup itself is just a
+# small manifest listing the hashes of its weeks in order.
+
+
+class PriceBackups:
+    """Compressed, content addressed backups of the prices in the given directory.
+
+    With keep as None every backup is kept.
+    """
+
+    def __init__(self, path, keep=DEFAULT_BACKUP_RETENTION):
+        if keep is not None and keep < 1:
+            raise ValueError(f"must keep at least one backup, not {keep}")
+        self.path = Path(path)
+        self.keep = keep  # how many of the most recent backups to keep
+
+    @property
+    def objects(self):
+        return self.path / "objects"
+
+    def backups(self):
+        """Returns the paths of all the backup manifests, oldest first."""
+
+        def taken(manifest):  # manifests are named prices-Y-m-d-HMS[-n].json
+            parts = manifest.stem.split("-")
+            return parts[1:5], int(parts[5]) if len(parts) > 5 else 0
+
+        return sorted(self.path.glob("prices-*.json"), key=taken)
+
+    def _find(self, backup):
+        if backup is None or backup == "latest":
+            backups = self.backups()
+            if not backups:
+                raise FileNotFoundError(f"there are no backups in {self.path}")
+            return backups[-1]
+        path = Path(backup)
+        if path.exists():
+            return path
+        if (self.path / path.name).exists():
+            return self.path / path.name
+        names = ", ".join(manifest.name for manifest in self.backups()) or "none"
+        raise click.BadParameter(
+            f"there's no backup {backup}, the backups are: {names}",
+            param_hint="'--restore-backup'",
+        )
+
+    def save(self, weeks):
+        """Backs up the given weeks of prices, oldest first, to a new backup manifest.
+
+        Returns the path of the manifest.
+        """
+        self.objects.mkdir(parents=True, exist_ok=True)
+        hashes = []
+        for week in weeks:
+            content = week.to_csv(index=False).encode()
+            digest = hashlib.sha256(content).hexdigest()
+            blob = self.objects / f"{digest}.csv.gz"
+            if not blob.exists():
+                _atomic_write(blob, gzip.compress(content, mtime=0))
+            hashes.append(digest)
+
+        now = datetime.now(pytz.utc)
+        stem = now.strftime("prices-%Y-%m-%d-%H%M%S")
+        manifest = self.path / f"{stem}.json"
+        n = 1
+        while manifest.exists():  # never overwrite a backup taken in the same second
+            manifest = self.path / f"{stem}-{n}.json"
+            n += 1
+        rows = sum(len(week) for week in weeks)
+        backup = {"created": now.isoformat(), "rows": rows, "objects": hashes}
+        _atomic_write(manifest, json.dumps(backup, indent=2).encode())
+        self.prune()
+        return manifest
+
+    def restore(self, backup=None):
+        """Returns the weeks of prices in the given backup, or in the latest backup."""
+        manifest = json.loads(self._find(backup).read_text())
+        weeks = []
+        for digest in manifest["objects"]:
+            content = gzip.decompress((self.objects / f"{digest}.csv.gz").read_bytes())
+            if hashlib.sha256(content).hexdigest() != digest:
+                raise CorruptSnapshotError(f"backup object {digest} is corrupt")
+            week = pd.read_csv(BytesIO(content))
+            week["timestamp"] = pd.to_datetime(week.timestamp, utc=True)
+            weeks.append(week.astype(PRICES_DTYPES))
+        return weeks
+
+    def prune(self):
+        """Removes all but the most recent backups and any objects no longer used."""
+        backups = self.backups()
+        for manifest in backups[: -self.keep] if self.keep is not None else []:
+            manifest.unlink()
+        used = set()
+        for manifest in self.backups():
+            used.update(json.loads(manifest.read_text())["objects"])
+        for blob in self.objects.glob("*.csv.gz"):
+            if blob.name[: -len(".csv.gz")] not in used:
+                blob.unlink()
+
+
+##############################
+# Timelines
+##############################
+
+# A user's timeline is their Sunday buy price followed by their selling price in each
+# half day of the week after it, in their own timezone. Predictions and their graphs
+# are made from timelines, so rather than working each one out from all of the user's
+# prices every time it's needed, they're kept up to date as prices are logged.
+#
+# Timelines are only changed through the index when prices are changed through it too.
+# Any other change to the prices, like the retention period archiving old ones, drops
+# every timeline and they're rebuilt from the prices as they're next needed.
+
+
+class Timeline:
+    """One user's timeline, along with what's needed to add prices to it as they come.
+
+    Only a buy on a Sunday starts a timeline, which then has the latest price logged in
+    each of the selling periods after it. A timeline's prices are only current for 12
+    days after its buy.
+    """
+
+    __slots__ = ["tz", "prices", "bought_at", "latest"]
+
+    def __init__(self, tz):
+        self.tz = tz
+        self.prices = [None] * len(TIMELINE_PERIODS)
+        self.bought_at = None  # when the user last bought, whether or not on a Sunday
+        self.latest = None  # when the latest of the user's prices was logged
+
+    def add(self, kind, price, at):
+        """Adds a price logged at the given time; False if it's older than the latest."""
+        if self.latest is not None and at < self.latest:
+            return False
+        self.latest = at
+        local = at.tz_convert(self.tz)
+        day = local.isoweekday()
+        if kind == "buy":
+            self.bought_at = at
+            self.prices = [None] * len(TIMELINE_PERIODS)
+            if day == DAYS["sunday"]:
+                self.prices[0] = int(price)
+        elif self.prices[0] is not None and at > self.bought_at and day != DAYS["sunday"]:
+            self.prices[(day - 1) * 2 + (local.hour >= 12) + 1] = int(price)
+        return True
+
+    def close_week(self):
+        """Keeps only the buy, which is all that closing the week of prices carries."""
+        self.prices = [self.prices[0]] + [None] * len(SELLING_PERIODS)
+        self.latest = self.bought_at
+
+    def read(self, now):
+        """Returns the timeline's prices as a list as of the given time."""
+        if self.bought_at is None or self.bought_at <= now - timedelta(days=12):
+            return [None] * len(TIMELINE_PERIODS)
+        return list(self.prices)
+
+
+class TimelineIndex:
+    """Each user's timeline, kept up to date as prices are changed through the index.
+
+    The index uses the lock of the prices, so that a timeline and the prices it's from
+    are always changed together.
+    """
+
+    def __init__(self, prices_for, timezone_for):
+        self.prices_for = prices_for  # returns the PriceStore
+        self.timezone_for = timezone_for
+        self._timelines = {}
+        self._synced = (None, None)  # the PriceStore and version the index is up to
+
+    def _sync(self, prices):
+        """Drops every timeline if the prices changed other than through the index."""
+        store, version = self._synced
+        if store is not prices or version != prices.version:
+            self._timelines.clear()
+            self._synced = (prices, prices.version)
+
+    def _build(self, prices, user_ids):
+        """Returns new timelines for the given users from one pass over their prices."""
+        past = datetime.now(pytz.utc) - timedelta(days=12)
+        if len(user_ids) == 1:
+            recent = prices.prices_for(user_ids[0], since=past)
+        else:
+            recent = prices.load()
+            recent = recent[recent.author.isin(user_ids) & (recent.timestamp > past)]
+        recent = recent.sort_values(by="timestamp", kind="stable")
+        timelines = {user: Timeline(self.timezone_for(user)) for user in user_ids}
+
+        # the day of the week and the hour of each price in its author's timezone
+        zones = recent.author.map({user: str(t.tz) for user, t in timelines.items()})
+        weekday = pd.Series(0, index=recent.index)
+        hour = pd.Series(0, index=recent.index)
+        for _, group in recent.groupby(zones):
+            local = group.timestamp.dt.tz_convert(timelines[group.author.iloc[0]].tz)
+            weekday[group.index] = local.dt.dayofweek + 1
+            hour[group.index] = local.dt.hour
+
+        # only the most recent buy counts, and only if it's on a sunday
+        buys = recent[recent.kind == "buy"].drop_duplicates("author", keep="last")
+        sunday = weekday[buys.index] == DAYS["sunday"]
+        for author, price, at, on_sunday in zip(
+            buys.author, buys.price, buys.timestamp, sunday
+        ):
+            timelines[author].bought_at = at
+            if on_sunday:
+                timelines[author].prices[0] = int(price)
+        bought_at = recent.author.map(buys[sunday].set_index("author").timestamp)
+        sells = recent[
+            (recent.kind == "sell")
+            & (recent.timestamp > bought_at)
+            & (weekday != DAYS["sunday"])  # no sells allowed on sundays
+        ]
+        slots = (weekday[sells.index] - 1) * 2 + (hour[sells.index] >= 12) + 1
+        sells = sells.assign(slot=slots).drop_duplicates(["author", "slot"], keep="last")
+        for author, slot, price in zip(sells.author, sells.slot, sells.price):
+            timelines[author].prices[slot] = int(price)
+
+        for author, at in recent.groupby(by="author").timestamp.max().items():
+            timelines[author].latest = at
+        return timelines
+
+    def get_many(self, user_ids):
+        """Returns a dict of each given user id to their timeline as a list."""
+        now = pd.Timestamp(datetime.now(pytz.utc))
+        prices = self.prices_for()
+        with prices.lock:
+            self._sync(prices)
+            timelines = self._timelines
+            missing = [user for user in dict.fromkeys(user_ids) if user not in timelines]
+            if missing:
+                timelines.update(self._build(prices, missing))
+            return {user_id: timelines[user_id].read(now) for user_id in user_ids}
+
+    def get(self, user_id):
+        """Returns the given user's timeline as a list."""
+        return self.get_many([user_id])[user_id]
+
+    def append_price(self, author, kind, price, at):
+        """Logs a price for the given author, adding it to their timeline."""
+        prices = self.prices_for()
+        with prices.lock:
+            self._sync(prices)
+            prices.append_price(author, kind, price, at)
+            self._synced = (prices, prices.version)
+            timeline = self._timelines.get(author)
+            if timeline is not None and not timeline.add(kind, price, pd.Timestamp(at)):
+                del self._timelines[author]  # rebuilt from the prices when next needed
+
+    def drop_last_price(self, author):
+        """Removes the given author's last price, rebuilding their timeline."""
+        prices = self.prices_for()
+        with prices.lock:
+            self._sync(prices)
+            prices.drop_last_price(author)
+            self._synced = (prices, prices.version)
+            self._timelines.pop(author, None)
+
+    def clear_prices(self, author):
+        """Removes all of the given author's prices, emptying their timeline."""
+        prices = self.prices_for()
+        with prices.lock:
+            self._sync(prices)
+            prices.clear_prices(author)
+            self._synced = (prices, prices.version)
+            self._timelines[author] = Timeline(self.timezone_for(author))
+
+    def close_week(self):
+        """Closes the open week of prices, leaving only each timeline's buy."""
+        prices = self.prices_for()
+        with prices.lock:
+            self._sync(prices)
+            closed = prices.close_week()
+            self._synced = (prices, prices.version)
+            for timeline in self._timelines.values():
+                timeline.close_week()
+            return closed
+
+    def forget(self, author):
+        """Drops the given author's timeline, like when they change their timezone."""
+        with self.prices_for().lock:
+            self._timelines.pop(author, None)
+
+
+##############################
+# Best Prices
+##############################
+
+# The best prices logged in the last 12 hours are kept in an index, rather than found
+# by scanning all of the prices, because during the busiest hours of the market lots
+# of people ask for them over and over. Like the timeline index, the best price index
+# is only updated as prices are appended to the store. Other changes to the prices are
+# rare and the index is simply rebuilt after them.
+
+
+class BestPrices:
+    """The best price of each author of each kind logged in the last 12 hours.
+
+    The prices of each kind are kept in the order they were logged at, so that they're
+    expired from the front as the window moves on. Each author's prices are also kept
+    sorted, to find their best one. A ranking of only the prices that are the best of
+    their author's means that reading the best prices doesn't look at any others.
+    """
+
+    def __init__(self, prices_for):
+        self.prices_for = prices_for  # returns the PriceStore
+        self._synced = (None, None)  # the PriceStore and version the index is up to
+        self._cutoff = None  # prices logged at or before this have been expired
+        self._label = 0  # orders prices logged at the same time
+        self._window = defaultdict(list)  # kind to (at, label, author, price)
+        self._by_author = defaultdict(list)  # kind and author to (price, at, label)
+        self._ranking = defaultdict(list)  # kind to (rank, at, label, author, price)
+
+    def _unrank(self, kind, author):
+        """Removes the given author's best prices from the ranking."""
+        ranking = self._ranking[kind]
+        for row in self._bests(kind, author):
+            del ranking[bisect_left(ranking, row)]
+
+    def _rank(self, kind, author):
+        """Adds the given author's best prices to the ranking."""
+        for row in self._bests(kind, author):
+            insort(self._ranking[kind], row)
+
+    def _bests(self, kind, author):
+        """Returns the ranking rows of all of the author's prices that tie for best."""
+        yours = self._by_author.get((kind, author), [])
+        rows = []
+        for price, at, label in reversed(yours):
+            if price != yours[-1][0]:
+                break
+            rank = price if kind == "buy" else -price  # lower ranks are listed first
+            rows.append((rank, at, label, author, price))
+        return rows
+
+    def _add(self, author, kind, price, at):
+        if self._cutoff is not None and at <= self._cutoff:
+            return
+        self._label += 1
+        insort(self._window[kind], (at, self._label, author, price))
+        self._unrank(kind, author)
+        insort(self._by_author[(kind, author)], (price, at, self._label))
+        self._rank(kind, author)
+
+    def _expire(self, now):
+        cutoff = now - timedelta(hours=12)
+        for kind, window in self._window.items():
+            expired = bisect_right(window, (cutoff, math.inf))
+            for at, label, author, price in window[:expired]:
+                self._unrank(kind, author)
+                yours = self._by_author[(kind, author)]
+                del yours[bisect_left(yours, (price, at, label))]
+                if yours:
+                    self._rank(kind, author)
+                else:
+                    del self._by_author[(kind, author)]
+            del window[:expired]
+        self._cutoff = cutoff
+
+    def _rebuild(self, prices, now):
+        self._synced = (prices, prices.version)
+        self._cutoff = None
+        self._window.clear()
+        self._by_author.clear()
+        self._ranking.clear()
+        recent = prices.load()
+        recent = recent[recent.timestamp > now - timedelta(hours=12)]
+        for author, kind, price, at in zip(
+            recent.author, recent.kind, recent.price, recent.timestamp
+        ):
+            self._add(author, kind, int(price), at)
+
+    def appended(self, author, kind, price, at):
+        """Adds a price that was just appended to the prices, while holding their lock."""
+        prices = self.prices_for()
+        store, version = self._synced
+        if store is prices and version == prices.version - 1:
+            self._add(author, kind, int(price), pd.Timestamp(at))
+            self._synced = (prices, prices.version)
+
+    def best(self, kind):
+        """Returns the author, price and time of the best prices of the given kind."""
+        now = pd.Timestamp(datetime.now(pytz.utc))
+        prices = self.prices_for()
+        with prices.lock:
+            store, version = self._synced
+            if (
+                store is not prices
+                or version != prices.version
+                or now - timedelta(hours=12) < self._cutoff  # the clock went back
+            ):
+                self._rebuild(prices, now)
+            self._expire(now)
+            ranking = self._ranking[kind]
+            return [(author, price, at) for _, at, _, author, price in ranking]
+
+
+##############################
+# Predictions
+##############################
+
+# Predicting an island's prices means finding every model of the turnip price patterns
+# that fits its timeline. A model is one of the four patterns along with its parameters,
+# like which period its spike starts in. Each period's price is the buy price times a
+# multiplier from a range that depends on the pattern's phase, and in decaying phases
+# the range is relative to the multiplier of the period before. Every model of every
+# island being predicted is a row of numpy arrays, so that each known price rules out
+# models and narrows their ranges for all of them at once.
+#
+# Many users share the same timeline, especially early in the week when all they've
+# logged is a buy price, so predictions are cached by the timeline they were made for.
+
+# the turnip price patterns, in the order that their models are enumerated
+PATTERNS = ["triple", "spike", "decay", "bump"]
+
+# the odds of each pattern this week given last week's pattern
+PATTERN_ODDS = {
+    "triple": [0.2, 0.3, 0.15, 0.35],
+    "spike": [0.5, 0.05, 0.2, 0.25],
+    "decay": [0.25, 0.45, 0.05, 0.25],
+    "bump": [0.45, 0.25, 0.15, 0.15],
+    "unknown": [0.25, 0.25, 0.25, 0.25],
+}
+
+# ranges of the multiplier of the buy price for each phase of a pattern
+INITIAL_DECAY = (0.85, 0.9)
+WIDE_LOSS = (0.4, 0.9)
+MEDIUM_LOSS = (0.6, 0.8)
+SMALL_PROFIT = (0.9, 1.4)
+MEDIUM_PROFIT = (1.4, 2.0)
+LARGE_PROFIT = (2.0, 6.0)
+
+# changes to the range of the multiplier of the period before in decaying phases
+SLOW_DECAY = (-0.05, -0.03)
+RAPID_DECAY = (-0.1, -0.04)
+
+# The bump pattern's peak is three periods that share a hidden multiplier, the cap. The
+# periods either side of the peak are at least a medium profit, but up to the cap and
+# one bell less than the price it gives. Each model keeps its cap in an extra column.
+CAP = len(SELLING_PERIODS)
+
+
+def _pattern_phases():
+    """Yields the pattern and the multiplier range of each period of every model."""
+    for phase1, decay1 in product(range(7), [2, 3]):
+        for phase2 in range(1, 8 - phase1):
+            yield "triple", [
+                *[SMALL_PROFIT] * phase1,
+                MEDIUM_LOSS,
+                *[RAPID_DECAY] * (decay1 - 1),
+                *[SMALL_PROFIT] * phase2,
+                MEDIUM_LOSS,
+                *[RAPID_DECAY] * (4 - decay1),
+                *[SMALL_PROFIT] * (7 - phase1 - phase2),
+            ]
+    for start in range(1, 8):
+        peak = [SMALL_PROFIT, MEDIUM_PROFIT, LARGE_PROFIT, MEDIUM_PROFIT, SMALL_PROFIT]
+        before = [INITIAL_DECAY, *[SLOW_DECAY] * (start - 1)]
+        yield "spike", [*before, *peak, *[WIDE_LOSS] * (7 - start)]
+    yield "decay", [INITIAL_DECAY, *[SLOW_DECAY] * 11]
+    for start in range(8):
+        before = [WIDE_LOSS, *[SLOW_DECAY] * (start - 1)] if start else []
+        after = [WIDE_LOSS, *[SLOW_DECAY] * (6 - start)] if start < 7 else []
+        yield "bump", [*before, SMALL_PROFIT, SMALL_PROFIT, "peak", *after]
+
+
+def _pattern_grid():
+    """Returns the patterns of every model and arrays describing their multipliers.
+
+    For each model and period, including the cap, there's the low and high end of the
+    multiplier's range. Where an end is relative to another period's, the index of that
+    period is its parent and the end is a change to the parent's. Otherwise the parent
+    is -1. Sub1 is set where a price is one less than its multiplier gives. Passthrough
+    marks the middle of a bump's peak, whose price is the cap's price too.
+    """
+    patterns, models = [], []
+    for pattern, phases in _pattern_phases():
+        columns = []
+        for phase in phases:
+            if phase == "peak":
+                columns.append((MEDIUM_PROFIT[0], 0.0, -1, CAP, 1, 0))
+                columns.append((0.0, 0.0, CAP, CAP, 0, 1))
+                columns.append((MEDIUM_PROFIT[0], 0.0, -1, CAP, 1, 0))
+            elif phase in (SLOW_DECAY, RAPID_DECAY):
+                columns.append((*phase, len(columns) - 1, len(columns) - 1, 0, 0))
+            else:
+                columns.append((*phase, -1, -1, 0, 0))
+        columns.append((*MEDIUM_PROFIT, -1, -1, 0, 0))  # the cap, only used by bumps
+        patterns.append(PATTERNS.index(pattern))
+        models.append(columns)
+    models = np.array(models)
+    low, high = models[:, :, 0], models[:, :, 1]
+    low_parent, high_parent, sub1 = models[:, :, 2:5].astype(int).transpose(2, 0, 1)
+    passthrough = models[:, :CAP, 5].astype(bool)
+    return np.array(patterns), low, high, low_parent, high_parent, sub1, passthrough
+
+
+PATTERN_GRID = _pattern_grid()
+PATTERN_MODELS = np.bincount(PATTERN_GRID[0], minlength=len(PATTERNS))
+
+
+def _multiplier_range(price, buy):
+    """Returns the lowest and highest multipliers, to four places, that give the price.
+
+    A price is the buy price times a multiplier, rounded up.
+    """
+    low = float(Decimal((price - 1) / buy).quantize(Decimal("0.0001"), ROUND_DOWN))
+    while math.ceil(low * buy) < price:
+        low += 0.0001
+    high = float(Decimal(price / buy).quantize(Decimal("0.0001"), ROUND_UP))
+    while math.ceil(high * buy) > price:
+        high -= 0.0001
+    return low, high
+
+
+def _multiplier_ranges(prices, buys):
+    """Returns the multiplier ranges for arrays of prices and buy prices."""
+    pairs = np.stack([prices, buys], axis=1)
+    pairs, inverse = np.unique(pairs, axis=0, return_inverse=True)
+    ranges = [_multiplier_range(int(price), int(buy)) for price, buy in pairs]
+    ranges = np.array(ranges).reshape(-1, 2)
+    low, high = ranges[inverse.reshape(-1)].T
+    return low, high
+
+
+class _PatternFit:
+    """The models of the turnip price patterns for some islands, as they're ruled out.
+
+    Prices are an array of each island's prices in the selling periods, with NaN where
+    they're unknown. Only the bump pattern is possible on an island's initial week, but
+    since its buy price says nothing about the week there's a model of it for each of
+    the possible buy prices instead.
+    """
+
+    def __init__(self, buys, prices, initial_weeks):
+        patterns, low, high, low_parent, high_parent, sub1, passthrough = PATTERN_GRID
+        bumps = np.flatnonzero(patterns == PATTERNS.index("bump"))
+        initial_buys = np.arange(90, 111)
+        islands, models, model_buys = [], [], []
+        for island, (buy, initial_week) in enumerate(zip(buys, initial_weeks)):
+            if initial_week:
+                models.append(np.tile(bumps, len(initial_buys)))
+                model_buys.append(np.repeat(initial_buys, len(bumps)))
+            else:
+                models.append(np.arange(len(patterns)))
+                model_buys.append(np.full(len(patterns), buy))
+            islands.append(np.full(len(models[-1]), island))
+        models = np.concatenate(models)
+
+        self.island = np.concatenate(islands)
+        self.pattern = patterns[models]
+        self.buy = np.concatenate(model_buys).astype(float)
+        self.prices = np.asarray(prices, dtype=float)[self.island]
+        self.low_delta = low[models]
+        self.high_delta = high[models]
+        self.low_parent = low_parent[models]
+        self.high_parent = high_parent[models]
+        self.sub1 = sub1[models]
+        self.passthrough = passthrough[models]
+
+        # multipliers narrowed by known prices, NaN until they are
+        self.low_fixed = np.full(self.low_delta.shape, np.nan)
+        self.high_fixed = np.full(self.high_delta.shape, np.nan)
+        self.alive = np.ones(len(models), dtype=bool)
+
+    def multipliers(self):
+        """Returns the low and high ends of the multiplier for every model and period."""
+        rows = np.arange(len(self.pattern))
+        low = np.empty(self.low_delta.shape)
+        high = np.empty(self.high_delta.shape)
+        for period in [CAP, *range(CAP)]:  # parents always come first in this order
+            for ends, fixed, delta, parent in (
+                (low, self.low_fixed, self.low_delta, self.low_parent),
+                (high, self.high_fixed, self.high_delta, self.high_parent),
+            ):
+                relative = parent[:, period] >= 0
+                base = np.where(relative, ends[rows, parent[:, period]], 0.0)
+                ends[:, period] = np.where(
+                    np.isnan(fixed[:, period]), delta[:, period] + base, fixed[:, period]
+                )
+        return low, high
+
+    def fix(self, period, prices, fixing):
+        """Rules out the fixing models that can't have the prices and narrows the rest."""
+        low, high = self.multipliers()
+        low, high = low[fixing, period], high[fixing, period]
+        prices, buys = prices[fixing], self.buy[fixing]
+        sub1 = self.sub1[fixing, period]
+        possible = (prices >= np.ceil(low * buys) - sub1) & (
+            prices <= np.ceil(high * buys) - sub1
+        )
+        new_low, new_high = _multiplier_ranges(prices + sub1, buys)
+        possible &= (new_low <= high) & (new_high >= low)
+        self.low_fixed[fixing, period] = np.maximum(new_low, low)
+        self.high_fixed[fixing, period] = np.minimum(new_high, high)
+        self.alive[np.flatnonzero(fixing)[~possible]] = False
+
+    def fit(self):
+        """Fixes every known price, in order, ruling out the models that don't fit."""
+        for period in range(CAP):
+            prices = self.prices[:, period]
+            known = self.alive & ~np.isnan(prices)
+            peak = known & self.passthrough[:, period]
+            if peak.any():
+                self.fix(CAP, prices, peak)
+            fixing = known & self.alive
+            if not fixing.any():
+                continue
+            self.fix(period, prices, fixing)
+
+            # a price either side of a bump's peak means the cap can't be any lower
+            capped = fixing & self.alive & (self.low_parent[:, period] < 0)
+            capped &= self.high_parent[:, period] == CAP
+            if capped.any():
+                low, high = self.multipliers()
+                floor = low[capped, period]
+                narrows = (low[capped, CAP] <= floor) & (floor <= high[capped, CAP])
+                rows = np.flatnonzero(capped)[narrows]
+                self.low_fixed[rows, CAP] = floor[narrows]
+        return self
+
+    def price_ranges(self):
+        """Returns the lowest and highest price of every model in each selling period."""
+        low, high = self.multipliers()
+        low = np.ceil(low[:, :CAP] * self.buy[:, None]) - self.sub1[:, :CAP]
+        high = np.ceil(high[:, :CAP] * self.buy[:, None]) - self.sub1[:, :CAP]
+        known = ~np.isnan(self.prices)
+        low = np.where(known, self.prices, low).astype(int)
+        high = np.where(known, self.prices, high).astype(int)
+        return low, high
+
+
+PREDICTION_COLUMNS = ["low", "high", "expected", "chance"]
+
+
+class Prediction:
+    """The models of the turnip price patterns that fit an island's timeline.
+
+    Each model has a pattern and a row in low and high, with the lowest and highest
+    prices that it allows in each of the week's selling periods. Known prices are the
+    prices in the timeline, with zero where they're unknown.
+    """
+
+    def __init__(self, buy, patterns, low, high, known, previous_week="unknown"):
+        self.buy = buy
+        self.patterns = patterns
+        self.low = low
+        self.high = high
+        self.known = known
+        self.previous_week = previous_week
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def priors(self):
+        """Returns the odds of each pattern that's still possible, from last week's."""
+        remaining = np.unique(self.patterns)
+        odds = np.array(PATTERN_ODDS[self.previous_week])[remaining]
+        return dict(zip((PATTERNS[p] for p in remaining), odds / odds.sum()))
+
+    def odds(self):
+        """Returns the probability of each pattern that's still possible.
+
+        A pattern's odds from last week are weighed by how many of its models are left.
+        """
+        counts = np.bincount(self.patterns, minlength=len(PATTERNS))
+        odds = np.array(PATTERN_ODDS[self.previous_week]) * counts / PATTERN_MODELS
+        remaining = np.flatnonzero(counts)
+        odds = odds[remaining] / odds[remaining].sum()
+        return dict(zip((PATTERNS[p] for p in remaining), odds))
+
+    def weights(self):
+        """Returns the probability of each model, sharing its pattern's odds equally."""
+        counts = np.bincount(self.patterns, minlength=len(PATTERNS))
+        odds = np.zeros(len(PATTERNS))
+        for pattern, chance in self.odds().items():
+            odds[PATTERNS.index(pattern)] = chance
+        return odds[self.patterns] / counts[self.patterns]
+
+    def spike(self):
+        """Returns the chance of a spike and the period that it would most likely peak.
+
+        Without any chance of a spike, the period is None.
+        """
+        spikes = self.patterns == PATTERNS.index("spike")
+        if not spikes.any():
+            return 0, None
+        peaks = self.high[spikes].argmax(axis=1)
+        weights = np.bincount(peaks, weights=self.weights()[spikes])
+        peak = weights.argmax()
+        return self.odds()["spike"], SELLING_PERIODS[peak]
+
+    def table(self):
+        """Returns a DataFrame of the price range in each selling period.
+
+        Along with the lowest and highest prices, there's the expected price and the
+        chance of selling for more than the buy price.
+        """
+        if not len(self):
+            return pd.DataFrame(np.nan, index=SELLING_PERIODS, columns=PREDICTION_COLUMNS)
+        weights = self.weights()
+        sizes = self.high - self.low + 1
+        profitable = np.clip(self.high - np.maximum(self.low - 1, self.buy), 0, None)
+        columns = [
+            self.low.min(axis=0),
+            self.high.max(axis=0),
+            weights @ ((self.low + self.high) / 2),
+            weights @ (profitable / sizes),
+        ]
+        return pd.DataFrame(dict(zip(PREDICTION_COLUMNS, columns)), index=SELLING_PERIODS)
+
+
+def island_data(timeline):
+    """Returns the data of an island for predicting its prices from its timeline."""
+    prices = zip(TIMELINE_PERIODS, timeline)
+    timeline_data = {period: price for period, price in prices if price is not None}
+    # TODO: Incorporate information about user's pattern from last week
+    return {"initial_week": False, "timeline": timeline_data}
+
+
+def predict_islands(islands):
+    """Returns a Prediction for each island with the given data, or None without a buy.
+
+    All of the islands are fit at once, as one batch of models.
+    """
+    predictions = [None] * len(islands)
+    bought = [i for i, data in enumerate(islands) if "Sunday_AM" in data["timeline"]]
+    if not bought:
+        return predictions
+
+    timelines = [islands[i]["timeline"] for i in bought]
+    buys = [timeline["Sunday_AM"] for timeline in timelines]
+    prices = [
+        [timeline.get(period, np.nan) for period in SELLING_PERIODS]
+        for timeline in timelines
+    ]
+    initial_weeks = [islands[i].get("initial_week", False) for i in bought]
+    fit = _PatternFit(buys, prices, initial_weeks).fit()
+    low, high = fit.price_ranges()
+    known = np.nan_to_num(np.array(prices, dtype=float)).astype(int)
+
+    # each island's models are together, in the order that the islands were given
+    bounds = np.searchsorted(fit.island, np.arange(len(bought) + 1))
+    for n, i in enumerate(bought):
+        rows = np.arange(bounds[n], bounds[n + 1])
+        rows = rows[fit.alive[rows]]
+        previous_week = islands[i].get("previous_week", "unknown")
+        predictions[i] = Prediction(
+            buys[n], fit.pattern[rows], low[rows], high[rows], known[n], previous_week
+        )
+    return predictions
+
+
+def predict(island_data):
+    """Returns a Prediction for the island with the given data or None without a buy."""
+    return predict_islands([island_data])[0]
+
+
+def predict_text(name, prediction, url):
+    """Describes the prices predicted for the named island, given a prediction."""
+    if not len(prediction):
+        return s("predict_text_no_patterns", name=name, url=url)
+
+    odds = prediction.odds()
+    pattern = max(odds, key=odds.get)
+    lines = [s("predict_text", name=name, pattern=pattern, odds=f"{odds[pattern]:.0%}")]
+
+    table = prediction.table()
+    for period, known, row in zip(SELLING_PERIODS, prediction.known, table.itertuples()):
+        period = period.replace("_", " ")
+        if known:
+            lines.append(s("predict_text_known", period=period, price=known))
+        else:
+            chance = f"{row.chance:.0%}"
+            lines.append(
+                s(
+                    "predict_text_range",
+                    period=period,
+                    low=row.low,
+                    high=row.high,
+                    chance=chance,
+                )
+            )
+
+    unknown = table[prediction.known == 0]
+    if len(unknown):
+        best = unknown.expected.idxmax()
+        expected = round(unknown.expected[best])
+        period = best.replace("_", " ")
+        lines.append(s("predict_text_best", period=period, price=expected))
+    lines.append(s("predict_text_details", url=url))
+    return "\n".join(lines)
+
+
+class PredictionCache:
+    """A least recently used cache of predictions keyed by island data.
+
+    Predictions are kept in memory and, given a path, also in files there which survive
+    restarts. Each of these keeps at most max_entries predictions.
+    """
+
+    def __init__(self, max_entries=DEFAULT_PREDICTION_CACHE_SIZE, path=None):
+        self.max_entries = max_entries
+        self.path = Path(path) if path else None
+        self._predictions = OrderedDict()  # least recently used first
+        self._lock = threading.Lock()
+
+    def _file(self, key):
+        key = f"{PREDICTION_CACHE_FORMAT}:{key}"
+        return self.path / f"{hashlib.sha256(key.encode()).hexdigest()}.npz"
+
+    def _remember(self, key, prediction):
+        with self._lock:
+            self._predictions[key] = prediction
+            self._predictions.move_to_end(key)
+            while len(self._predictions) > self.max_entries:
+                self._predictions.popitem(last=False)
+
+    def _read(self, key):
+        path = self._file(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                if int(npz["format"]) != PREDICTION_CACHE_FORMAT:
+                    raise ValueError(f"{path} is not in the current format")
+                prediction = Prediction(
+                    int(npz["buy"]),
+                    npz["patterns"],
+                    npz["low"],
+                    npz["high"],
+                    npz["known"],
+                    str(npz["previous_week"]),
+                )
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+            logging.warning("dropping unreadable cached prediction %s", path)
+            try:
+                path.unlink()
+            except FileNotFoundError:  # another process got to it first
+                pass
+            return None
+        os.utime(path)  # it's now the most recently used
+        return prediction
+
+    def _write(self, key, prediction):
+        # The files are only a cache so there's no need to sync them to disk.
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self._file(key)
+        temp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        with open(temp, "wb") as f:
+            np.savez(
+                f,
+                format=PREDICTION_CACHE_FORMAT,
+                buy=prediction.buy,
+                patterns=prediction.patterns,
+                low=prediction.low,
+                high=prediction.high,
+                known=prediction.known,
+                previous_week=prediction.previous_week,
+            )
+        os.replace(temp, path)
+
+        # Files in older formats are never read again, so they're evicted first.
+        files = [f for f in self.path.iterdir() if not f.name.startswith(".")]
+        files.sort(key=lambda f: f.stat().st_mtime)
+        for stale in files[: max(len(files) - self.max_entries, 0)]:
+            try:
+                stale.unlink()
+            except FileNotFoundError:  # another process got to it first
+                pass
+
+    def _get(self, key):
+        with self._lock:
+            prediction = self._predictions.get(key)
+        if prediction is None and self.path:
+            prediction = self._read(key)
+        return prediction
+
+    def predict_all(self, islands):
+        """Returns the Prediction for each of the given islands' data, like predict().
+
+        The islands that aren't cached are all predicted together, as predict_islands()
+        does, so that they're fit in one pass.
+        """
+        keys = [json.dumps(island_data, sort_keys=True) for island_data in islands]
+        predictions = [self._get(key) for key in keys]
+        missed = [i for i, prediction in enumerate(predictions) if prediction is None]
+        if missed:
+            fitted = predict_islands([islands[i] for i in missed])
+            for i, prediction in zip(missed, fitted):
+                predictions[i] = prediction
+                if prediction is not None and self.path:
+                    self._write(keys[i], prediction)
+        for key, prediction in zip(keys, predictions):
+            if prediction is not None:
+                self._remember(key, prediction)
+        return predictions
+
+    def predict(self, island_data):
+        """Returns the Prediction for the given island data, using the cache if it can."""
+        return self.predict_all([island_data])[0]
+
+
+##############################
+# Graph Rendering
+##############################
+
+# Graphs are plotted from plain data by the functions below rather than by Turbot, so
+# that they can be rendered on a pool of worker processes. Plotting with matplotlib is
+# slow, so it doesn't belong on the bot's own threads. Each graph is its own Figure,
+# rather than pyplot's global current figure, and is rendered into memory, so graphs
+# can be rendered concurrently without clobbering each other.
+
+
+def lttb(x, y, points):
+    """Returns the indices of the given number of points that best keep a series' shape.
+
+    This is the Largest-Triangle-Three-Buckets downsampling algorithm. It keeps the
+    first and last points and then one point from each of equally sized buckets of the
+    rest: the one making the largest triangle with the point kept from the bucket before
+    and the average of the bucket after.
+    """
+    n = len(x)
+    if n <= points:
+        return np.arange(n)
+    if points < 3:
+        return np.linspace(0, n - 1, points).astype(int)
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    keep = np.empty(points, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    kept = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        after = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        avg_x, avg_y = x[end:after].mean(), y[end:after].mean()
+        areas = np.abs(
+            (x[kept] - avg_x) * (y[start:end] - y[kept])
+            - (x[kept] - x[start:end]) * (avg_y - y[kept])
+        )
+        kept = start + int(np.argmax(areas))
+        keep[bucket + 1] = kept
+    return keep
+
+
+def plot_historical(series):
+    """Plots everyone's selling prices; series is a list of (name, dates, prices)."""
+    if not series:
+        return None
+
+    HOURS = mdates.HourLocator()
+    HOURS_FMT = mdates.DateFormatter("%b %d %H:%M")
+    TWELVEHOUR = mdates.HourLocator(interval=12)
+
+    figure = Figure(figsize=(18, 9), dpi=100)
+    ax = figure.subplots()
+    ax.xaxis.set_major_locator(TWELVEHOUR)
+    ax.xaxis.set_major_formatter(HOURS_FMT)
+    ax.xaxis.set_minor_locator(HOURS)
+
+    ax.yaxis.set_minor_locator(matplotlib.ticker.MultipleLocator(5))
+
+    legendElems = []
+    for user_name, dates, prices in series:
+        legendElems.append(user_name)
+        if len(dates):
+            ax.plot(dates, prices, linestyle="-", marker="o", label=user_name)
+
+    for label in ax.get_xticklabels():
+        label.set(rotation=45, ha="right", rotation_mode="anchor")
+    figure.subplots_adjust(left=0.05, bottom=0.2, right=0.85)
+    ax.grid(b=True, which="major", color="#666666", linestyle="-")
+    ax.yaxis.grid(b=True, which="minor", color="#555555", linestyle=":")
+    ax.set_ylabel("Price")
+    ax.set_xlabel("Time (UTC)")
+    ax.set_title("Selling Prices")
+    ax.legend(legendElems, loc="upper left", bbox_to_anchor=(1, 1))
+    return figure
+
+
+PATTERN_COLORS = {"triple": "orange", "spike": "green", "decay": "red", "bump": "blue"}
+
+
+def plot_predictive(name, prediction):
+    """Plots the range of prices predicted for the named island, given a prediction.
+
+    Each model is shaded in its pattern's color, more strongly the more likely it is,
+    wherever the island's prices aren't known yet. Known prices are plotted as lines.
+    """
+    if prediction is None:
+        return None
+
+    figure = Figure()
+    ax = figure.subplots()
+    ax.set_title(f"Island {name}: current: !!ERROR!!; Last: {prediction.previous_week}")
+    ax.set_ylabel("Turnip Price")
+    ax.xaxis.set_ticks(range(2, 14))
+    ax.set_xticklabels(
+        ["Mon AM", "Mon PM", "Tue AM", "Tue PM", "Wed AM", "Wed PM"]
+        + ["Thu AM", "Thu PM", "Fri AM", "Fri PM", "Sat AM", "Sat PM"],
+        rotation=45,
+    )
+    ax.grid(axis="both", which="both", ls="--")
+    ax.set_ylim(0, 660)
+    figure.tight_layout()
+
+    if len(prediction):
+        # as with turnips, shading only uses the odds from last week's pattern
+        counts = np.bincount(prediction.patterns, minlength=len(PATTERNS))
+        priors = prediction.priors()
+        alphas = np.full(len(prediction), 1 / len(prediction))
+        if prediction.previous_week != "unknown":
+            alphas = [priors[PATTERNS[p]] / counts[p] for p in prediction.patterns]
+
+        # periods are numbered from Sunday AM, as they are in the turnips package
+        periods = range(2, 14)
+        priced = prediction.known > 0
+        for known, days in groupby(periods, key=lambda day: priced[day - 2]):
+            days = list(days)
+            if known:
+                ax.plot(days, prediction.known[np.array(days) - 2], c="black")
+            elif days != [13]:  # a lone unknown Saturday PM is never shaded
+                # shade from the known prices either side
+                days = list(range(max(days[0] - 1, 2), min(days[-1] + 1, 13) + 1))
+                slots = np.array(days) - 2
+                for pattern, low, high, alpha in zip(
+                    prediction.patterns, prediction.low, prediction.high, alphas
+                ):
+                    color = PATTERN_COLORS[PATTERNS[pattern]]
+                    ax.fill_between(
+                        days, low[slots], high[slots], alpha=alpha, color=color
+                    )
+                    ax.scatter(days, low[slots], c="black", s=2)
+                    ax.scatter(days, high[slots], c="black", s=2)
+
+        summary = "+".join(
+            f"{counts[PATTERNS.index(pattern)]}_{{{pattern}}}^{{{odds:.2f}}}"
+            for pattern, odds in priors.items()
+        )
+        ax.set_title(
+            f"Island {name}: ${len(prediction)}_{{total}}={summary}$, "
+            f"Last: {prediction.previous_week}"
+        )
+
+    # fit the y-axis to the plotted data
+    maximum = 0
+    for line in ax.lines:
+        for price in line.get_ydata():
+            if price > maximum:
+                maximum = price
+    for collection in ax.collections:
+        for point in collection.get_offsets():
+            _, y = point
+            if y > maximum:
+                maximum = y
+    ax.set_ylim(0, maximum + 50)
+    ax.autoscale_view()
+    return figure
+
+
+GRAPHS = {"historical": plot_historical, "predictive": plot_predictive}
+
+
+def render_graph(kind, *args):
+    """Returns a graph of the given kind as PNG bytes, or None if it has no data."""
+    figure = GRAPHS[kind](*args)
+    if figure is None:
+        return None
+    buffer = BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+_render_workers_started = None  # set in each render worker by warm_up_renderer()
+
+
+def warm_up_renderer(started=None):
+    """Renders a throwaway graph so that fonts are loaded and cached ahead of time.
+
+    Render workers also keep the given barrier for wait_for_render_workers().
+    """
+    global _render_workers_started
+    _render_workers_started = started
+    figure = Figure()
+    ax = figure.subplots()
+    ax.plot([0, 1], [0, 1], marker="o")
+    ax.set_title("Warm Up")
+    figure.savefig(BytesIO(), format="png")
+
+
+def wait_for_render_workers():
+    """Waits in a render worker until every render worker has started."""
+    _render_workers_started.wait(timeout=RENDER_WORKERS_START_TIMEOUT)
+
+
+class GraphRenderer:
+    """Renders graphs to PNG bytes on a pool of pre-warmed worker processes.
+
+    With no workers, graphs are rendered in this process instead.
+    """
+
+    def __init__(self, workers=DEFAULT_RENDER_WORKERS):
+        self.workers = workers
+        self.rendering = 0  # how many graphs are being rendered by the workers
+        self._pool = None  # do not use directly, get it from start()
+        self._lock = threading.Lock()
+        self._starting = threading.Lock()  # held while the workers are being started
+
+    def start(self):
+        """Starts and warms up the worker processes, if they haven't been started yet."""
+        # Starting the workers takes a while, so only one thread starts them and it does
+        # so without holding the lock that saturated() and render() need.
+        with self._starting:
+            with self._lock:
+                if self._pool is not None or not self.workers:
+                    return self._pool
+            pool = self._spawn()
+            with self._lock:
+                self._pool = pool
+            return pool
+
+    def _spawn(self):
+        """Returns a new pool of worker processes once every worker has warmed up."""
+        context = multiprocessing.get_context("spawn")
+        started = context.Barrier(self.workers)
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=warm_up_renderer,
+            initargs=(started,),
+        )
+        try:
+            # Workers are only started as tasks arrive that no idle worker can take,
+            # so every one of them is started, and warmed up, by giving each worker
+            # a task that blocks until all of the workers have started.
+            waits = []
+            for _ in range(self.workers):
+                waits.append(pool.submit(wait_for_render_workers))
+            for wait in waits:
+                wait.result()
+        except BaseException:
+            pool.shutdown(wait=False)
+            raise
+        return pool
+
+    def _discard(self, pool):
+        """Stops the given pool and forgets it, so the next render starts a new one."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def render(self, kind, *args):
+        """Returns a graph of the given kind as PNG bytes or None if it's empty."""
+        for attempt in range(2):
+            pool = self.start()
+            if pool is None:
+                return render_graph(kind, *args)
+            with self._lock:
+                self.rendering += 1
+            try:
+                return pool.submit(render_graph, kind, *args).result()
+            except BrokenProcessPool:
+                if attempt:
+                    raise
+                logging.warning("a graph render worker died, restarting the workers")
+                self._discard(pool)
+            finally:
+                with self._lock:
+                    self.rendering -= 1
+
+    def saturated(self):
+        """Returns True if every worker is busy, so a new graph would have to wait."""
+        with self._lock:
+            return bool(self.workers) and self.rendering >= self.workers
+
+    def shutdown(self):
+        """Stops the worker processes."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+
+class GraphCache:
+    """A least recently used cache of rendered graphs that's limited by total size."""
+
+    def __init__(self, max_bytes=DEFAULT_GRAPH_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.size = 0  # total size of all cached graphs in bytes
+        self._graphs = OrderedDict()  # least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached graph for the given key or None if it isn't cached."""
+        with self._lock:
+            png = self._graphs.get(key)
+            if png is not None:
+                self._graphs.move_to_end(key)
+            return png
+
+    def put(self, key, png):
+        """Caches the given graph, evicting the least recently used ones to make room."""
+        with self._lock:
+            if key in self._graphs:
+                self.size -= len(self._graphs.pop(key))
+            if len(png) > self.max_bytes:
+                return
+            self._graphs[key] = png
+            self.size += len(png)
+            while self.size > self.max_bytes:
+                _, evicted = self._graphs.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get_or_render(self, key, render):
+        """Returns the cached graph for the given key, rendering it if needed."""
+        png = self.get(key)
+        if png is None:
+            png = render()
+            if png is not None:
+                self.put(key, png)
+        return png
+
+
 def command(f):
     f.is_command = True
     return f
@@ -288,6 +3069,17 @@ class Turbot(discord.Client):
         fish_file=DEFAULT_DB_FISH,
         fossils_file=DEFAULT_DB_FOSSILS,
         users_file=DEFAULT_DB_USERS,
+        storage="csv",
+        db_file=DEFAULT_DB_SQLITE,
+        flush_interval=None,
+        flush_threshold=DEFAULT_FLUSH_THRESHOLD,
+        backup_retention=DEFAULT_BACKUP_RETENTION,
+        retention_weeks=None,
+        retention_interval=DEFAULT_RETENTION_INTERVAL,
+        workers=DEFAULT_WORKERS,
+        render_workers=DEFAULT_RENDER_WORKERS,
+        graph_cache_size=DEFAULT_GRAPH_CACHE_SIZE,
+        prediction_cache_dir=None,
         log_level=None,
     ):
         if log_level:  # pragma: no cover
@@ -300,14 +3092,51 @@ class Turbot(discord.Client):
         self.fish_file = fish_file
         self.fossils_file = fossils_file
         self.users_file = users_file
+        self.storage = storage
+        self.db_file = db_file
         self.base_prophet_url = "https://turnipprophet.io/?prices="  # TODO: configurable?
-        self._prices_data = None  # do not use directly, load it from load_prices()
-        self._art_data = None  # do not use directly, load it from load_art()
-        self._fish_data = None  # do not use directly, load it from load_fish()
-        self._fossils_data = None  # do not use directly, load it from load_fossils()
-        self._users_data = None  # do not use directly, load it from load_users()
+        self.store = open_storage(
+            storage,
+            prices_file=prices_file,
+            art_file=art_file,
+            fish_file=fish_file,
+            fossils_file=fossils_file,
+            users_file=users_file,
+            db_file=db_file,
+        )
+        self.backups = PriceBackups(
+            Path(prices_file).parent / "backups", keep=backup_retention
+        )
         self._last_backup_filename = None
 
+        # With retention_weeks, prices older than that many weeks are moved to the
+        # archive at startup and then again every retention_interval seconds.
+        self.archive = PriceArchive(Path(prices_file).parent / "archive")
+        self.retention_weeks = retention_weeks
+        self.retention_interval = retention_interval
+        self._retainer = None
+
+        # With a flush interval, changes to stored data are buffered and written out
+        # together every flush_interval seconds or once flush_threshold are pending.
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._flusher = None
+        self.store.set_write_behind(flush_interval is not None)
+
+        # Commands run on a pool of worker threads rather than on the event loop, so a
+        # slow command doesn't hold up any other channel or discord's heartbeats.
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.closing = False  # set by close(), after which no more commands are run
+        # Graphs are rendered on their own pool of worker processes and then cached
+        # until the data that they show has changed.
+        self.renderer = GraphRenderer(render_workers)
+        self.graph_cache = GraphCache(graph_cache_size)
+        self.predictions = PredictionCache(path=prediction_cache_dir)
+        # Each user's timeline is kept up to date as they log prices.
+        self.timelines = TimelineIndex(lambda: self.store.prices, self.get_user_timezone)
+        # And the best prices of the last 12 hours are kept ranked.
+        self.best_prices = BestPrices(lambda: self.store.prices)
+
         # build a list of commands supported by this bot by fetching @command methods
         members = inspect.getmembers(self, predicate=inspect.ismethod)
         self._commands = [
@@ -319,319 +3148,176 @@ class Turbot(discord.Client):
     def run(self):  # pragma: no cover
         super().run(self.token)
 
-    def save_prices(self, data):
-        """Saves the given prices data to csv file."""
-        data.to_csv(self.prices_file, index=False)  # persist to disk
-        self._prices_data = data  # in-memory optimization
+    async def close(self):
+        """Flushes any buffered changes to stored data before disconnecting."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._retainer is not None:
+            self._retainer.cancel()
+            self._retainer = None
+        # No new commands are started, but any that are running are left to finish. The
+        # waiting is done on another thread so that the event loop isn't blocked by it.
+        self.closing = True
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, partial(self.executor.shutdown, wait=True))
+        await loop.run_in_executor(None, self.renderer.shutdown)
+        await loop.run_in_executor(None, self.store.flush)
+        await super().close()
+
+    async def run_in_worker(self, f, *args):
+        """Runs the given function on a worker thread and returns its result."""
+        return await asyncio.get_event_loop().run_in_executor(self.executor, f, *args)
+
+    async def flush_periodically(self):
+        """Flushes buffered changes to stored data every flush_interval seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.run_in_worker(self.store.flush)
+            except asyncio.CancelledError:  # not a subclass of Exception before 3.8
+                raise
+            except Exception:
+                logging.exception("failed to flush stored data, trying again later")
+
+    def apply_retention(self):
+        """Archives prices logged before the start of the week retention_weeks ago."""
+        now = pd.Series([pd.Timestamp(datetime.now(pytz.utc))])
+        before = pd.Timestamp(week_of(now)[0], tz=pytz.utc)
+        before -= pd.Timedelta(weeks=self.retention_weeks)
+        self.store.prices.expire(
+            before, lambda prices: self.archive.save(prices, self.get_user_timezone)
+        )
+        self.store.flush()
+
+    async def retain_periodically(self):
+        """Applies the retention period now and then every retention_interval seconds."""
+        while True:
+            try:
+                await self.run_in_worker(self.apply_retention)
+            except asyncio.CancelledError:  # not a subclass of Exception before 3.8
+                raise
+            except Exception:
+                logging.exception("failed to archive old prices, trying again later")
+            await asyncio.sleep(self.retention_interval)
 
     def last_backup_filename(self):
         """Return the name of the last known backup file for prices or None if unknown."""
         return self._last_backup_filename
 
-    def backup_prices(self, data):
-        """Backs up the prices data to a datetime stamped file."""
-        filename = datetime.now(pytz.utc).strftime(
-            "prices-%Y-%m-%d.csv"  # TODO: configurable?
-        )
-        filepath = Path(self.prices_file).parent / filename
-        self._last_backup_filename = filepath
-        data.to_csv(filepath, index=False)
-
-    def load_prices(self):
-        """Loads up and returns the application price data as a DataFrame."""
-        if self._prices_data is not None:
-            return self._prices_data
-
-        cols = ["author", "kind", "price", "timestamp"]
-        dtypes = ["int64", "object", "int64", "datetime64[ns, UTC]"]
-        if Path(self.prices_file).exists():
-            self._prices_data = pd.read_csv(
-                self.prices_file, names=cols, parse_dates=True, skiprows=1
-            )
-        else:
-            self._prices_data = pd.read_csv(
-                StringIO(""), names=cols, dtype=dict(zip(cols, dtypes))
-            )
-        self._prices_data = self._prices_data.astype(dict(zip(cols, dtypes)))
-        return self._prices_data
-
-    def save_users(self, data):
-        """Saves the given users data to csv file."""
-        data.to_csv(self.users_file, index=False)  # persist to disk
-        self._users_data = data  # in-memory optimization
-
-    def load_users(self):
-        """Returns a DataFrame of user data or creates an empty one."""
-        if self._users_data is not None:
-            self._users_data = self._users_data.fillna("")
-            return self._users_data
-
-        cols = ["author", *USER_PREFRENCES]
-        dtypes = ["int64", "str", "str", "str", "str", "str", "str", "str"]
-        if Path(self.users_file).exists():
-            self._users_data = pd.read_csv(self.users_file, names=cols, skiprows=1)
-        else:
-            self._users_data = pd.read_csv(
-                StringIO(""), names=cols, dtype=dict(zip(cols, dtypes))
-            )
-        self._users_data = self._users_data.fillna("")
-        self._users_data = self._users_data.astype(dict(zip(cols, dtypes)))
-        return self._users_data
-
-    def save_art(self, data):
-        """Saves the given art data to csv file."""
-        data.to_csv(self.art_file, index=False)  # persist to disk
-        self._art_data = data  # in-memory optimization
-
-    def load_art(self):
-        """Returns a DataFrame of art data or creates an empty one."""
-        if self._art_data is None:
-            try:
-                self._art_data = pd.read_csv(self.art_file)
-            except FileNotFoundError:
-                self._art_data = pd.DataFrame(columns=["author", "name"])
-        return self._art_data
-
-    def save_fish(self, data):
-        """Saves the given fish data to csv file."""
-        data.to_csv(self.fish_file, index=False)  # persist to disk
-        self._fish_data = data  # in-memory optimization
-
-    def load_fish(self):
-        """Returns a DataFrame of fish data or creates an empty one."""
-        if self._fish_data is None:
-            try:
-                self._fish_data = pd.read_csv(self.fish_file)
-            except FileNotFoundError:
-                self._fish_data = pd.DataFrame(columns=["author", "name"])
-        return self._fish_data
-
-    def save_fossils(self, data):
-        """Saves the given fossils data to csv file."""
-        data.to_csv(self.fossils_file, index=False)  # persist to disk
-        self._fossils_data = data  # in-memory optimization
-
-    def load_fossils(self):
-        """Returns a DataFrame of fossils data or creates an empty one."""
-        if self._fossils_data is None:
-            try:
-                self._fossils_data = pd.read_csv(self.fossils_file)
-            except FileNotFoundError:
-                self._fossils_data = pd.DataFrame(columns=["author", "name"])
-        return self._fossils_data
+    def backup_prices(self, weeks):
+        """Backs up the weeks of prices to a datetime stamped backup manifest."""
+        self._last_backup_filename = self.backups.save(weeks)
 
     def _get_island_data(self, user):
-        timeline = self.get_user_timeline(user.id)
-        timeline_data = dict(
-            zip(
-                [
-                    "Sunday_AM",
-                    "Monday_AM",
-                    "Monday_PM",
-                    "Tuesday_AM",
-                    "Tuesday_PM",
-                    "Wednesday_AM",
-                    "Wednesday_PM",
-                    "Thursday_AM",
-                    "Thursday_PM",
-                    "Friday_AM",
-                    "Friday_PM",
-                    "Saturday_AM",
-                    "Saturday_PM",
-                ],
-                timeline,
-            )
-        )
-        timeline_data = {k: v for k, v in timeline_data.items() if v is not None}
-        # TODO: Incorporate information about user's pattern from last week
-        return {"initial_week": False, "timeline": timeline_data}
-
-    def _get_predictive_graph(self, target_user, graphname):
-        """Builds a predictive graph of a user's price data."""
-        islands = {"islands": {}}
-        island_data = self._get_island_data(target_user)
-        if "Sunday_AM" not in island_data["timeline"]:
-            return None
-        islands["islands"][target_user.name] = island_data
-        arch = Archipelago.load_json(json.dumps(islands))
-        island = next(arch.islands)  # there should only be one island
-        plot_models_range(
-            island.name, list(island.model_group.models), island.previous_week, True
-        )
+        return island_data(self.get_user_timeline(user.id))
 
-        # fit the y-axis to the plotted data
-        maximum = 0
-        ax = plt.gca()
-        for line in ax.lines:
-            for price in line.get_ydata():
-                if price > maximum:
-                    maximum = price
-        for collection in ax.collections:
-            for point in collection.get_offsets():
-                _, y = point
-                if y > maximum:
-                    maximum = y
-        ax.set_ylim(0, maximum + 50)
-        ax.autoscale_view()
-        plt.draw()
-
-        plt.savefig(graphname)
-        return plt
-
-    def _get_historical_graph(self, channel, graphname):
-        """Builds a historical graph of everyone's price data."""
-        HOURS = mdates.HourLocator()
-        HOURS_FMT = mdates.DateFormatter("%b %d %H:%M")
-        TWELVEHOUR = mdates.HourLocator(interval=12)
-
-        plt.figure(figsize=(10, 12), dpi=100)
-        _, ax = plt.subplots()
-        ax.xaxis.set_major_locator(TWELVEHOUR)
-        ax.xaxis.set_major_formatter(HOURS_FMT)
-        ax.xaxis.set_minor_locator(HOURS)
-
-        ax.yaxis.set_minor_locator(matplotlib.ticker.MultipleLocator(5))
-
-        priceList = self.load_prices()
-        legendElems = []
-
-        found_at_least_one_user = False
-        for user_id, df in priceList.groupby(by="author"):
-            dates = []
-            prices = []
-            user_name = discord_user_name(channel, user_id)
-            if not user_name:
-                continue
-            found_at_least_one_user = True
-            legendElems.append(user_name)
-            for _, row in df.iterrows():
-                if row.kind == "sell":
-                    prices.append(row.price)
-                    dates.append(row.timestamp)
-            if dates:
-                plt.plot(dates, prices, linestyle="-", marker="o", label=user_name)
-        if not found_at_least_one_user:
-            return None
+    def _get_historical_series(self, channel, top=None, points=None):
+        """Returns the name, sell dates and sell prices of each user in the channel.
 
-        plt.xticks(rotation=45, ha="right", rotation_mode="anchor")
-        plt.subplots_adjust(left=0.05, bottom=0.2, right=0.85)
-        plt.grid(b=True, which="major", color="#666666", linestyle="-")
-        ax.yaxis.grid(b=True, which="minor", color="#555555", linestyle=":")
-        plt.ylabel("Price")
-        plt.xlabel("Time (UTC)")
-        plt.title("Selling Prices")
-        plt.legend(legendElems, loc="upper left", bbox_to_anchor=(1, 1))
+        The dates and prices are numpy arrays, split out of all of the selling prices in
+        one pass rather than by iterating over each user's prices. With top, only the
+        users with the top selling prices are included, best first. With points, each
+        user's prices are downsampled to at most that many.
+        """
+        names = {member.id: str(member) for member in channel.members}
+        prices = self.store.prices.load()
+        prices = prices[prices.author.isin(list(names))]
+        sells = prices[prices.kind == "sell"].sort_values(
+            by=["author", "timestamp"], kind="stable"
+        )
+        authors, starts = np.unique(sells.author.to_numpy(), return_index=True)
+        dates = np.split(sells.timestamp.dt.tz_convert(None).to_numpy(), starts[1:])
+        values = np.split(sells.price.to_numpy(), starts[1:])
+        by_author = dict(zip(authors, zip(dates, values)))
+        if points:
+            for author, (dates, values) in by_author.items():
+                keep = lttb(dates.astype("int64").astype(float), values, points)
+                by_author[author] = (dates[keep], values[keep])
+        if top:
+            best = sells.groupby(by="author", sort=True).price.max()
+            plotted = best.sort_values(ascending=False, kind="stable").index[:top]
+        else:
+            plotted = np.unique(prices.author.to_numpy())
+        none = (np.array([], dtype="datetime64[ns]"), np.array([], dtype="int64"))
+        return [(names[author], *by_author.get(author, none)) for author in plotted]
 
-        figure = plt.gcf()
-        figure.set_size_inches(18, 9)
+    def _get_graph_data(self, channel, target_user, **options):
+        """Returns the kind of graph for the given target and the data to plot in it.
+
+        Options are passed on to _get_historical_series() for historical graphs.
+        """
+        if target_user:
+            prediction = self.predictions.predict(self._get_island_data(target_user))
+            return "predictive", (target_user.name, prediction)
+        return "historical", (self._get_historical_series(channel, **options),)
 
-        plt.savefig(graphname, dpi=100)
-        return plt
+    def get_graph(self, channel, target_user, **options):
+        """Returns a Figure with a graph of user data or None if there's no data."""
+        kind, args = self._get_graph_data(channel, target_user, **options)
+        return GRAPHS[kind](*args)
 
-    def get_graph(self, channel, target_user, graphname):
-        """Returns a graph of user data; the call site is responsible for closing."""
+    def _get_graph_key(self, channel, target_user, **options):
+        """Returns a key that changes whenever the graph for the given target would."""
         if target_user:
-            return self._get_predictive_graph(target_user, graphname)
-        else:
-            return self._get_historical_graph(channel, graphname)
+            timeline = tuple(self.get_user_timeline(target_user.id))
+            return "predictive", target_user.name, timeline
+        members = tuple(sorted((member.id, str(member)) for member in channel.members))
+        version = self.store.prices.version
+        return "historical", version, members, tuple(sorted(options.items()))
+
+    def _render_graph(self, channel, target_user, **options):
+        kind, args = self._get_graph_data(channel, target_user, **options)
+        return self.renderer.render(kind, *args)
+
+    def generate_graph(self, channel, target_user, **options):  # pragma: no cover
+        """Generates a nice looking graph of user data as PNG bytes."""
+        return self.graph_cache.get_or_render(
+            self._get_graph_key(channel, target_user, **options),
+            lambda: self._render_graph(channel, target_user, **options),
+        )
+
+    def graph_is_ready(self, channel, target_user, **options):
+        """Returns True if a graph is cached or can be rendered without waiting."""
+        key = self._get_graph_key(channel, target_user, **options)
+        return self.graph_cache.get(key) is not None or not self.renderer.saturated()
 
-    def generate_graph(self, channel, target_user, graphname):  # pragma: no cover
-        """Generates a nice looking graph of user data."""
-        fig = self.get_graph(channel, target_user, graphname)
-        if fig:
-            plt.close("all")
+    def attach_graph(self, channel, target_user, filename, **options):
+        """Generates a graph of user data as an attachment, or None if there's no data."""
+        png = self.generate_graph(channel, target_user, **options)
+        return discord.File(BytesIO(png), filename=filename) if png else None
 
     def append_price(self, author, kind, price, at):
         """Adds a price to the prices data file for the given author and kind."""
         at = datetime.now(pytz.utc) if not at else at
         at = at.astimezone(pytz.utc)  # always store data in UTC
-        prices = self.load_prices()
-        prices = prices.append(
-            pd.DataFrame(columns=prices.columns, data=[[author.id, kind, price, at]]),
-            ignore_index=True,
-        )
-        self.save_prices(prices)
+        with self.store.prices.lock:  # so the best prices see just this one appended
+            self.timelines.append_price(author.id, kind, price, at)
+            self.best_prices.appended(author.id, kind, price, at)
 
     def get_last_price(self, user_id):
         """Returns the last sell price for the given user id."""
-        prices = self.load_prices()
-        last = (
-            prices[(prices.author == user_id) & (prices.kind == "sell")]
-            .sort_values(by=["timestamp"])
-            .tail(1)
-            .price
-        )
+        prices = self.store.prices.prices_for(user_id)
+        last = prices[prices.kind == "sell"].sort_values(by=["timestamp"]).tail(1).price
         return last.iloc[0] if last.any() else None
 
     def get_user_prefs(self, user_id):
-        users = self.load_users()
-        row = users[users.author == user_id].tail(1)
-        if row.empty:
-            return {}
+        prefs = self.store.users.prefs_for(user_id)
+        return prefs.as_dict() if prefs else {}
 
-        prefs = {}
-        data = row.to_dict(orient="records")[0]
-        for column in users.columns[1:]:
-            if not data[column]:
-                continue
-            if column == "timezone":
-                prefs[column] = pytz.timezone(data[column])
-            else:
-                prefs[column] = data[column]
-        return prefs
+    def get_user_timezone(self, user_id):
+        prefs = self.store.users.prefs_for(user_id)
+        return prefs.tz if prefs else pytz.UTC
 
     def get_user_timeline(self, user_id):
-        prices = self.load_prices()
-        past = datetime.now(pytz.utc) - timedelta(days=12)
-        yours = prices[(prices.author == user_id) & (prices.timestamp > past)]
-        yours = yours.sort_values(by=["timestamp"])
-
-        # convert all timestamps to the target user's timezone
-        target_timezone = self.get_user_prefs(user_id).get("timezone", pytz.UTC)
-        yours["timestamp"] = yours.timestamp.dt.tz_convert(target_timezone)
-
-        recent_buy = yours[yours.kind == "buy"].tail(1)
-        if recent_buy.empty:  # no buy found
-            return [None] * 13
+        return self.timelines.get(user_id)
 
-        buy_date = recent_buy.timestamp.iloc[0]
-        if (
-            buy_date.to_pydatetime().isoweekday() != DAYS["sunday"]
-        ):  # buy isn't on a sunday
-            return [None] * 13
-
-        buy_price = int(recent_buy.price.iloc[0])
-        sells = yours[(yours.kind == "sell") & (yours.timestamp > buy_date)]
-        if sells.empty:  # no sells found after buy date
-            return [buy_price] + [None] * 12
-
-        sell_data = [
-            [None, None],  # monday
-            [None, None],  # tuesday
-            [None, None],  # wednesday
-            [None, None],  # friday
-            [None, None],  # thrusday
-            [None, None],  # saturday
-        ]
-
-        groups = sells.set_index("timestamp").groupby(pd.Grouper(freq="D"))
-        for day, df in groups:
-            day_of_week = day.to_pydatetime().isoweekday()
-            if day_of_week == DAYS["sunday"]:  # no sells allowed on sundays
-                continue
-            for ts, row in df.iterrows():
-                if ts.hour < 12:  # am
-                    sell_data[day_of_week - 1][0] = int(row["price"])
-                else:  # pm
-                    sell_data[day_of_week - 1][1] = int(row["price"])
-
-        timeline = [buy_price]
-        for day in sell_data:
-            timeline.extend(day)
-        return timeline
+    def get_user_timelines(self, user_ids):
+        """Returns a dict of each given user id to their timeline."""
+        return self.timelines.get_many(user_ids)
 
     def to_usertime(self, author_id, dt):
-        user_timezone = self.get_user_prefs(author_id).get("timezone", pytz.UTC)
+        user_timezone = self.get_user_timezone(author_id)
         if hasattr(dt, "tz_convert"):  # pandas-datetime-like objects
             return dt.tz_convert(user_timezone)
         elif hasattr(dt, "astimezone"):  # python-datetime-like objects
@@ -641,16 +3327,9 @@ class Turbot(discord.Client):
             return dt
 
     def save_user_pref(self, author, pref, value):
-        users = self.load_users()
-        row = users[users.author == author.id].tail(1)
-        if row.empty:
-            data = pd.DataFrame(columns=users.columns)
-            data["author"] = [author.id]
-            data[pref] = [value]
-            users = users.append(data, ignore_index=True)
-        else:
-            users.at[row.index, pref] = value
-        self.save_users(users)
+        self.store.users.set_pref(author.id, pref, value)
+        if pref == "timezone":  # the user's timeline is in their timezone
+            self.timelines.forget(author.id)
 
     def paginate(self, text):
         """Discord responses must be 2000 characters of less; paginate breaks them up."""
@@ -702,7 +3381,9 @@ class Turbot(discord.Client):
             logging.debug("%s (author=%s, params=%s)", command, message.author, params)
             method = getattr(self, command)
             async with message.channel.typing():
-                response, attachment = method(message.channel, message.author, params)
+                response, attachment = await self.run_in_worker(
+                    method, message.channel, message.author, params
+                )
             if not isinstance(response, list):
                 response = [response]
             last_reply_index = len(response) - 1
@@ -728,6 +3409,8 @@ class Turbot(discord.Client):
                     await message.channel.send(embed=reply, file=file)
                 else:
                     raise RuntimeError("non-string non-embed reply not supported")
+        if self.store.pending >= self.flush_threshold:
+            await self.run_in_worker(self.store.flush)
 
     ##############################
     # Discord Client Behavior
@@ -736,7 +3419,8 @@ class Turbot(discord.Client):
     async def on_message(self, message):
         """Behavior when the client gets a message from Discord."""
         if (
-            str(message.channel.type) == "text"
+            not self.closing
+            and str(message.channel.type) == "text"
             and message.author.id != self.user.id
             and message.channel.name in self.channels
             and message.content.startswith("!")
@@ -746,6 +3430,11 @@ class Turbot(discord.Client):
     async def on_ready(self):
         """Behavior when the client has successfully connected to Discord."""
         logging.debug("logged in as %s", self.user)
+        if self.flush_interval is not None and self._flusher is None:
+            self._flusher = asyncio.ensure_future(self.flush_periodically())
+        if self.retention_weeks is not None and self._retainer is None:
+            self._retainer = asyncio.ensure_future(self.retain_periodically())
+        await self.run_in_worker(self.renderer.start)
 
     ##############################
     # Bot Command Functions
@@ -905,14 +3594,13 @@ class Turbot(discord.Client):
         if not is_turbot_admin(channel, author):
             return s("not_admin"), None
 
-        self.generate_graph(channel, None, LASTWEEKCMD_FILE)
-        prices = self.load_prices()
-        self.backup_prices(prices)
-
-        buys = prices[prices.kind == "buy"].sort_values(by="timestamp")
-        idx = buys.groupby(by="author")["timestamp"].idxmax()
-        prices = buys.loc[idx]
-        self.save_prices(prices)
+        png = self.generate_graph(channel, None)
+        if png:
+            _atomic_write(LASTWEEKCMD_FILE, png)
+        self.timelines.close_week()
+        prices = self.store.prices
+        self.backup_prices([prices.load_week(week) for week in prices.weeks()])
+        self.store.flush()  # a reset is never left buffered
         return s("reset"), None
 
     @command
@@ -927,16 +3615,50 @@ class Turbot(discord.Client):
     @command
     def graph(self, channel, author, params):
         """
-        Generates a historical graph of turnip prices for all users.
+        Generates a historical graph of turnip prices for all users. On busy servers, use
+        top to graph only the users with the best selling prices, or sample to graph
+        fewer prices for each user. | [top [count] or sample [points]]
+        """
+        if not params:
+            return s("graph_all_users"), self.attach_graph(channel, None, "graph.png")
+
+        mode, count = params[0].lower(), params[1] if len(params) > 1 else None
+        if mode not in GRAPH_MODES or len(params) > 2:
+            return s("graph_usage"), None
+        if count is None:
+            count = GRAPH_MODES[mode]
+        elif not count.isdigit() or int(count) < 1:
+            return s("graph_usage"), None
+        else:
+            count = int(count)
+
+        if mode == "top":
+            response = s("graph_top_users", count=count)
+            return response, self.attach_graph(channel, None, "graph.png", top=count)
+        response = s("graph_all_users")
+        return response, self.attach_graph(channel, None, "graph.png", points=count)
+
+    def _history_for(self, user_id):
+        """Returns the given user's prices in recent closed weeks and then the open week.
+
+        Each week starts with the latest buy price carried over from the week before it,
+        which is only included once, in the week it was logged in.
         """
-        self.generate_graph(channel, None, GRAPHCMD_FILE)
-        return s("graph_all_users"), discord.File(GRAPHCMD_FILE)
+        store = self.store.prices
+        weeks = store.closed_prices_for(user_id, weeks=HISTORY_WEEKS)
+        weeks.append(store.prices_for(user_id))
+        history = weeks[:1]
+        for before, week in zip(weeks, weeks[1:]):
+            buys = before[before.kind == "buy"].timestamp
+            history.append(week[~((week.kind == "buy") & week.timestamp.isin(buys))])
+        return pd.concat(history)
 
     @command
     def history(self, channel, author, params):
         """
-        Show the historical turnip prices for a user. If no user is specified, it will
-        display your own prices. | [user]
+        Show the historical turnip prices for a user, including the last few weeks before
+        the data was reset. If no user is specified, it will display your own prices. |
+        [user]
         """
         target = author.id if not params else params[0]
         target_name = discord_user_name(channel, target)
@@ -944,9 +3666,20 @@ class Turbot(discord.Client):
         if not target_name or not target_id:
             return s("cant_find_user", name=target), None
 
-        prices = self.load_prices()
-        yours = prices[prices.author == target_id]
+        yours = self._history_for(target_id)
         lines = [s("history_header", name=target_name)]
+        for _, summary in self.archive.summaries_for(target_id).iterrows():
+            lines.append(
+                s(
+                    "history_summary",
+                    week=summary.week,
+                    buy=summary_price(summary.buy),
+                    best=summary_price(summary.best),
+                    timeline=" ".join(
+                        summary_price(summary[slot], "-") for slot in TIMELINE_SLOTS
+                    ),
+                )
+            )
         for _, row in yours.iterrows():
             time = self.to_usertime(target_id, row.timestamp)
             lines.append(
@@ -966,9 +3699,7 @@ class Turbot(discord.Client):
         """
         target = author.id
         target_name = discord_user_name(channel, target)
-        prices = self.load_prices()
-        prices = prices.drop(prices[prices.author == author.id].tail(1).index)
-        self.save_prices(prices)
+        self.timelines.drop_last_price(author.id)
         return s("oops", name=target_name), None
 
     @command
@@ -977,26 +3708,19 @@ class Turbot(discord.Client):
         Clears all of your own historical turnip prices.
         """
         user_id = discord_user_id(channel, str(author))
-        prices = self.load_prices()
-        prices = prices[prices.author != user_id]
-        self.save_prices(prices)
+        self.timelines.clear_prices(user_id)
         return s("clear", name=author), None
 
     def _best(self, channel, author, kind):
-        prices = self.load_prices()
-        past = datetime.now(pytz.utc) - timedelta(hours=12)
-        sells = prices[(prices.kind == kind) & (prices.timestamp > past)]
-        idx = sells.groupby(by="author").price.transform(max) == sells.price
-        bests = sells[idx].sort_values(by="price", ascending=kind == "buy")
+        members = {member.id: member for member in channel.members}
         lines = [s(f"best{kind}_header")]
-        for _, row in bests.iterrows():
-            name = discord_user_from_id(channel, row.author)
+        for user_id, price, at in self.best_prices.best(kind):
             lines.append(
                 s(
                     "best",
-                    name=name,
-                    price=row.price,
-                    timestamp=h(self.to_usertime(row.author, row.timestamp)),
+                    name=members.get(user_id),
+                    price=price,
+                    timestamp=h(self.to_usertime(user_id, at)),
                 )
             )
         return "\n".join(lines), None
@@ -1035,57 +3759,36 @@ class Turbot(discord.Client):
         lines = []
 
         if valid_fossils:
-            fossils = self.load_fossils()
-            yours = fossils[fossils.author == author.id]
-            dupes = yours.loc[yours.name.isin(valid_fossils)].name.values.tolist()
-            new_names = list(set(valid_fossils) - set(dupes))
-            new_data = [[author.id, name] for name in new_names]
-            new_fossils = pd.DataFrame(columns=fossils.columns, data=new_data)
-            fossils = fossils.append(new_fossils, ignore_index=True)
-            yours = fossils[fossils.author == author.id]  # re-fetch for congrats
-            self.save_fossils(fossils)
+            new_names = self.store.fossils.add_collected(author.id, valid_fossils)
+            dupes = valid_fossils - new_names
             if new_names:
                 lines.append(s("collect_fossil_new", items=", ".join(sorted(new_names))))
             if dupes:
                 lines.append(s("collect_fossil_dupe", items=", ".join(sorted(dupes))))
-            if len(FOSSILS_SET) == len(yours.index):
+            if self.store.fossils.count(author.id) == len(FOSSILS_SET):
                 lines.append(s("congrats_all_fossils"))
 
         if valid_bugs:
             lines.append(s("collect_bugs"))
 
         if valid_fish:
-            fish = self.load_fish()
-            yours = fish[fish.author == author.id]
-            dupes = yours.loc[yours.name.isin(valid_fish)].name.values.tolist()
-            new_names = list(set(valid_fish) - set(dupes))
-            new_data = [[author.id, name] for name in new_names]
-            new_fish = pd.DataFrame(columns=fish.columns, data=new_data)
-            fish = fish.append(new_fish, ignore_index=True)
-            yours = fish[fish.author == author.id]  # re-fetch for congrats
-            self.save_fish(fish)
+            new_names = self.store.fish.add_collected(author.id, valid_fish)
+            dupes = valid_fish - new_names
             if new_names:
                 lines.append(s("collect_fish_new", items=", ".join(sorted(new_names))))
             if dupes:
                 lines.append(s("collect_fish_dupe", items=", ".join(sorted(dupes))))
-            if len(FISH_SET) == len(yours.index):
+            if self.store.fish.count(author.id) == len(FISH_SET):
                 lines.append(s("congrats_all_fish"))
 
         if valid_art:
-            art = self.load_art()
-            yours = art[art.author == author.id]
-            dupes = yours.loc[yours.name.isin(valid_art)].name.values.tolist()
-            new_names = list(set(valid_art) - set(dupes))
-            new_data = [[author.id, name] for name in new_names]
-            new_art = pd.DataFrame(columns=art.columns, data=new_data)
-            art = art.append(new_art, ignore_index=True)
-            yours = art[art.author == author.id]  # re-fetch for congrats
-            self.save_art(art)
+            new_names = self.store.art.add_collected(author.id, valid_art)
+            dupes = valid_art - new_names
             if new_names:
                 lines.append(s("collect_art_new", items=", ".join(sorted(new_names))))
             if dupes:
                 lines.append(s("collect_art_dupe", items=", ".join(sorted(dupes))))
-            if len(ART_SET) == len(yours.index):
+            if self.store.art.count(author.id) == len(ART_SET):
                 lines.append(s("congrats_all_art"))
 
         if invalid:
@@ -1113,13 +3816,8 @@ class Turbot(discord.Client):
         lines = []
 
         if valid_fossils:
-            fossils = self.load_fossils()
-            yours = fossils[fossils.author == author.id]
-            previously_collected = yours.loc[yours.name.isin(valid_fossils)]
-            deleted = set(previously_collected.name.values.tolist())
+            deleted = self.store.fossils.remove_collected(author.id, valid_fossils)
             didnt_have = valid_fossils - deleted
-            fossils = fossils.drop(previously_collected.index)
-            self.save_fossils(fossils)
             if deleted:
                 lines.append(
                     s("uncollect_fossil_deleted", items=", ".join(sorted(deleted)))
@@ -1133,13 +3831,8 @@ class Turbot(discord.Client):
             lines.append(s("uncollect_bugs"))
 
         if valid_fish:
-            fish = self.load_fish()
-            yours = fish[fish.author == author.id]
-            previously_collected = yours.loc[yours.name.isin(valid_fish)]
-            deleted = set(previously_collected.name.values.tolist())
+            deleted = self.store.fish.remove_collected(author.id, valid_fish)
             didnt_have = valid_fish - deleted
-            fish = fish.drop(previously_collected.index)
-            self.save_fish(fish)
             if deleted:
                 lines.append(
                     s("uncollect_fish_deleted", items=", ".join(sorted(deleted)))
@@ -1150,13 +3843,8 @@ class Turbot(discord.Client):
                 )
 
         if valid_art:
-            art = self.load_art()
-            yours = art[art.author == author.id]
-            previously_collected = yours.loc[yours.name.isin(valid_art)]
-            deleted = set(previously_collected.name.values.tolist())
+            deleted = self.store.art.remove_collected(author.id, valid_art)
             didnt_have = valid_art - deleted
-            art = art.drop(previously_collected.index)
-            self.save_art(art)
             if deleted:
                 lines.append(s("uncollect_art_deleted", items=", ".join(sorted(deleted))))
             if didnt_have:
@@ -1187,7 +3875,7 @@ class Turbot(discord.Client):
         valid_art = items.intersection(ART_SET)
         invalid = items.difference(COLLECTABLE_SET)
 
-        fossils = self.load_fossils()
+        fossils = self.store.fossils.load()
         fossil_users = fossils.author.unique()
         fossil_results = defaultdict(list)
         for collected_fossil in valid_fossils:
@@ -1200,7 +3888,7 @@ class Turbot(discord.Client):
         if valid_bugs:
             return s("search_bugs"), None
 
-        fish = self.load_fish()
+        fish = self.store.fish.load()
         fish_users = fish.author.unique()
         fish_results = defaultdict(list)
         for collected_fish in valid_fish:
@@ -1210,7 +3898,7 @@ class Turbot(discord.Client):
                 name = discord_user_from_id(channel, needer)
                 fish_results[name].append(collected_fish)
 
-        art = self.load_art()
+        art = self.store.art.load()
         art_users = art.author.unique()
         art_results = defaultdict(list)
         for collected_art in valid_art:
@@ -1269,20 +3957,11 @@ class Turbot(discord.Client):
         if not target_name or not target_id:
             return s("cant_find_user", name=target), None
 
-        fossils = self.load_fossils()
-        your_fossils = fossils[fossils.author == target_id]
-        collected_fossils = set(your_fossils.name.unique())
-        remaining_fossils = FOSSILS_SET - collected_fossils
+        remaining_fossils = self.store.fossils.uncollected(target_id)
 
-        fish = self.load_fish()
-        your_fish = fish[fish.author == target_id]
-        collected_fish = set(your_fish.name.unique())
-        remaining_fish = FISH_SET - collected_fish
+        remaining_fish = self.store.fish.uncollected(target_id)
 
-        art = self.load_art()
-        your_art = art[art.author == target_id]
-        collected_art = set(your_art.name.unique())
-        remaining_art = ART_SET - collected_art
+        remaining_art = self.store.art.uncollected(target_id)
 
         lines = []
 
@@ -1330,7 +4009,7 @@ class Turbot(discord.Client):
         """
         Lists all the needed fossils for all the channel members.
         """
-        fossils = self.load_fossils()
+        fossils = self.store.fossils.load()
         authors = [member.id for member in channel.members if member.id != self.user.id]
         total = pd.DataFrame(
             list(product(authors, FOSSILS_SET)), columns=["author", "name"]
@@ -1365,19 +4044,13 @@ class Turbot(discord.Client):
         if not target_name or not target_id:
             return s("cant_find_user", name=target), None
 
-        fossils = self.load_fossils()
-        your_fossils = fossils[fossils.author == target_id]
-        collected_fossils = set(your_fossils.name.unique())
+        collected_fossils = self.store.fossils.collected(target_id)
         all_fossils = len(collected_fossils) == len(FOSSILS_SET)
 
-        fish = self.load_fish()
-        your_fish = fish[fish.author == target_id]
-        collected_fish = set(your_fish.name.unique())
+        collected_fish = self.store.fish.collected(target_id)
         all_fish = len(collected_fish) == len(FISH_SET)
 
-        art = self.load_art()
-        your_art = art[art.author == target_id]
-        collected_art = set(your_art.name.unique())
+        collected_art = self.store.art.collected(target_id)
         all_art = len(collected_art) == len(ART_SET)
 
         lines = []
@@ -1425,8 +4098,16 @@ class Turbot(discord.Client):
     @command
     def predict(self, channel, author, params):
         """
-        Get a link to a prediction calculator for a price history. | [user]
+        Get a link to a prediction calculator for a price history. Use text to get the
+        predicted prices without a graph, which is faster, or all to rank everyone by
+        their chance of a spike. | [all or [text] [user]]
         """
+        if len(params) == 1 and params[0].lower() == "all":
+            return self._predict_all(channel), None
+
+        text = bool(params) and params[0].lower() == "text"
+        if text:
+            params = params[1:]
         target = author.id if not params else params[0]
         target_name = discord_user_name(channel, target)
         target_id = discord_user_id(channel, target_name)
@@ -1438,10 +4119,43 @@ class Turbot(discord.Client):
         if not timeline[0]:
             return s("cant_find_buy", name=target_name), None
 
-        self.generate_graph(channel, target_user, GRAPHCMD_FILE)
         query = ".".join((str(price) if price else "") for price in timeline).rstrip(".")
         url = f"{self.base_prophet_url}{query}"
-        return s("predict", name=target_name, url=url), discord.File(GRAPHCMD_FILE)
+
+        # rather than wait on busy graph renderers, just give the predicted prices
+        if text or not self.graph_is_ready(channel, target_user):
+            prediction = self.predictions.predict(self._get_island_data(target_user))
+            return predict_text(target_name, prediction, url), None
+
+        attachment = self.attach_graph(channel, target_user, "predict.png")
+        return s("predict", name=target_name, url=url), attachment
+
+    def _predict_all(self, channel):
+        """Ranks everyone in the channel by their chance of a spike this week."""
+        names = {member.id: str(member) for member in channel.members}
+        timelines = self.get_user_timelines(list(names))
+        users = [user_id for user_id, timeline in timelines.items() if timeline[0]]
+        if not users:
+            return s("predict_all_none")
+        islands = [island_data(timelines[user]) for user in users]
+        predictions = self.predictions.predict_all(islands)
+
+        ranked = []  # the chance of a spike, negated so the best sort first, with lines
+        for user_id, prediction in zip(users, predictions):
+            name = names[user_id]
+            if not len(prediction):
+                ranked.append((1, name, s("predict_all_no_patterns", name=name)))
+                continue
+            chance, period = prediction.spike()
+            if period is None:
+                line = s("predict_all_no_spike", name=name)
+            else:
+                period = period.replace("_", " ")
+                line = s(
+                    "predict_all_spike", name=name, chance=f"{chance:.0%}", period=period
+                )
+            ranked.append((-chance, name, line))
+        return "\n".join([s("predict_all"), *(line for _, _, line in sorted(ranked))])
 
     @command
     def pref(self, channel, author, params):
@@ -1489,30 +4203,19 @@ class Turbot(discord.Client):
         lines = []
         if valid:
             lines.append(s("count_fossil_valid_header"))
-            fossils = self.load_fossils()
             for user_name, user_id in sorted(valid):
-                yours = fossils[fossils.author == user_id]
-                collected = set(yours.name.unique())
-                remaining = FOSSILS_SET - collected
-                lines.append(
-                    s("count_fossil_valid", name=user_name, count=len(remaining))
-                )
+                remaining = len(FOSSILS_SET) - self.store.fossils.count(user_id)
+                lines.append(s("count_fossil_valid", name=user_name, count=remaining))
 
             lines.append(s("count_fish_valid_header"))
-            fish = self.load_fish()
             for user_name, user_id in sorted(valid):
-                yours = fish[fish.author == user_id]
-                collected = set(yours.name.unique())
-                remaining = FISH_SET - collected
-                lines.append(s("count_fish_valid", name=user_name, count=len(remaining)))
+                remaining = len(FISH_SET) - self.store.fish.count(user_id)
+                lines.append(s("count_fish_valid", name=user_name, count=remaining))
 
             lines.append(s("count_art_valid_header"))
-            art = self.load_art()
             for user_name, user_id in sorted(valid):
-                yours = art[art.author == user_id]
-                collected = set(yours.name.unique())
-                remaining = ART_SET - collected
-                lines.append(s("count_art_valid", name=user_name, count=len(remaining)))
+                remaining = len(ART_SET) - self.store.art.count(user_id)
+                lines.append(s("count_art_valid", name=user_name, count=remaining))
 
         if invalid:
             lines.append(s("count_invalid_header"))
@@ -1658,13 +4361,12 @@ class Turbot(discord.Client):
                 return s(f"{kind}_none_found", search=user_input)
         else:
             if kind == "fish":
-                caught = self.load_fish()
-                caught = caught[caught.author == author.id]
+                caught = self.store.fish.collected(author.id)
             else:  # kind == "bugs"
                 caught = None  # not supported yet
 
-            if caught is not None and not caught.empty:
-                already = available.loc[available.name.isin(caught.name)]
+            if caught:
+                already = available.loc[available.name.isin(caught)]
                 available = available.drop(already.index)
 
             found = available
@@ -1827,9 +4529,7 @@ class Turbot(discord.Client):
 
         query = " ".join(params).lower()  # allow spaces in names
 
-        users = self.load_users()
-        for _, row in users.iterrows():
-            user_id = int(row["author"])
+        for user_id in self.store.users.authors():
             user_name = discord_user_name(channel, user_id)
             if not user_name:
                 continue
@@ -1945,6 +4645,89 @@ def get_channels(channels_file):  # pragma: no cover
     default=DEFAULT_DB_USERS,
     help="read users preferences data from this file",
 )
+@click.option(
+    "-s",
+    "--storage",
+    type=click.Choice(STORAGE_BACKENDS),
+    default="csv",
+    help="store application data in csv files, binary npz snapshots next to them, "
+    "or a sqlite database",
+)
+@click.option(
+    "--db-file",
+    default=DEFAULT_DB_SQLITE,
+    help="read and write all application data to this sqlite database "
+    "when using sqlite storage; existing csv files are imported into a new database",
+)
+@click.option(
+    "--flush-interval",
+    type=float,
+    help="buffer changes to application data and write them out together "
+    "every this many seconds; by default every change is written immediately",
+)
+@click.option(
+    "--flush-threshold",
+    type=int,
+    default=DEFAULT_FLUSH_THRESHOLD,
+    help="when buffering changes, write them out once this many are pending",
+)
+@click.option(
+    "--export-csv",
+    default=False,
+    is_flag=True,
+    help="write all application data from the chosen storage to the csv files and exit",
+)
+@click.option(
+    "--backup-retention",
+    type=click.IntRange(min=1),
+    default=DEFAULT_BACKUP_RETENTION,
+    help="keep this many of the most recent price backups taken by !reset",
+)
+@click.option(
+    "--retention-weeks",
+    type=int,
+    help="archive prices older than this many weeks, keeping a weekly summary "
+    "of each user's prices; by default prices are kept forever",
+)
+@click.option(
+    "--retention-interval",
+    type=float,
+    default=DEFAULT_RETENTION_INTERVAL,
+    help="when archiving prices, check for old prices every this many seconds",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=DEFAULT_WORKERS,
+    help="run up to this many commands at the same time",
+)
+@click.option(
+    "--render-workers",
+    type=int,
+    default=DEFAULT_RENDER_WORKERS,
+    help="render up to this many graphs at the same time in worker processes; "
+    "with 0 graphs are rendered in the bot's own process",
+)
+@click.option(
+    "--graph-cache-size",
+    type=int,
+    default=DEFAULT_GRAPH_CACHE_SIZE,
+    help="keep up to this many bytes of rendered graphs cached",
+)
+@click.option(
+    "--prediction-cache-dir",
+    help="also cache turnip price predictions in this directory so that they're kept "
+    "across restarts",
+)
+@click.option(
+    "--list-backups", default=False, is_flag=True, help="list the price backups and exit",
+)
+@click.option(
+    "--restore-backup",
+    metavar="BACKUP",
+    help="replace all price data with the given backup, or with the latest backup "
+    "when given latest, reopening the week that its !reset closed, and exit",
+)
 @click.version_option(version=__version__)
 @click.option(
     "--dev",
@@ -1963,8 +4746,49 @@ def main(
     fish_file,
     fossils_file,
     users_file,
+    storage,
+    db_file,
+    flush_interval,
+    flush_threshold,
+    export_csv,
+    backup_retention,
+    retention_weeks,
+    retention_interval,
+    workers,
+    render_workers,
+    graph_cache_size,
+    prediction_cache_dir,
+    list_backups,
+    restore_backup,
     dev,
 ):  # pragma: no cover
+    files = dict(
+        prices_file=prices_file,
+        art_file=art_file,
+        fish_file=fish_file,
+        fossils_file=fossils_file,
+        users_file=users_file,
+    )
+    if export_csv:
+        if storage != "csv":
+            open_storage(storage, db_file=db_file, **files).copy_to(
+                open_storage("csv", **files)
+            )
+        return
+
+    if list_backups or restore_backup:
+        backups = PriceBackups(
+            Path(prices_file).parent / "backups", keep=backup_retention
+        )
+        if list_backups:
+            for manifest in backups.backups():
+                print(manifest.name)
+        if restore_backup:
+            store = open_storage(storage, db_file=db_file, **files)
+            store.prices.replace_weeks(backups.restore(restore_backup))
+            store.flush()
+        return
+
     auth_channels = get_channels(auth_channels_file) + list(channel)
     if not auth_channels:
         print("error: you must provide at least one authorized channel", file=sys.stderr)
@@ -1988,6 +4812,17 @@ def main(
         fish_file=fish_file,
         fossils_file=fossils_file,
         users_file=users_file,
+        storage=storage,
+        db_file=db_file,
+        flush_interval=flush_interval,
+        flush_threshold=flush_threshold,
+        backup_retention=backup_retention,
+        retention_weeks=retention_weeks,
+        retention_interval=retention_interval,
+        workers=workers,
+        render_workers=render_workers,
+        graph_cache_size=graph_cache_size,
+        prediction_cache_dir=prediction_cache_dir,
         log_level=getattr(logging, "DEBUG" if verbose else log_level),
     ).run()
 
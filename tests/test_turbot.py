@@ -1,22 +1,29 @@
+import asyncio
 import inspect
 import json
+import multiprocessing
 import random
 import re
+import sqlite3
+import threading
 from collections import defaultdict
+from concurrent import futures
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from os import chdir
+from os import chdir, utime
 from os.path import dirname, realpath
 from pathlib import Path
 from subprocess import run
 from unittest.mock import MagicMock, Mock
 
+import numpy as np
 import pytest
 import pytz
 import toml
 from callee import Matching
 
 import turbot
+from turnips.archipelago import Archipelago
 
 ##############################
 # Discord.py Mocks
@@ -128,6 +135,9 @@ class MockDiscordClient:
     def __init__(self):
         self.user = ADMIN
 
+    async def close(self):
+        pass
+
 
 ##############################
 # Test Suite Constants
@@ -215,7 +225,6 @@ def set_random_seed():
 
 @pytest.fixture
 def client(monkeypatch, freezer, patch_discord, tmp_path):
-    monkeypatch.setattr(turbot, "GRAPHCMD_FILE", tmp_path / "graphcmd.png")
     monkeypatch.setattr(turbot, "LASTWEEKCMD_FILE", tmp_path / "lastweek.png")
     monkeypatch.setattr(turbot, "s", S_SPY)
     freezer.move_to(NOW)
@@ -227,7 +236,35 @@ def client(monkeypatch, freezer, patch_discord, tmp_path):
         fish_file=tmp_path / "fish.csv",
         fossils_file=tmp_path / "fossils.csv",
         users_file=tmp_path / "users.csv",
+        render_workers=0,
+    )
+
+
+@pytest.fixture
+def sqlite_client(client, tmp_path):
+    client.store = turbot.open_storage(
+        "sqlite",
+        prices_file=client.prices_file,
+        art_file=client.art_file,
+        fish_file=client.fish_file,
+        fossils_file=client.fossils_file,
+        users_file=client.users_file,
+        db_file=tmp_path / "turbot.db",
+    )
+    return client
+
+
+@pytest.fixture
+def npz_client(client):
+    client.store = turbot.open_storage(
+        "npz",
+        prices_file=client.prices_file,
+        art_file=client.art_file,
+        fish_file=client.fish_file,
+        fossils_file=client.fossils_file,
+        users_file=client.users_file,
     )
+    return client
 
 
 @pytest.fixture
@@ -245,20 +282,14 @@ def lines():
 
 @pytest.fixture
 def graph(mocker, monkeypatch):
-    def create_file(*args, **kwargs):
-        Path(turbot.GRAPHCMD_FILE).touch()
-
-    mock = mocker.Mock(side_effect=create_file)
+    mock = mocker.Mock(return_value=b"graph")
     monkeypatch.setattr(turbot.Turbot, "generate_graph", mock)
     return mock
 
 
 @pytest.fixture
 def lastweek(mocker, monkeypatch):
-    def create_file(*args, **kwargs):
-        Path(turbot.LASTWEEKCMD_FILE).touch()
-
-    mock = mocker.Mock(side_effect=create_file)
+    mock = mocker.Mock(return_value=b"lastweek")
     monkeypatch.setattr(turbot.Turbot, "generate_graph", mock)
     return mock
 
@@ -795,6 +826,42 @@ class TestTurbot:
             f"> **{FRIEND}:** {turbot.h(friend_now)} for 200 bells"
         )
 
+    async def test_on_message_bestsell_window(self, client, channel, freezer):
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 600"))
+        await client.on_message(MockMessage(BUDDY, channel, "!sell 300"))
+        freezer.move_to(NOW + timedelta(hours=6))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        await client.on_message(MockMessage(BUDDY, channel, "!sell 300"))
+        await client.on_message(MockMessage(GUY, channel, "!sell 400"))
+
+        await client.on_message(MockMessage(someone(), channel, "!bestsell"))
+        assert channel.last_sent_response == (
+            "__**Best Selling Prices in the Last 12 Hours**__\n"
+            f"> **{FRIEND}:** 6 hours ago for 600 bells\n"
+            f"> **{GUY}:** now for 400 bells\n"
+            f"> **{BUDDY}:** 6 hours ago for 300 bells\n"
+            f"> **{BUDDY}:** now for 300 bells"
+        )
+
+        # once the first prices are more than 12 hours old they no longer count
+        freezer.move_to(NOW + timedelta(hours=13))
+        await client.on_message(MockMessage(someone(), channel, "!bestsell"))
+        assert channel.last_sent_response == (
+            "__**Best Selling Prices in the Last 12 Hours**__\n"
+            f"> **{GUY}:** 7 hours ago for 400 bells\n"
+            f"> **{BUDDY}:** 7 hours ago for 300 bells\n"
+            f"> **{FRIEND}:** 7 hours ago for 200 bells"
+        )
+
+        # prices removed from the store are gone from the best prices too
+        await client.on_message(MockMessage(GUY, channel, "!oops"))
+        await client.on_message(MockMessage(someone(), channel, "!bestsell"))
+        assert channel.last_sent_response == (
+            "__**Best Selling Prices in the Last 12 Hours**__\n"
+            f"> **{BUDDY}:** 7 hours ago for 300 bells\n"
+            f"> **{FRIEND}:** 7 hours ago for 200 bells"
+        )
+
     async def test_on_message_oops(self, client, channel, lines):
         author = someone()
         await client.on_message(MockMessage(author, channel, "!buy 1"))
@@ -928,8 +995,32 @@ class TestTurbot:
         channel.sent.assert_called_with(
             "__**Historical Graph for All Users**__", file=Matching(is_discord_file)
         )
-        graph.assert_called_with(channel, None, turbot.GRAPHCMD_FILE)
-        assert Path(turbot.GRAPHCMD_FILE).exists()
+        graph.assert_called_with(channel, None)
+        assert channel.last_sent_call["kwargs"]["file"].fp.read() == b"graph"
+
+    async def test_on_message_graph_top(self, client, channel, graph):
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 600"))
+        await client.on_message(MockMessage(BUDDY, channel, "!sell 90"))
+
+        await client.on_message(MockMessage(someone(), channel, "!graph top 5"))
+        channel.sent.assert_called_with(
+            "__**Historical Graph for the Top 5 Sellers**__",
+            file=Matching(is_discord_file),
+        )
+        graph.assert_called_with(channel, None, top=5)
+
+        await client.on_message(MockMessage(someone(), channel, "!graph sample"))
+        graph.assert_called_with(channel, None, points=turbot.GRAPH_MODES["sample"])
+
+    async def test_on_message_graph_bad_mode(self, client, channel, graph):
+        for params in ["nope", "top zero", "sample 0", "top 1 2"]:
+            await client.on_message(MockMessage(someone(), channel, f"!graph {params}"))
+            assert channel.last_sent_response == (
+                "Use !graph top [count] to graph only the users with the best selling "
+                "prices, or !graph sample [points] to graph at most that many prices "
+                "for each user."
+            )
+        graph.assert_not_called()
 
     async def test_on_message_lastweek_none(self, client, channel):
         await client.on_message(MockMessage(someone(), channel, "!lastweek"))
@@ -942,8 +1033,8 @@ class TestTurbot:
     async def test_on_message_lastweek(self, client, channel, lastweek):
         await client.on_message(MockMessage(someturbotadmin(), channel, "!reset"))
         assert channel.last_sent_response == ("**Resetting data for a new week!**")
-        lastweek.assert_called_with(channel, None, turbot.LASTWEEKCMD_FILE)
-        assert Path(turbot.LASTWEEKCMD_FILE).exists()
+        lastweek.assert_called_with(channel, None)
+        assert Path(turbot.LASTWEEKCMD_FILE).read_bytes() == b"lastweek"
 
         await client.on_message(MockMessage(someone(), channel, "!lastweek"))
         channel.sent.assert_called_with(
@@ -1024,14 +1115,274 @@ class TestTurbot:
                 f"{BUDDY.id},buy,122,{later}\n",
                 f"{GUY.id},buy,102,{later}\n",
             ]
-        lastweek.assert_called_with(channel, None, turbot.LASTWEEKCMD_FILE)
-        assert Path(turbot.LASTWEEKCMD_FILE).exists()
+        lastweek.assert_called_with(channel, None)
+        assert Path(turbot.LASTWEEKCMD_FILE).read_bytes() == b"lastweek"
 
         # ensure the backup is correct
         backup_file = Path(client.last_backup_filename())
         assert backup_file.exists()
-        with open(backup_file) as f:
-            assert old_data == f.readlines()
+        restored = client.backups.restore(backup_file)[-1].to_csv(index=False)
+        assert old_data == restored.splitlines(keepends=True)
+
+    async def test_close_week(self, client, channel, freezer, lastweek, tmp_path):
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        await client.on_message(MockMessage(someturbotadmin(), channel, "!reset"))
+        freezer.move_to(NOW + timedelta(days=7))
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 110"))
+        await client.on_message(MockMessage(BUDDY, channel, "!sell 300"))
+        await client.on_message(MockMessage(someturbotadmin(), channel, "!reset"))
+
+        # each reset writes the open week aside
+        closed = sorted(path.name for path in (tmp_path / "prices-weeks").glob("*.csv"))
+        assert closed == ["0000.csv", "0001.csv"]
+        store = client.store.prices
+        assert store.weeks() == [0, 1]
+        assert store.load_week(0).price.tolist() == [100, 200]
+        assert store.load_week(1).price.tolist() == [100, 110, 300]
+        assert store.load().price.tolist() == [110]
+
+    async def test_close_week_writes_carried_buys(self, tmp_path):
+        store = turbot.CsvPriceStore(tmp_path / "prices.csv")
+        store.write_behind = True
+        store.append_price(FRIEND.id, "buy", 100, NOW)
+        store.append_price(FRIEND.id, "sell", 200, NOW)
+        store.close_week()
+
+        # the new week is on disk with the carried buys before anything is flushed
+        assert store.pending == 0
+        reopened = turbot.CsvPriceStore(tmp_path / "prices.csv")
+        assert reopened.load().price.tolist() == [100]
+        assert reopened.load_week(0).price.tolist() == [100, 200]
+
+    async def test_close_week_history(self, client, channel, freezer, lastweek):
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        await client.on_message(MockMessage(BUDDY, channel, "!sell 250"))
+        await client.on_message(MockMessage(someturbotadmin(), channel, "!reset"))
+        later = NOW + timedelta(days=7)
+        freezer.move_to(later)
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 300"))
+
+        # closed weeks are still in the history, with carried over buys only once
+        await client.on_message(MockMessage(FRIEND, channel, "!history"))
+        ts = f"{turbot.h(NOW)} ({turbot.day_and_time(NOW)})"
+        later_ts = f"{turbot.h(later)} ({turbot.day_and_time(later)})"
+        assert channel.last_sent_response == (
+            f"__**Historical info for {FRIEND}**__\n"
+            f"> Can buy turnips from Daisy Mae for 100 bells {ts}\n"
+            f"> Can sell turnips to Timmy & Tommy for 200 bells {ts}\n"
+            f"> Can sell turnips to Timmy & Tommy for 300 bells {later_ts}"
+        )
+
+    async def test_close_week_history_is_indexed(
+        self, client, channel, freezer, lastweek, monkeypatch
+    ):
+        for week in range(turbot.HISTORY_WEEKS + 1):
+            freezer.move_to(NOW + timedelta(days=7 * week))
+            await client.on_message(MockMessage(FRIEND, channel, f"!sell {100 + week}"))
+            await client.on_message(MockMessage(someturbotadmin(), channel, "!reset"))
+
+        store = client.store.prices
+        read = []
+        read_week = store._read_week
+
+        def counted(week):
+            read.append(week)
+            return read_week(week)
+
+        monkeypatch.setattr(store, "_read_week", counted)
+
+        # closed weeks are indexed as they're closed so they're never read back
+        await client.on_message(MockMessage(FRIEND, channel, "!history"))
+        assert read == []
+
+        # and after a restart each week is only read the first time it's needed
+        store._closed_index = {}
+        await client.on_message(MockMessage(FRIEND, channel, "!history"))
+        await client.on_message(MockMessage(FRIEND, channel, "!history"))
+        assert read == [1, 2, 3, 4]
+
+        # only the most recent weeks are shown
+        prices = re.findall(r"for (\d+) bells", channel.last_sent_response)
+        assert prices == ["101", "102", "103", "104"]
+
+    async def test_close_week_engines(self, tmp_path):
+        for engine in ["memory", "csv", "npz", "sqlite"]:
+            store = turbot.open_storage(
+                engine,
+                prices_file=tmp_path / engine / "prices.csv",
+                db_file=tmp_path / engine / "turbot.db",
+            ).prices
+            (tmp_path / engine).mkdir()
+            store.append_price(FRIEND.id, "buy", 100, NOW)
+            store.append_price(FRIEND.id, "sell", 200, NOW + timedelta(days=1))
+            store.append_price(BUDDY.id, "sell", 300, NOW + timedelta(days=1))
+            closed = store.close_week()
+            assert closed.price.tolist() == [100, 200, 300]
+            store.append_price(FRIEND.id, "sell", 400, NOW + timedelta(days=8))
+            assert store.close_week().price.tolist() == [100, 400]
+
+            assert store.weeks() == [0, 1], engine
+            assert store.load_week(0).price.tolist() == [100, 200, 300], engine
+            assert store.load_week(1).price.tolist() == [100, 400], engine
+            assert store.load().price.tolist() == [100], engine
+            assert store.prices_for(FRIEND.id).price.tolist() == [100], engine
+
+    async def test_retention(
+        self, client, channel, freezer, lastweek, monkeypatch, tmp_path
+    ):
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        await client.on_message(MockMessage(someturbotadmin(), channel, "!reset"))
+        freezer.move_to(NOW + timedelta(days=2))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 300"))
+        freezer.move_to(NOW + timedelta(days=16))
+
+        slept = []
+
+        async def sleep(delay):
+            if slept:
+                raise asyncio.CancelledError()
+            slept.append(delay)
+
+        # retention runs right away and then again after every interval
+        monkeypatch.setattr(turbot.asyncio, "sleep", sleep)
+        client.retention_weeks = 1
+        with pytest.raises(asyncio.CancelledError):
+            await client.retain_periodically()
+        assert slept == [turbot.DEFAULT_RETENTION_INTERVAL]
+
+        # old prices are archived by week but the latest buy price is kept
+        store = client.store.prices
+        assert store.weeks() == []
+        assert store.load().price.tolist() == [100]
+        archived = sorted(path.name for path in (tmp_path / "archive").glob("*.gz"))
+        assert archived == ["prices-1982-04-18.csv.gz", "prices-1982-04-25.csv.gz"]
+        week = datetime(1982, 4, 18).date()
+        assert client.archive.load_week(week).price.tolist() == [100, 200]
+
+        await client.on_message(MockMessage(FRIEND, channel, "!history"))
+        ts = f"{turbot.h(NOW)} ({turbot.day_and_time(NOW)})"
+        assert channel.last_sent_response == (
+            f"__**Historical info for {FRIEND}**__\n"
+            "> Week of 1982-04-18: bought for 100 bells, "
+            "sold for up to 200 bells (- - - - - - - - - - 200 -)\n"
+            "> Week of 1982-04-25: bought for ? bells, "
+            "sold for up to 300 bells (300 - - - - - - - - - - -)\n"
+            f"> Can buy turnips from Daisy Mae for 100 bells {ts}"
+        )
+
+    async def test_expire_engines(self, tmp_path):
+        for engine in ["memory", "csv", "npz", "sqlite"]:
+            store = turbot.open_storage(
+                engine,
+                prices_file=tmp_path / engine / "prices.csv",
+                db_file=tmp_path / engine / "turbot.db",
+            ).prices
+            (tmp_path / engine).mkdir()
+            store.append_price(FRIEND.id, "buy", 100, NOW)
+            store.append_price(FRIEND.id, "sell", 200, NOW)
+            store.close_week()
+            store.append_price(BUDDY.id, "sell", 300, NOW + timedelta(days=8))
+            store.close_week()
+            store.append_price(BUDDY.id, "sell", 400, NOW + timedelta(days=9))
+            store.append_price(BUDDY.id, "sell", 500, NOW + timedelta(days=15))
+
+            archived = []
+            assert store.expire(NOW + timedelta(days=10), archived.append) == [0, 1]
+            assert archived[0].price.tolist() == [100, 200, 100, 300, 400], engine
+            assert store.weeks() == [], engine
+            assert store.load().price.tolist() == [100, 500], engine
+            assert store.prices_for(BUDDY.id).price.tolist() == [500], engine
+
+    async def test_replace_weeks_engines(self, tmp_path):
+        for engine in ["memory", "csv", "npz", "sqlite"]:
+            store = turbot.open_storage(
+                engine,
+                prices_file=tmp_path / engine / "prices.csv",
+                db_file=tmp_path / engine / "turbot.db",
+            ).prices
+            (tmp_path / engine).mkdir()
+            store.append_price(FRIEND.id, "buy", 100, NOW)
+            store.close_week()
+            store.close_week()
+            store.append_price(FRIEND.id, "sell", 200, NOW + timedelta(days=8))
+            first = store.load_week(1).copy()
+            live = store.load().copy()
+
+            store.replace_weeks([first, live])
+            assert store.weeks() == [0], engine
+            assert store.load_week(0).price.tolist() == [100], engine
+            assert store.load().price.tolist() == [100, 200], engine
+            assert store.closed_prices_for(FRIEND.id)[0].price.tolist() == [100], engine
+
+    async def test_price_backups(self, client, channel, freezer, lastweek, tmp_path):
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        await client.on_message(MockMessage(someturbotadmin(), channel, "!reset"))
+        first = Path(client.last_backup_filename())
+        objects = tmp_path / "backups" / "objects"
+        assert len(list(objects.iterdir())) == 1
+
+        # a backup taken in the same second doesn't overwrite the first one
+        second = client.backups.save(client.backups.restore(first))
+        assert first != second
+        assert client.backups.backups() == [first, second]
+        assert len(list(objects.iterdir())) == 1
+
+        # each closed week of prices is only ever stored once across backups
+        freezer.move_to(NOW + timedelta(days=7))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 300"))
+        await client.on_message(MockMessage(someturbotadmin(), channel, "!reset"))
+        third = Path(client.last_backup_filename())
+        assert len(list(objects.iterdir())) == 2
+        manifests = [json.loads(path.read_text()) for path in (first, third)]
+        assert manifests[1]["objects"][0] == manifests[0]["objects"][0]
+
+        weeks = client.backups.restore(first)
+        assert [week.price.tolist() for week in weeks] == [[100, 200]]
+        weeks = client.backups.restore()
+        assert [week.price.tolist() for week in weeks] == [[100, 200], [100, 300]]
+        loaded_dtypes = [str(t) for t in weeks[-1].dtypes.tolist()]
+        assert loaded_dtypes == ["int64", "category", "int64", "datetime64[ns, UTC]"]
+
+        # restoring a backup reopens the week that its reset closed
+        client.store.prices.replace_weeks(weeks)
+        assert client.store.prices.weeks() == [0]
+        assert client.store.prices.load_week(0).price.tolist() == [100, 200]
+        assert client.store.prices.load().price.tolist() == [100, 300]
+
+        # only the most recent backups and the objects they use are kept
+        fourth = client.backups.save(weeks[-1:])
+        client.backups.keep = 1
+        client.backups.prune()
+        assert client.backups.backups() == [fourth]
+        assert len(list(objects.iterdir())) == 1
+        weeks = client.backups.restore(fourth.name)
+        assert [week.price.tolist() for week in weeks] == [[100, 300]]
+
+    async def test_price_backups_unknown(self, client, channel, lastweek, tmp_path):
+        with pytest.raises(ValueError):
+            turbot.PriceBackups(tmp_path / "backups", keep=0)
+        turbot.PriceBackups(tmp_path / "backups", keep=None).prune()
+
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        await client.on_message(MockMessage(someturbotadmin(), channel, "!reset"))
+        name = Path(client.last_backup_filename()).name
+        with pytest.raises(turbot.click.BadParameter, match=name):
+            client.backups.restore("prices-2000-01-01-000000.json")
+
+    async def test_price_backups_corrupt(self, client, channel, tmp_path):
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        client.backups.save([client.store.prices.load()])
+        with pytest.raises(FileNotFoundError):
+            turbot.PriceBackups(tmp_path / "nothing").restore()
+
+        blob = next((tmp_path / "backups" / "objects").iterdir())
+        blob.write_bytes(turbot.gzip.compress(b"author,kind,price,timestamp\n"))
+        with pytest.raises(turbot.CorruptSnapshotError):
+            client.backups.restore()
 
     async def test_on_message_collect_no_list(self, client, channel):
         await client.on_message(MockMessage(someone(), channel, "!collect"))
@@ -1744,6 +2095,164 @@ class TestTurbot:
             file=Matching(is_discord_file),
         )
 
+    async def test_on_message_predict_text(self, client, channel, freezer):
+        author = someone()
+
+        sunday_am = datetime(2020, 4, 26, 9, tzinfo=pytz.utc)
+        freezer.move_to(sunday_am)
+        await client.on_message(MockMessage(author, channel, "!buy 100"))
+        freezer.move_to(sunday_am + timedelta(days=1))
+        await client.on_message(MockMessage(author, channel, "!sell 88"))
+        freezer.move_to(sunday_am + timedelta(days=1, hours=12))
+        await client.on_message(MockMessage(author, channel, "!sell 84"))
+
+        await client.on_message(MockMessage(author, channel, "!predict text"))
+        channel.sent.assert_called_with(
+            f"__**Predicted Prices for {author}**__ (most likely a decay pattern, 38%)\n"
+            "> Monday AM: 88 bells\n"
+            "> Monday PM: 84 bells\n"
+            "> Tuesday AM: 79 to 140 bells (8% chance of a profit)\n"
+            "> Tuesday PM: 74 to 200 bells (17% chance of a profit)\n"
+            "> Wednesday AM: 69 to 600 bells (28% chance of a profit)\n"
+            "> Wednesday PM: 64 to 600 bells (38% chance of a profit)\n"
+            "> Thursday AM: 59 to 600 bells (47% chance of a profit)\n"
+            "> Thursday PM: 40 to 600 bells (47% chance of a profit)\n"
+            "> Friday AM: 35 to 600 bells (39% chance of a profit)\n"
+            "> Friday PM: 31 to 600 bells (30% chance of a profit)\n"
+            "> Saturday AM: 26 to 200 bells (19% chance of a profit)\n"
+            "> Saturday PM: 21 to 199 bells (9% chance of a profit)\n"
+            "> Best time to sell: Thursday AM, for about 120 bells\n"
+            "Details: <https://turnipprophet.io/?prices=100.88.84>"
+        )
+
+        freezer.move_to(sunday_am + timedelta(days=2))
+        await client.on_message(MockMessage(author, channel, "!sell 500"))
+        await client.on_message(MockMessage(author, channel, f"!predict text {author}"))
+        channel.sent.assert_called_with(
+            f"The prices for {author} don't fit any turnip price pattern.\n"
+            "Details: <https://turnipprophet.io/?prices=100.88.84.500>"
+        )
+
+    async def test_on_message_predict_busy_renderer(
+        self, client, channel, freezer, graph, monkeypatch
+    ):
+        author = someone()
+        freezer.move_to(datetime(2020, 4, 26, 9, tzinfo=pytz.utc))
+        await client.on_message(MockMessage(author, channel, "!buy 100"))
+
+        monkeypatch.setattr(client.renderer, "saturated", lambda: True)
+        await client.on_message(MockMessage(author, channel, "!predict"))
+        assert channel.last_sent_response.startswith(
+            f"__**Predicted Prices for {author}**__"
+        )
+        graph.assert_not_called()
+
+        # a graph that's already been rendered doesn't need the renderer
+        monkeypatch.setattr(client.graph_cache, "get", lambda key: b"graph")
+        await client.on_message(MockMessage(author, channel, "!predict"))
+        channel.sent.assert_called_with(
+            f"__**Predictive Graph for {author}**__\n"
+            "Details: <https://turnipprophet.io/?prices=100>",
+            file=Matching(is_discord_file),
+        )
+
+    async def test_on_message_predict_all(self, client, channel, freezer, monkeypatch):
+        await client.on_message(MockMessage(FRIEND, channel, "!predict all"))
+        assert channel.last_sent_response == "No one has logged a buy price this Sunday."
+
+        sunday_am = datetime(2020, 4, 26, 9, tzinfo=pytz.utc)
+        logged = {
+            FRIEND: [100, 88, 84],
+            BUDDY: [95, 85, 80, 76, 120],
+            GUY: [100, 500],
+            DUDE: [100, 88, 84, 80, 76, 72, 68, 64, 60, 56, 52],
+        }
+        for user, prices in logged.items():
+            freezer.move_to(sunday_am)
+            await client.on_message(MockMessage(user, channel, f"!buy {prices[0]}"))
+            for halfdays, price in enumerate(prices[1:], start=2):
+                freezer.move_to(sunday_am + timedelta(hours=12 * halfdays))
+                await client.on_message(MockMessage(user, channel, f"!sell {price}"))
+
+        await client.on_message(MockMessage(FRIEND, channel, "!predict all"))
+        assert channel.last_sent_response == (
+            "__**Chances of a Spike This Week**__\n"
+            f"> **{BUDDY}**: 53% chance of a spike, most likely peaking Wednesday PM\n"
+            f"> **{FRIEND}**: 33% chance of a spike, most likely peaking Wednesday AM\n"
+            f"> **{DUDE}**: no chance of a spike\n"
+            f"> **{GUY}**: prices don't fit any turnip price pattern"
+        )
+        ranked = channel.last_sent_response
+
+        # predictions are cached, so only islands with new prices are fit again
+        fitted = []
+
+        def predict_islands(islands):
+            fitted.append(len(islands))
+            return original(islands)
+
+        original = turbot.predict_islands
+        monkeypatch.setattr(turbot, "predict_islands", predict_islands)
+        await client.on_message(MockMessage(FRIEND, channel, "!predict all"))
+        assert channel.last_sent_response == ranked
+        assert fitted == []
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 80"))
+        await client.on_message(MockMessage(FRIEND, channel, "!predict all"))
+        assert fitted == [1]
+
+    async def test_get_user_timelines(self, client, channel, freezer):
+        users = [FRIEND, BUDDY, GUY, DUDE]
+        ids = [user.id for user in users]
+
+        def assert_timelines_are_current():
+            timelines = client.get_user_timelines(ids)
+            rebuilt = turbot.TimelineIndex(
+                lambda: client.store.prices, client.get_user_timezone
+            ).get_many(ids)
+            assert timelines == rebuilt
+            for user in users:
+                assert timelines[user.id] == client.get_user_timeline(user.id)
+            return timelines
+
+        await client.on_message(
+            MockMessage(BUDDY, channel, "!pref timezone America/Los_Angeles")
+        )
+        await client.on_message(MockMessage(GUY, channel, "!pref timezone Asia/Tokyo"))
+        assert_timelines_are_current()  # everyone's timeline is indexed from here on
+
+        sunday_am = datetime(2020, 4, 26, 9, tzinfo=pytz.utc)
+        for user in [FRIEND, BUDDY, GUY]:
+            freezer.move_to(sunday_am - timedelta(days=7))
+            await client.on_message(MockMessage(user, channel, "!buy 90"))
+            freezer.move_to(sunday_am)
+            await client.on_message(MockMessage(user, channel, "!buy 100"))
+            for hours in range(8, 150, 7):
+                freezer.move_to(sunday_am + timedelta(hours=hours))
+                await client.on_message(MockMessage(user, channel, f"!sell {hours}"))
+        await client.on_message(MockMessage(DUDE, channel, "!sell 100"))
+        timelines = assert_timelines_are_current()
+        assert timelines[FRIEND.id][0] == 100
+        assert timelines[DUDE.id] == [None] * 13
+
+        # a price logged out of order, undoing prices, changing timezones and clearing
+        client.append_price(FRIEND, "sell", 77, sunday_am + timedelta(hours=30))
+        assert_timelines_are_current()
+        await client.on_message(MockMessage(BUDDY, channel, "!oops"))
+        assert_timelines_are_current()
+        await client.on_message(MockMessage(FRIEND, channel, "!pref timezone Asia/Tokyo"))
+        assert_timelines_are_current()
+        await client.on_message(MockMessage(GUY, channel, "!clear"))
+        assert assert_timelines_are_current()[GUY.id] == [None] * 13
+
+        # closing the week keeps only the buy
+        client.timelines.close_week()
+        timelines = assert_timelines_are_current()
+        assert timelines[BUDDY.id] == [100] + [None] * 12
+
+        # and the timelines expire along with the buy
+        freezer.move_to(sunday_am + timedelta(days=12))
+        assert client.get_user_timeline(BUDDY.id) == [None] * 13
+
     async def test_get_last_price(self, client, channel, freezer):
         # when there's no data for the user
         assert client.get_last_price(GUY) is None
@@ -1897,11 +2406,11 @@ class TestTurbot:
         assert len(channel.all_sent_calls) == 3
 
     async def test_load_prices_new(self, client):
-        prices = client.load_prices()
+        prices = client.store.prices.load()
         assert prices.empty
 
         loaded_dtypes = [str(t) for t in prices.dtypes.tolist()]
-        assert loaded_dtypes == ["int64", "object", "int64", "datetime64[ns, UTC]"]
+        assert loaded_dtypes == ["int64", "category", "int64", "datetime64[ns, UTC]"]
 
     async def test_load_prices_existing(self, client):
         data = [
@@ -1920,12 +2429,712 @@ class TestTurbot:
             for line in data:
                 f.write(f"{','.join(line)}\n")
 
-        prices = client.load_prices()
+        prices = client.store.prices.load()
         loaded_data = [[str(i) for i in row.tolist()] for _, row in prices.iterrows()]
         assert loaded_data == data[1:]
 
         loaded_dtypes = [str(t) for t in prices.dtypes.tolist()]
-        assert loaded_dtypes == ["int64", "object", "int64", "datetime64[ns, UTC]"]
+        assert loaded_dtypes == ["int64", "category", "int64", "datetime64[ns, UTC]"]
+
+    async def test_load_prices_torn_row(self, client, lines, caplog):
+        with open(client.prices_file, "w") as f:
+            f.writelines(
+                [
+                    "author,kind,price,timestamp\n",
+                    f"{FRIEND.id},buy,94,2020-04-12 13:11:22+00:00\n",
+                    f"{FRIEND.id},sell,66",  # a crash happened while writing this row
+                ]
+            )
+
+        prices = client.store.prices.load()
+        assert len(prices) == 1
+        assert "dropping 1 torn rows from the price log" in caplog.messages
+        assert lines(client.prices_file) == [
+            "author,kind,price,timestamp\n",
+            f"{FRIEND.id},buy,94,2020-04-12 13:11:22+00:00\n",
+        ]
+
+    @pytest.mark.parametrize(
+        "torn", ["2020-05-0", "2020-05-04 10:0", "2020-05-04 10:00:00+00:0", "se"]
+    )
+    async def test_load_prices_torn_timestamp(self, client, lines, torn):
+        with open(client.prices_file, "w") as f:
+            f.writelines(
+                [
+                    "author,kind,price,timestamp\n",
+                    f"{FRIEND.id},buy,94,2020-04-12 13:11:22+00:00\n",
+                    f"{FRIEND.id},sell,66,{torn}",  # torn while writing the timestamp
+                ]
+            )
+
+        prices = client.store.prices.load()
+        assert prices.price.tolist() == [94]
+        assert lines(client.prices_file) == [
+            "author,kind,price,timestamp\n",
+            f"{FRIEND.id},buy,94,2020-04-12 13:11:22+00:00\n",
+        ]
+
+    async def test_load_prices_no_trailing_newline(self, client, channel, lines, caplog):
+        with open(client.prices_file, "w") as f:
+            f.writelines(
+                [
+                    "author,kind,price,timestamp\n",
+                    f"{FRIEND.id},buy,94,2020-04-12 13:11:22+00:00\n",
+                    f"{FRIEND.id},sell,66,2020-04-13 12:51:41.321097374+00:00",
+                ]
+            )
+
+        # the last row is complete so it's kept, and new prices go on a line of their own
+        assert client.store.prices.load().price.tolist() == [94, 66]
+        assert not [r for r in caplog.records if r.levelno >= turbot.logging.WARNING]
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 100"))
+        client.store.prices._data = None
+        assert client.store.prices.load().price.tolist() == [94, 66, 100]
+        assert len(lines(client.prices_file)) == 4
+
+    async def test_load_prices_npz_torn_journal(self, npz_client, channel, tmp_path):
+        client = npz_client
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 94"))
+        (journal,) = tmp_path.glob("prices.journal-*.csv")
+        with open(journal, "a") as f:
+            f.write(f"{FRIEND.id},sell,66,2020-05-04 10:0")
+
+        client.store.prices._data = None
+        assert client.store.prices.load().price.tolist() == [94]
+
+    async def test_snapshot_is_atomic(self, client, channel, tmp_path):
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 100"))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        await client.on_message(MockMessage(FRIEND, channel, "!oops"))
+        await client.on_message(MockMessage(FRIEND, channel, "!collect amber"))
+
+        # no temporary files are left behind and each snapshot has a manifest
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            "fossils.csv",
+            "fossils.csv.manifest",
+            "prices.csv",
+            "prices.csv.manifest",
+        ]
+
+        # prices appended after the last snapshot still verify against its checksum
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 300"))
+        client.store.prices._data = None
+        assert client.store.prices.load().price.tolist() == [100, 300]
+
+    async def test_snapshot_corrupt(self, client, channel):
+        await client.on_message(MockMessage(FRIEND, channel, "!pref nickname Friend"))
+        with open(client.users_file, "r+") as f:
+            f.truncate(10)  # something other than turbot damaged the file
+
+        client.store.users._data = None
+        with pytest.raises(turbot.CorruptSnapshotError):
+            client.store.users.load()
+
+        # without the manifest whatever is left of the file is loaded as is
+        turbot.manifest_path(client.users_file).unlink()
+        assert client.store.users.load().author.tolist() == []
+
+    async def test_snapshot_crash_between_renames(self, client, channel, monkeypatch):
+        await client.on_message(MockMessage(FRIEND, channel, "!collect amber"))
+
+        # crash after the new manifest is in place but before the new snapshot is
+        replace = turbot.os.replace
+
+        def crashing_replace(src, dst):
+            if not str(dst).endswith(".manifest"):
+                raise OSError("crashed")
+            replace(src, dst)
+
+        monkeypatch.setattr(turbot.os, "replace", crashing_replace)
+        with pytest.raises(OSError):
+            await client.on_message(MockMessage(FRIEND, channel, "!collect ammonite"))
+        monkeypatch.undo()
+
+        # the previous snapshot is still intact and verifies
+        client.store.fossils._data = None
+        assert client.store.fossils.collected(FRIEND.id) == {"amber"}
+
+    async def test_append_price_journal(self, client, channel, lines, mocker):
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        assert lines(client.prices_file) == [
+            "author,kind,price,timestamp\n",
+            f"{FRIEND.id},buy,100,{NOW}\n",
+        ]
+
+        # appending a price should never rewrite the whole prices file
+        to_csv = mocker.spy(turbot.pd.DataFrame, "to_csv")
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        await client.on_message(MockMessage(BUDDY, channel, "!sell 300"))
+        to_csv.assert_not_called()
+        assert lines(client.prices_file) == [
+            f"{FRIEND.id},sell,200,{NOW}\n",
+            f"{BUDDY.id},sell,300,{NOW}\n",
+        ]
+
+        prices = client.store.prices.load()
+        assert prices.price.tolist() == [100, 200, 300]
+        loaded_dtypes = [str(t) for t in prices.dtypes.tolist()]
+        assert loaded_dtypes == ["int64", "category", "int64", "datetime64[ns, UTC]"]
+
+        # a fresh client replays the journal from disk
+        client.store.prices._data = None
+        assert client.store.prices.load().price.tolist() == [100, 200, 300]
+
+    async def test_sqlite_prices(self, sqlite_client, channel):
+        client = sqlite_client
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 300"))
+        await client.on_message(MockMessage(BUDDY, channel, "!sell 400"))
+        await client.on_message(MockMessage(GUY, channel, "!sell 500"))
+        await client.on_message(MockMessage(FRIEND, channel, "!oops"))
+        await client.on_message(MockMessage(GUY, channel, "!clear"))
+        assert not Path(client.prices_file).exists()
+
+        rows = (
+            client.store.prices.db.connect()
+            .execute("SELECT author, kind, price FROM prices")
+            .fetchall()
+        )
+        assert rows == [
+            (FRIEND.id, "buy", 100),
+            (FRIEND.id, "sell", 200),
+            (BUDDY.id, "sell", 400),
+        ]
+
+        client.store.prices._data = None  # unload in-memory prices data
+        prices = client.store.prices.load()
+        assert prices.price.tolist() == [100, 200, 400]
+        assert prices.timestamp.tolist() == [NOW] * 3
+        loaded_dtypes = [str(t) for t in prices.dtypes.tolist()]
+        assert loaded_dtypes == ["int64", "category", "int64", "datetime64[ns, UTC]"]
+
+    async def test_sqlite_indexes(self, sqlite_client):
+        indexes = sqlite_client.store.prices.db.connect().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'prices'"
+        )
+        assert {"prices_author", "prices_author_kind_timestamp"} <= {
+            row[0] for row in indexes
+        }
+
+    async def test_sqlite_collectables(self, sqlite_client, channel):
+        client = sqlite_client
+        await client.on_message(MockMessage(FRIEND, channel, "!collect amber, ammonite"))
+        await client.on_message(MockMessage(FRIEND, channel, "!collect amber, koi"))
+        await client.on_message(MockMessage(FRIEND, channel, "!uncollect ammonite"))
+        assert not Path(client.fossils_file).exists()
+
+        rows = (
+            client.store.prices.db.connect()
+            .execute("SELECT author, name FROM fossils")
+            .fetchall()
+        )
+        assert rows == [(FRIEND.id, "amber")]
+        rows = (
+            client.store.prices.db.connect()
+            .execute("SELECT author, name FROM fish")
+            .fetchall()
+        )
+        assert rows == [(FRIEND.id, "koi")]
+
+        client.store.fossils._data = None  # unload in-memory fossils data
+        await client.on_message(MockMessage(FRIEND, channel, "!collected"))
+        assert channel.last_sent_response == (
+            f"__**1 fish donated by {FRIEND}**__\n"
+            ">>> koi\n"
+            f"__**1 fossils donated by {FRIEND}**__\n"
+            ">>> amber"
+        )
+
+    async def test_sqlite_users(self, sqlite_client, channel):
+        client = sqlite_client
+        await client.on_message(MockMessage(FRIEND, channel, "!pref hemisphere northern"))
+        await client.on_message(MockMessage(BUDDY, channel, "!pref island Kriti"))
+        assert not Path(client.users_file).exists()
+
+        client.store.users._data = None  # unload in-memory users data
+        assert client.get_user_prefs(FRIEND.id) == {"hemisphere": "northern"}
+        assert client.get_user_prefs(BUDDY.id) == {"island": "Kriti"}
+
+    async def test_sqlite_imports_csv_files(self, sqlite_client):
+        client = sqlite_client
+        with open(client.prices_file, "w") as f:
+            f.writelines(
+                [
+                    "author,kind,price,timestamp\n",
+                    f"{FRIEND.id},buy,94,2020-04-12 13:11:22+00:00\n",
+                ]
+            )
+        with open(client.art_file, "w") as f:
+            f.writelines(["author,name\n", f"{FRIEND.id},academic painting\n"])
+
+        assert client.store.prices.load().price.tolist() == [94]
+        assert client.store.art.load().name.tolist() == ["academic painting"]
+        assert client.store.users.load().empty
+
+    async def test_npz_storage(self, npz_client, channel, tmp_path):
+        client = npz_client
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        await client.on_message(MockMessage(FRIEND, channel, "!collect amber, ammonite"))
+        await client.on_message(MockMessage(FRIEND, channel, "!pref timezone UTC"))
+
+        # a fresh storage loads the same data and dtypes back from the npz snapshots
+        store = turbot.open_storage(
+            "npz",
+            prices_file=client.prices_file,
+            art_file=client.art_file,
+            fish_file=client.fish_file,
+            fossils_file=client.fossils_file,
+            users_file=client.users_file,
+        )
+        prices = store.prices.load()
+        assert prices.price.tolist() == [100, 200]
+        assert prices.timestamp.tolist() == [NOW, NOW]
+        loaded_dtypes = [str(t) for t in prices.dtypes.tolist()]
+        assert loaded_dtypes == ["int64", "category", "int64", "datetime64[ns, UTC]"]
+        assert store.fossils.collected(FRIEND.id) == {"amber", "ammonite"}
+        assert store.users.load().timezone.tolist() == ["UTC"]
+
+        # none of the csv files were written
+        assert not Path(client.prices_file).exists()
+        assert not Path(client.fossils_file).exists()
+        assert not Path(client.users_file).exists()
+
+    async def test_npz_journal(self, npz_client, channel, tmp_path):
+        client = npz_client
+        client.store.prices.journal_limit = 3
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 100"))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        assert len(open(tmp_path / "prices.journal-0.csv").readlines()) == 3
+
+        # the journal is folded into a new snapshot once it's long enough
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 300"))
+        assert not (tmp_path / "prices.journal-0.csv").exists()
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 400"))
+        assert (tmp_path / "prices.journal-1.csv").exists()
+
+        # a journal from an older generation is never replayed
+        with open(tmp_path / "prices.journal-0.csv", "w") as f:
+            f.writelines(
+                ["author,kind,price,timestamp\n", f"{FRIEND.id},sell,300,{NOW}\n"]
+            )
+        client.store.prices._data = None
+        assert client.store.prices.load().price.tolist() == [100, 200, 300, 400]
+
+        # and removing a price takes a new snapshot right away
+        await client.on_message(MockMessage(FRIEND, channel, "!oops"))
+        assert not (tmp_path / "prices.journal-1.csv").exists()
+        client.store.prices._data = None
+        assert client.store.prices.load().price.tolist() == [100, 200, 300]
+
+    async def test_npz_imports_and_exports_csv_files(self, npz_client, tmp_path):
+        client = npz_client
+        with open(client.prices_file, "w") as f:
+            f.writelines(
+                [
+                    "author,kind,price,timestamp\n",
+                    f"{FRIEND.id},buy,94,2020-04-12 13:11:22+00:00\n",
+                ]
+            )
+        with open(client.art_file, "w") as f:
+            f.writelines(["author,name\n", f"{FRIEND.id},academic painting\n"])
+
+        assert client.store.prices.load().price.tolist() == [94]
+        assert client.store.art.load().name.tolist() == ["academic painting"]
+        assert client.store.users.load().empty
+
+        client.store.prices.append_price(BUDDY.id, "sell", 300, NOW)
+        client.store.art.add_collected(BUDDY.id, ["moody painting"])
+        csv = turbot.open_storage(
+            "csv",
+            prices_file=tmp_path / "export" / "prices.csv",
+            art_file=tmp_path / "export" / "art.csv",
+            fish_file=tmp_path / "export" / "fish.csv",
+            fossils_file=tmp_path / "export" / "fossils.csv",
+            users_file=tmp_path / "export" / "users.csv",
+        )
+        (tmp_path / "export").mkdir()
+        client.store.copy_to(csv)
+        exported = turbot.pd.read_csv(tmp_path / "export" / "prices.csv")
+        assert exported.price.tolist() == [94, 300]
+        exported = turbot.pd.read_csv(tmp_path / "export" / "art.csv")
+        assert exported.name.tolist() == ["academic painting", "moody painting"]
+
+    async def test_collection_names_are_categories(self, client, channel):
+        with open(client.fossils_file, "w") as f:
+            f.writelines(
+                ["author,name\n", f"{FRIEND.id},amber\n", f"{FRIEND.id},unobtanium\n"]
+            )
+        await client.on_message(MockMessage(FRIEND, channel, "!collect ammonite"))
+        fossils = client.store.fossils.load()
+        assert str(fossils.name.dtype) == "category"
+        assert fossils.name.cat.categories.tolist() == sorted(turbot.FOSSILS_SET)
+        assert fossils.name.tolist() == ["amber", "ammonite"]
+
+    async def test_npz_bitset_collections(self, npz_client, channel, tmp_path):
+        client = npz_client
+        await client.on_message(MockMessage(FRIEND, channel, "!collect amber, ammonite"))
+        await client.on_message(MockMessage(FRIEND, channel, "!collect amber, koi"))
+        await client.on_message(MockMessage(BUDDY, channel, "!collect amber"))
+        await client.on_message(MockMessage(FRIEND, channel, "!uncollect ammonite"))
+        store = client.store.fossils
+        assert store._masks() == {
+            FRIEND.id: store.bits["amber"],
+            BUDDY.id: store.bits["amber"],
+        }
+        assert store.count(FRIEND.id) == 1
+        assert store.uncollected(FRIEND.id) == turbot.FOSSILS_SET - {"amber"}
+        assert client.store.fish.collected(FRIEND.id) == {"koi"}
+
+        # the masks are saved as words along with the catalog that numbers their bits
+        with turbot.np.load(tmp_path / "fossils.npz") as npz:
+            assert npz["authors"].tolist() == [FRIEND.id, BUDDY.id]
+            assert npz["words"].dtype == "uint64"
+            assert npz["names"].tolist() == sorted(turbot.FOSSILS_SET)
+
+        # exporting the collections gives rows of author and name
+        assert store.load().values.tolist() == [
+            [FRIEND.id, "amber"],
+            [BUDDY.id, "amber"],
+        ]
+
+    async def test_npz_bitset_catalog_changes(self, npz_client, monkeypatch):
+        client = npz_client
+        client.store.fossils.add_collected(FRIEND.id, ["amber", "trilobite"])
+        client.store.fossils.flush()
+
+        # remove an item from the catalog and add a new one that sorts before the rest
+        catalog = (turbot.FOSSILS_SET - {"amber"}) | {"aardvark"}
+        monkeypatch.setitem(turbot.COLLECTABLE_CATALOGS, "fossils", catalog)
+        store = turbot.BitsetCollectionStore("fossils", client.store.fossils.path)
+        assert store.collected(FRIEND.id) == {"trilobite"}
+
+    async def test_npz_bitset_imports_unknown_names(self, npz_client):
+        client = npz_client
+        with open(client.fossils_file, "w") as f:
+            f.writelines(
+                ["author,name\n", f"{FRIEND.id},amber\n", f"{FRIEND.id},unobtanium\n"]
+            )
+        assert client.store.fossils.collected(FRIEND.id) == {"amber"}
+
+    async def test_price_author_index(self, client, channel, mocker):
+        store = client.store.prices
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        await client.on_message(MockMessage(BUDDY, channel, "!buy 110"))
+        assert store.prices_for(FRIEND.id).price.tolist() == [100]
+
+        # once the index is built, per-user lookups don't touch the other prices
+        load = mocker.spy(store, "load")
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 300"))
+        await client.on_message(MockMessage(BUDDY, channel, "!sell 400"))
+        assert store.prices_for(FRIEND.id).price.tolist() == [100, 200, 300]
+        assert store.prices_for(BUDDY.id).price.tolist() == [110, 400]
+        assert store.prices_for(GUY.id).empty
+        assert len(load.call_args_list) == 3  # only to read prices before appending
+
+        await client.on_message(MockMessage(FRIEND, channel, "!oops"))
+        await client.on_message(MockMessage(GUY, channel, "!oops"))
+        assert store.prices_for(FRIEND.id).price.tolist() == [100, 200]
+        await client.on_message(MockMessage(BUDDY, channel, "!clear"))
+        assert store.prices_for(BUDDY.id).empty
+
+        # the index always agrees with all of the prices
+        prices = store.load()
+        assert prices.price.tolist() == [100, 200]
+        for author, yours in store._author_index().items():
+            assert yours.equals(prices[prices.author == author])
+
+    async def test_user_prefs_records(self, client, channel, mocker):
+        await client.on_message(
+            MockMessage(FRIEND, channel, "!pref timezone America/Denver")
+        )
+        await client.on_message(MockMessage(FRIEND, channel, "!pref island Kriti"))
+        prefs = client.store.users.prefs_for(FRIEND.id)
+        assert prefs.island == "Kriti"
+        assert client.store.users.prefs_for(BUDDY.id) is None
+        assert client.get_user_prefs(FRIEND.id) == {
+            "timezone": pytz.timezone("America/Denver"),
+            "island": "Kriti",
+        }
+
+        # the timezone is resolved once and kept until it's changed
+        denver = pytz.timezone("America/Denver")
+        timezone = mocker.spy(turbot.pytz, "timezone")
+        for _ in range(3):
+            client.to_usertime(FRIEND.id, NOW)
+        assert client.get_user_timezone(FRIEND.id) == denver
+        timezone.assert_not_called()
+        await client.on_message(MockMessage(FRIEND, channel, "!pref timezone UTC"))
+        assert client.get_user_timezone(FRIEND.id) == pytz.timezone("UTC")
+        assert client.get_user_timezone(BUDDY.id) == pytz.UTC
+        assert prefs is client.store.users.prefs_for(FRIEND.id)  # updated in place
+
+    async def test_memory_storage(self):
+        store = turbot.open_storage("memory")
+        store.prices.append_price(FRIEND.id, "buy", 100, NOW)
+        store.prices.append_price(FRIEND.id, "sell", 200, NOW + timedelta(hours=1))
+        store.prices.append_price(BUDDY.id, "sell", 300, NOW + timedelta(hours=2))
+        store.prices.append_price(FRIEND.id, "sell", 400, NOW + timedelta(hours=3))
+        assert store.prices.prices_for(FRIEND.id).price.tolist() == [100, 200, 400]
+        since = NOW + timedelta(minutes=30)
+        assert store.prices.prices_for(FRIEND.id, since).price.tolist() == [200, 400]
+
+        store.prices.drop_last_price(FRIEND.id)
+        assert store.prices.prices_for(FRIEND.id).price.tolist() == [100, 200]
+        store.prices.clear_prices(FRIEND.id)
+        assert store.prices.load().price.tolist() == [300]
+
+        store.users.set_pref(FRIEND.id, "island", "Kriti")
+        store.users.set_pref(FRIEND.id, "fruit", "pear")
+        store.users.set_pref(BUDDY.id, "fruit", "apple")
+        assert store.users.load().to_dict(orient="records") == [
+            {**{pref: "" for pref in turbot.USER_PREFRENCES}, **row}
+            for row in [
+                {"author": FRIEND.id, "island": "Kriti", "fruit": "pear"},
+                {"author": BUDDY.id, "fruit": "apple"},
+            ]
+        ]
+
+        assert store.fossils.add_collected(FRIEND.id, {"amber", "ammonite"}) == {
+            "amber",
+            "ammonite",
+        }
+        assert store.fossils.add_collected(FRIEND.id, {"amber", "dunkleosteus"}) == {
+            "dunkleosteus"
+        }
+        assert store.fossils.remove_collected(FRIEND.id, {"amber", "ankylo skull"}) == {
+            "amber"
+        }
+        assert store.fossils.collected(FRIEND.id) == {"ammonite", "dunkleosteus"}
+        assert store.fossils.collected(BUDDY.id) == set()
+        assert store.collection("fossils") is store.fossils
+
+    async def test_open_storage_unknown_engine(self):
+        with pytest.raises(ValueError):
+            turbot.open_storage("parchment")
+
+    async def test_sqlite_prices_for(self, sqlite_client, channel, freezer):
+        client = sqlite_client
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        freezer.move_to(NOW + timedelta(hours=2))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        await client.on_message(MockMessage(BUDDY, channel, "!sell 300"))
+
+        prices = client.store.prices.prices_for(FRIEND.id, NOW + timedelta(hours=1))
+        assert prices.price.tolist() == [200]
+        loaded_dtypes = [str(t) for t in prices.dtypes.tolist()]
+        assert loaded_dtypes == ["int64", "category", "int64", "datetime64[ns, UTC]"]
+
+    async def test_write_behind(self, client, channel, lines):
+        client.store.set_write_behind(True)
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        await client.on_message(MockMessage(FRIEND, channel, "!collect amber, ammonite"))
+        await client.on_message(
+            MockMessage(FRIEND, channel, "!pref timezone America/Denver")
+        )
+        assert client.store.pending == 4
+        assert not Path(client.prices_file).exists()
+        assert not Path(client.fossils_file).exists()
+        assert not Path(client.users_file).exists()
+
+        # buffered changes are still visible to commands
+        await client.on_message(MockMessage(FRIEND, channel, "!history"))
+        assert "for 100 bells" in channel.last_sent_response
+        assert "for 200 bells" in channel.last_sent_response
+
+        # all the buffered prices are written out together
+        client.store.flush()
+        assert client.store.pending == 0
+        assert lines(client.prices_file) == [
+            "author,kind,price,timestamp\n",
+            f"{FRIEND.id},buy,100,{NOW}\n",
+            f"{FRIEND.id},sell,200,{NOW}\n",
+        ]
+        assert set(turbot.pd.read_csv(client.fossils_file).name) == {"amber", "ammonite"}
+        assert turbot.pd.read_csv(client.users_file).timezone.tolist() == [
+            "America/Denver"
+        ]
+
+    async def test_write_behind_flush_threshold(self, client, channel, lines):
+        client.store.set_write_behind(True)
+        client.flush_threshold = 3
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 100"))
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        assert not Path(client.prices_file).exists()
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 300"))
+        assert client.store.pending == 0
+        assert len(lines(client.prices_file)) == 4
+
+    async def test_write_behind_flush_on_reset(self, client, channel, lines, lastweek):
+        client.store.set_write_behind(True)
+        await client.on_message(MockMessage(FRIEND, channel, "!buy 100"))
+        await client.on_message(MockMessage(BUDDY, channel, "!sell 200"))
+        await client.on_message(MockMessage(someturbotadmin(), channel, "!reset"))
+        assert client.store.pending == 0
+        assert lines(client.prices_file) == [
+            "author,kind,price,timestamp\n",
+            f"{FRIEND.id},buy,100,{NOW}\n",
+        ]
+
+    async def test_write_behind_flush_on_close(self, client, channel, lines):
+        client.store.set_write_behind(True)
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 100"))
+        await client.close()
+        assert lines(client.prices_file) == [
+            "author,kind,price,timestamp\n",
+            f"{FRIEND.id},sell,100,{NOW}\n",
+        ]
+
+    async def test_close_waits_for_commands_off_the_event_loop(
+        self, client, channel, lines
+    ):
+        client.store.set_write_behind(True)
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 100"))
+        finish = threading.Event()
+        running = asyncio.ensure_future(client.run_in_worker(finish.wait))
+        threading.Timer(5, finish.set).start()  # so a blocked event loop can't hang
+
+        closing = asyncio.ensure_future(client.close())
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert not closing.done()  # the event loop is still free to run while it waits
+
+        # commands sent while closing are ignored rather than failing to be scheduled
+        sent = channel.sent.call_count
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 200"))
+        assert channel.sent.call_count == sent
+
+        finish.set()
+        await closing
+        assert running.done()
+        assert lines(client.prices_file) == [
+            "author,kind,price,timestamp\n",
+            f"{FRIEND.id},sell,100,{NOW}\n",
+        ]
+
+    async def test_flush_periodically(self, client, channel, lines, monkeypatch):
+        client = turbot.Turbot(
+            token=CLIENT_TOKEN,
+            channels=[AUTHORIZED_CHANNEL],
+            prices_file=client.prices_file,
+            art_file=client.art_file,
+            fish_file=client.fish_file,
+            fossils_file=client.fossils_file,
+            users_file=client.users_file,
+            flush_interval=60,
+        )
+        slept = []
+
+        async def sleep(delay):
+            if slept:
+                raise asyncio.CancelledError()
+            slept.append(delay)
+
+        monkeypatch.setattr(turbot.asyncio, "sleep", sleep)
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 100"))
+        assert not Path(client.prices_file).exists()
+        with pytest.raises(asyncio.CancelledError):
+            await client.flush_periodically()
+        assert slept == [60]
+        assert lines(client.prices_file) == [
+            "author,kind,price,timestamp\n",
+            f"{FRIEND.id},sell,100,{NOW}\n",
+        ]
+
+    async def test_flush_periodically_survives_errors(self, client, monkeypatch):
+        flushes = []
+        slept = []
+
+        def flush():
+            flushes.append(True)
+            if len(flushes) == 1:
+                raise OSError("disk full")
+
+        async def sleep(delay):
+            if len(slept) == 2:
+                raise asyncio.CancelledError()
+            slept.append(delay)
+
+        monkeypatch.setattr(client.store, "flush", flush)
+        monkeypatch.setattr(turbot.asyncio, "sleep", sleep)
+        with pytest.raises(asyncio.CancelledError):
+            await client.flush_periodically()
+        assert len(flushes) == 2
+
+    async def test_retain_periodically_survives_errors(self, client, monkeypatch):
+        retained = []
+
+        def apply_retention():
+            retained.append(True)
+            if len(retained) == 1:
+                raise OSError("disk full")
+
+        async def sleep(delay):
+            if len(retained) == 2:
+                raise asyncio.CancelledError()
+
+        monkeypatch.setattr(client, "apply_retention", apply_retention)
+        monkeypatch.setattr(turbot.asyncio, "sleep", sleep)
+        with pytest.raises(asyncio.CancelledError):
+            await client.retain_periodically()
+        assert len(retained) == 2
+
+    async def test_commands_run_in_workers(self, client, channel, monkeypatch):
+        started = turbot.threading.Event()
+        finish = turbot.threading.Event()
+
+        def slow(channel, author, params):
+            started.set()
+            finish.wait(timeout=5)
+            return "done", None
+
+        # other commands are processed while a slow command is still running
+        monkeypatch.setattr(client, "graph", slow)
+        slow_task = asyncio.ensure_future(
+            client.on_message(MockMessage(FRIEND, channel, "!graph"))
+        )
+        await client.run_in_worker(started.wait, 5)
+        await client.on_message(MockMessage(BUDDY, channel, "!sell 100"))
+        assert channel.all_sent_responses == [
+            f"Logged selling price of 100 for user {BUDDY}."
+        ]
+        finish.set()
+        await slow_task
+        assert channel.last_sent_response == "done"
+
+    async def test_store_methods_hold_lock(self, tmp_path):
+        store = turbot.open_storage("csv", prices_file=tmp_path / "prices.csv").prices
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            with store.lock:
+                appended = executor.submit(
+                    store.append_price, FRIEND.id, "sell", 100, NOW
+                )
+                with pytest.raises(futures.TimeoutError):
+                    appended.result(timeout=0.1)
+            appended.result(timeout=5)
+        assert store.load().price.tolist() == [100]
+
+    async def test_sqlite_group_commit(self, sqlite_client, channel, tmp_path):
+        client = sqlite_client
+        client.store.prices.load()  # make sure the database exists
+        client.store.set_write_behind(True)
+        await client.on_message(MockMessage(FRIEND, channel, "!sell 100"))
+        await client.on_message(MockMessage(FRIEND, channel, "!collect amber"))
+        await client.on_message(MockMessage(FRIEND, channel, "!pref nickname Friend"))
+
+        # nothing is committed until the buffered changes are flushed together
+        connection = sqlite3.connect(str(tmp_path / "turbot.db"))
+        assert connection.execute("SELECT * FROM prices").fetchall() == []
+        client.store.flush()
+        rows = connection.execute("SELECT author, price FROM prices").fetchall()
+        assert rows == [(FRIEND.id, 100)]
+        rows = connection.execute("SELECT author, name FROM fossils").fetchall()
+        assert rows == [(FRIEND.id, "amber")]
+        rows = connection.execute("SELECT author, nickname FROM users").fetchall()
+        assert rows == [(FRIEND.id, "Friend")]
 
     async def test_on_message_bug_no_hemisphere(self, client, channel):
         await client.on_message(MockMessage(someone(), channel, "!bugs"))
@@ -2173,7 +3382,7 @@ class TestTurbot:
         }
 
         # unload in-memory users data
-        client._users_data = None
+        client.store.users._data = None
 
         assert client.get_user_prefs(author.id) == {
             "friend": "111122223333",
@@ -2783,39 +3992,300 @@ class TestFigures:
                 ]
             )
 
+    def test_get_historical_series(self, client, channel):
+        self.set_bogus_prices(client)
+        (
+            (friend, friend_dates, friend_prices),
+            (dude, dude_dates, dude_prices),
+        ) = client._get_historical_series(channel)
+        assert (friend, dude) == (str(FRIEND), str(DUDE))
+        assert list(friend_dates) == [turbot.np.datetime64("2020-04-06T09:00", "ns")]
+        assert friend_prices.tolist() == [112]
+        assert len(dude_dates) == len(dude_prices) == 0
+
+    def test_get_historical_series_modes(self, client, channel):
+        for hours, price in enumerate([100, 300, 200, 50, 400, 100, 120]):
+            at = NOW + timedelta(hours=hours)
+            client.store.prices.append_price(FRIEND.id, "sell", price, at)
+        client.store.prices.append_price(BUDDY.id, "sell", 500, NOW)
+        client.store.prices.append_price(GUY.id, "sell", 90, NOW)
+
+        top = client._get_historical_series(channel, top=2)
+        assert [name for name, _, _ in top] == [str(BUDDY), str(FRIEND)]
+
+        # the sampled series keeps the ends and the peaks in between
+        sampled = dict(
+            (name, prices.tolist())
+            for name, _, prices in client._get_historical_series(channel, points=4)
+        )
+        assert sampled[str(FRIEND)] == [100, 300, 400, 120]
+        assert sampled[str(BUDDY)] == [500]
+
+    def test_get_historical_series_sample_out_of_order(self, client, channel):
+        # prices in the log are not always in the order they were logged at
+        logged = list(enumerate([100, 300, 200, 50, 400, 100, 120]))
+        for hours, price in reversed(logged):
+            at = NOW + timedelta(hours=hours)
+            client.store.prices.append_price(FRIEND.id, "sell", price, at)
+
+        ((_, dates, prices),) = client._get_historical_series(channel, points=4)
+        assert prices.tolist() == [100, 300, 400, 120]
+        assert (dates[1:] > dates[:-1]).all()
+
+    def test_lttb(self):
+        x = turbot.np.arange(1000, dtype=float)
+        y = turbot.np.sin(x / 50)
+        keep = turbot.lttb(x, y, 100)
+        assert len(keep) == 100
+        assert keep[0] == 0 and keep[-1] == 999
+        assert (turbot.np.diff(keep) > 0).all()
+        assert turbot.lttb(x[:10], y[:10], 100).tolist() == list(range(10))
+
     def test_get_graph_predictive_bad_user(self, client, channel):
         self.set_example_prices(client)
-        client.get_graph(channel, PUNK, turbot.GRAPHCMD_FILE)
-        assert not Path(turbot.GRAPHCMD_FILE).exists()
+        assert client.get_graph(channel, PUNK) is None
 
     def test_get_graph_historical_no_users(self, client, channel):
-        client.get_graph(channel, None, turbot.GRAPHCMD_FILE)
-        assert not Path(turbot.GRAPHCMD_FILE).exists()
+        assert client.get_graph(channel, None) is None
 
     def test_get_graph_predictive_no_data(self, client, channel):
-        client.get_graph(channel, FRIEND, turbot.GRAPHCMD_FILE)
-        assert not Path(turbot.GRAPHCMD_FILE).exists()
+        assert client.get_graph(channel, FRIEND) is None
 
     @pytest.mark.mpl_image_compare
     def test_get_graph_historical_with_bogus_data(self, client, channel):
         self.set_bogus_prices(client)
-        client.get_graph(channel, None, turbot.GRAPHCMD_FILE)
-        return client.get_graph(channel, None, turbot.GRAPHCMD_FILE)
+        client.get_graph(channel, None)
+        return client.get_graph(channel, None)
 
     @pytest.mark.mpl_image_compare
     def test_get_graph_historical(self, client, channel):
         self.set_example_prices(client)
-        return client.get_graph(channel, None, turbot.GRAPHCMD_FILE)
+        return client.get_graph(channel, None)
 
     @pytest.mark.mpl_image_compare
     def test_get_graph_predictive_friend(self, client, channel):
         self.set_example_prices(client)
-        return client.get_graph(channel, FRIEND, turbot.GRAPHCMD_FILE)
+        return client.get_graph(channel, FRIEND)
 
     @pytest.mark.mpl_image_compare
     def test_get_graph_predictive_dude(self, client, channel):
         self.set_example_prices(client)
-        return client.get_graph(channel, DUDE, turbot.GRAPHCMD_FILE)
+        return client.get_graph(channel, DUDE)
+
+    def test_graph_renderer(self):
+        island = {"initial_week": False, "timeline": {"Sunday_AM": 100, "Monday_AM": 90}}
+        prediction = turbot.predict(island)
+        inline = turbot.GraphRenderer(workers=0)
+        pooled = turbot.GraphRenderer(workers=1)
+        try:
+            png = pooled.render("predictive", "friend", prediction)
+            assert png.startswith(b"\x89PNG")
+            assert png == inline.render("predictive", "friend", prediction)
+            assert pooled.render("predictive", "friend", None) is None
+        finally:
+            pooled.shutdown()
+
+    def test_graph_renderer_starts_every_worker(self):
+        before = set(multiprocessing.active_children())
+        renderer = turbot.GraphRenderer(workers=3)
+        try:
+            renderer.start()
+            assert len(set(multiprocessing.active_children()) - before) == 3
+        finally:
+            renderer.shutdown()
+
+    def test_graph_renderer_survives_a_dead_worker(self):
+        island = {"initial_week": False, "timeline": {"Sunday_AM": 100, "Monday_AM": 90}}
+        prediction = turbot.predict(island)
+        before = set(multiprocessing.active_children())
+        renderer = turbot.GraphRenderer(workers=1)
+        try:
+            renderer.start()
+            (worker,) = set(multiprocessing.active_children()) - before
+            worker.kill()
+            worker.join()
+            png = renderer.render("predictive", "friend", prediction)
+            assert png.startswith(b"\x89PNG")
+            assert renderer.rendering == 0
+        finally:
+            renderer.shutdown()
+
+    def test_graph_renderer_saturated(self, monkeypatch):
+        assert not turbot.GraphRenderer(workers=0).saturated()
+        renderer = turbot.GraphRenderer(workers=2)
+        assert not renderer.saturated()
+        renderer.rendering = 2
+        assert renderer.saturated()
+
+    def test_prediction_cache(self, monkeypatch, tmp_path):
+        island = {"initial_week": False, "timeline": {"Sunday_AM": 100, "Monday_AM": 90}}
+        other = {"initial_week": False, "timeline": {"Sunday_AM": 100}}
+        predictions = []
+
+        def predict_islands(islands):
+            predictions.extend(islands)
+            return original(islands)
+
+        expected = turbot.predict(island)
+        expected_other = turbot.predict(other)
+        original = turbot.predict_islands
+        monkeypatch.setattr(turbot, "predict_islands", predict_islands)
+        cache = turbot.PredictionCache(max_entries=1, path=tmp_path)
+        assert cache.predict(island).low.tolist() == expected.low.tolist()
+        assert cache.predict(dict(island)) is cache.predict(island)
+        assert predictions == [island]
+
+        # predictions evicted from memory or made before a restart are read from disk
+        cache.predict(other)
+        assert len(list(tmp_path.glob("*.npz"))) == 1
+        cache.predict(other)
+        restored = turbot.PredictionCache(path=tmp_path).predict(other)
+        assert predictions == [island, other]
+        assert restored.buy == 100
+        assert restored.previous_week == "unknown"
+        assert restored.odds() == expected_other.odds()
+        assert restored.table().equals(expected_other.table())
+
+    def test_prediction_cache_unreadable(self, tmp_path):
+        island = {"initial_week": False, "timeline": {"Sunday_AM": 100}}
+        cache = turbot.PredictionCache(path=tmp_path)
+        cache.predict(island)
+        (path,) = tmp_path.glob("*.npz")
+
+        # a file from a different format is a miss and is replaced
+        np.savez(path, format=1, models=np.zeros(3))
+        key = json.dumps(island, sort_keys=True)
+        assert turbot.PredictionCache(path=tmp_path)._read(key) is None
+        assert not path.exists()
+        prediction = turbot.PredictionCache(path=tmp_path).predict(island)
+        assert len(prediction) == len(turbot.predict(island))
+        assert turbot.PredictionCache(path=tmp_path)._read(key).buy == 100
+
+        # as is a corrupt one
+        path.write_bytes(b"not a prediction")
+        assert turbot.PredictionCache(path=tmp_path)._read(key) is None
+        assert not path.exists()
+
+        # files in older formats are evicted first
+        stale = tmp_path / "old.pickle"
+        stale.write_bytes(b"pickled")
+        utime(stale, (0, 0))
+        turbot.PredictionCache(max_entries=1, path=tmp_path).predict(island)
+        assert not stale.exists()
+
+    @pytest.mark.parametrize(
+        "initial_week, timeline",
+        [
+            (False, {"Sunday_AM": 98}),
+            (False, {"Sunday_AM": 100, "Monday_AM": 90}),
+            (False, {"Sunday_AM": 103, "Monday_AM": 112, "Tuesday_PM": 95}),
+            (False, {"Sunday_AM": 90, "Monday_AM": 80, "Tuesday_AM": 125}),
+            (False, {"Sunday_AM": 95, "Tuesday_AM": 130, "Tuesday_PM": 220}),
+            (False, {"Sunday_AM": 110, "Wednesday_AM": 150, "Wednesday_PM": 250}),
+            (False, {"Sunday_AM": 100, "Thursday_AM": 90, "Thursday_PM": 80}),
+            (False, {"Sunday_AM": 100, "Monday_AM": 500}),
+            (True, {"Sunday_AM": 94, "Monday_PM": 58}),
+            (True, {"Sunday_AM": 105, "Monday_AM": 95, "Monday_PM": 120}),
+        ],
+    )
+    def test_predict_matches_turnips(self, initial_week, timeline):
+        island = {"initial_week": initial_week, "timeline": timeline}
+        arch = Archipelago.load_json(json.dumps({"islands": {"island": island}}))
+        expected = [
+            (
+                model.model_type.name,
+                [price.lower for price in (mod.price for mod in model.timeline.values())],
+                [price.upper for price in (mod.price for mod in model.timeline.values())],
+            )
+            for model in next(arch.islands).model_group.models
+        ]
+
+        prediction = turbot.predict(island)
+        assert [
+            (turbot.PATTERNS[pattern], low.tolist(), high.tolist())
+            for pattern, low, high in zip(
+                prediction.patterns, prediction.low, prediction.high
+            )
+        ] == expected
+
+    def test_predict_islands(self):
+        islands = [
+            {"timeline": {"Sunday_AM": 100, "Monday_AM": 90}},
+            {"timeline": {}},
+            {"initial_week": True, "timeline": {"Sunday_AM": 105, "Monday_AM": 95}},
+            {"timeline": {"Sunday_AM": 100, "Monday_AM": 500}},
+        ]
+        predictions = turbot.predict_islands(islands)
+        assert predictions[1] is None
+        for island, prediction in zip(islands, predictions):
+            if prediction is not None:
+                alone = turbot.predict(island)
+                assert prediction.patterns.tolist() == alone.patterns.tolist()
+                assert prediction.low.tolist() == alone.low.tolist()
+                assert prediction.high.tolist() == alone.high.tolist()
+        assert len(predictions[3]) == 0
+
+    def test_prediction_spike(self):
+        timeline = {"Sunday_AM": 95, "Monday_AM": 85, "Monday_PM": 80, "Tuesday_AM": 76}
+        prediction = turbot.predict({"timeline": {**timeline, "Tuesday_PM": 120}})
+        chance, period = prediction.spike()
+        assert chance == prediction.odds()["spike"]
+        assert period == "Wednesday_PM"
+
+        prediction = turbot.predict({"initial_week": True, "timeline": timeline})
+        assert prediction.spike() == (0, None)
+
+    def test_prediction_table(self):
+        timeline = {"Sunday_AM": 95, "Monday_AM": 85, "Monday_PM": 80, "Tuesday_AM": 76}
+        prediction = turbot.predict({"timeline": {**timeline, "Tuesday_PM": 120}})
+        assert prediction.priors() == {"spike": 0.5, "bump": 0.5}
+        assert prediction.odds()["spike"] > prediction.odds()["bump"]
+        table = prediction.table()
+        assert list(table.index) == turbot.SELLING_PERIODS
+        assert table.loc["Monday_AM"].tolist() == [85, 85, 85, 0]
+        wednesday_pm = table.loc["Wednesday_PM"]
+        assert (wednesday_pm.low, wednesday_pm.high, wednesday_pm.chance) == (132, 570, 1)
+        assert 132 < wednesday_pm.expected < 570
+        assert 0 < table.loc["Wednesday_AM"].chance < 1
+
+        prediction = turbot.predict({"timeline": {"Sunday_AM": 100, "Monday_AM": 500}})
+        assert len(prediction) == 0
+        assert prediction.table().isna().all().all()
+
+    def test_graph_cache(self):
+        cache = turbot.GraphCache(max_bytes=10)
+        cache.put("a", b"aaaa")
+        cache.put("b", b"bbbb")
+        assert cache.get("a") == b"aaaa"
+
+        # the least recently used graphs are evicted to make room
+        cache.put("c", b"cccc")
+        assert cache.get("b") is None
+        assert cache.get("a") == b"aaaa"
+        assert cache.size == 8
+
+        # graphs that are too big to ever fit are not cached at all
+        cache.put("d", b"d" * 11)
+        assert cache.get("d") is None
+        assert cache.get_or_render("d", lambda: b"dd") == b"dd"
+        assert cache.get_or_render("d", lambda: b"xx") == b"dd"
+        assert cache.size == 10
+
+    def test_generate_graph_is_cached(self, client, channel, mocker, monkeypatch):
+        render = mocker.Mock(return_value=b"graph")
+        monkeypatch.setattr(client.renderer, "render", render)
+        client.store.prices.append_price(FRIEND.id, "sell", 100, NOW)
+        assert client.generate_graph(channel, None) == b"graph"
+        assert client.generate_graph(channel, None) == b"graph"
+        assert render.call_count == 1
+
+        # new prices or members with new names make for a different graph
+        client.store.prices.append_price(FRIEND.id, "sell", 200, NOW)
+        client.generate_graph(channel, None)
+        assert render.call_count == 2
+        monkeypatch.setattr(channel, "members", channel.members[1:])
+        client.generate_graph(channel, None)
+        assert render.call_count == 3
 
 
 class TestCodebase: